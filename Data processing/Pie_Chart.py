@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
 from datetime import datetime
+import time
 import urllib.request
+import numpy as np
 import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib import font_manager
 from openpyxl.drawing.image import Image as XLImage
 import sys
+from excel_reader import open_workbook, read_sheet_head, extract_table
+from excel_sanitize import is_text_dtype
 
 # =========================
 # 基準路徑：支援 .py 與 PyInstaller EXE
@@ -102,6 +106,12 @@ _VALUE_ALIASES = {
 NORM_CATEGORY_KEYS = {_normalize_name(c) for c in _CATEGORY_ALIASES}
 NORM_VALUE_KEYS = {_normalize_name(c) for c in _VALUE_ALIASES}
 
+_NAME_STRIP_RE = r"[ _\-()（）\[\]【】:：]"
+
+def _normalize_names(s: pd.Series) -> pd.Series:
+    """_normalize_name 的向量化版本（整欄一次處理）"""
+    return s.str.strip().str.lower().str.replace(_NAME_STRIP_RE, "", regex=True)
+
 def try_standardize_columns(df: pd.DataFrame):
     norm_cols = {_normalize_name(c): c for c in df.columns}
 
@@ -128,54 +138,16 @@ def try_standardize_columns(df: pd.DataFrame):
 # =========================
 # 從 sheet 中找出真正的表頭列
 # =========================
-def extract_table_from_sheet(df_raw: pd.DataFrame) -> pd.DataFrame | None:
+def extract_table_from_sheet(xls, sheet, df_head: pd.DataFrame) -> pd.DataFrame | None:
     """
-    df_raw 是 header=None 讀進來的整張工作表
-    會掃每一列，找出包含「付款條件」/「金額」欄名的那一列當 header
+    df_head 是 header=None 讀進來的工作表前幾列
+    找出第一個包含「付款條件」/「金額」欄名的列當 header（前幾列找不到才整張找）
     """
-    header_row = None
-    nrows = len(df_raw)
-
-    for i in range(nrows):
-        row = df_raw.iloc[i]
-        hit_cat = False
-        hit_val = False
-        for v in row:
-            if pd.isna(v):
-                continue
-            key = _normalize_name(v)
-            if key in NORM_CATEGORY_KEYS:
-                hit_cat = True
-            if key in NORM_VALUE_KEYS:
-                hit_val = True
-        if hit_cat or hit_val:
-            header_row = i
-            break
-
-    if header_row is None:
-        return None
-
-    header = df_raw.iloc[header_row]
-    df = df_raw.iloc[header_row + 1 :].copy()
-    df.columns = header
-
-    # 刪掉完全空白列
-    df = df.dropna(how="all")
-
-    # 刪掉完全是 Unnamed 且全空的欄
-    mask_keep = []
-    for col in df.columns:
-        col_str = str(col)
-        if col_str.startswith("Unnamed"):
-            if df[col].notna().any():
-                mask_keep.append(True)
-            else:
-                mask_keep.append(False)
-        else:
-            mask_keep.append(True)
-    df = df.loc[:, mask_keep]
-
-    return df
+    return extract_table(
+        xls, sheet, df_head,
+        NORM_CATEGORY_KEYS | NORM_VALUE_KEYS,
+        normalize=_normalize_names,
+    )
 
 # =========================
 # 讀取最新 Excel（含 .xlsb）
@@ -186,10 +158,6 @@ def _collect_excel_files(folder: Path):
         files += list(folder.rglob(ext))
     return [f for f in files if not f.name.startswith("~$")]
 
-def _read_one_excel_file(f: Path) -> dict:
-    # header=None：讓我們自己找哪一列是欄名
-    return pd.read_excel(f, sheet_name=None, header=None)
-
 def read_latest_excel_in_dir(folder: Path) -> pd.DataFrame | None:
     files = _collect_excel_files(folder)
     if not files:
@@ -201,79 +169,93 @@ def read_latest_excel_in_dir(folder: Path) -> pd.DataFrame | None:
     print(f"使用最新檔：{latest.relative_to(folder).as_posix()}")
 
     frames = []
-    xls = _read_one_excel_file(latest)
-    for sheet, df_raw in (xls or {}).items():
-        if df_raw is None or df_raw.empty:
-            continue
-
-        df = extract_table_from_sheet(df_raw)
-        if df is None or df.empty:
-            print(f"[SKIP] {latest.name}::{sheet} 找不到欄位列，已略過。")
-            continue
+    # header=None 先讀前幾列：讓我們自己找哪一列是欄名
+    with open_workbook(latest) as xls:
+        for sheet in xls.sheet_names:
+            df_head = read_sheet_head(xls, sheet)
+            if df_head.empty:
+                continue
 
-        std = try_standardize_columns(df)
-        if std is None:
-            print(f"[SKIP] {latest.name}::{sheet} 欄位不符，已略過。")
-            continue
+            df = extract_table_from_sheet(xls, sheet, df_head)
+            if df is None or df.empty:
+                print(f"[SKIP] {latest.name}::{sheet} 找不到欄位列，已略過。")
+                continue
 
-        std["__source_file"] = latest.name
-        std["__sheet"] = str(sheet)
-        frames.append(std)
+            std = try_standardize_columns(df)
+            if std is None:
+                print(f"[SKIP] {latest.name}::{sheet} 欄位不符，已略過。")
+                continue
 
-    if not frames:
-        first_sheet, first_df = next(iter(xls.items()))
-        print("==== 欄位對不到，請檢查這份檔案的欄位名稱 ====")
-        print(f"檔案：{latest}")
-        print(f"工作表：{first_sheet}")
-        print("欄位清單：", list(first_df.iloc[0]))
-        print("=======================================")
-        # 這種屬於資料問題，維持 raise，讓你知道這個檔案有問題
-        raise RuntimeError(f"{latest} 無任何符合欄位的工作表。")
+            std["__source_file"] = latest.name
+            std["__sheet"] = str(sheet)
+            frames.append(std)
+
+        if not frames:
+            first_sheet = xls.sheet_names[0]
+            first_head = read_sheet_head(xls, first_sheet, nrows=1)
+            print("==== 欄位對不到，請檢查這份檔案的欄位名稱 ====")
+            print(f"檔案：{latest}")
+            print(f"工作表：{first_sheet}")
+            print("欄位清單：", list(first_head.iloc[0]) if not first_head.empty else [])
+            print("=======================================")
+            # 這種屬於資料問題，維持 raise，讓你知道這個檔案有問題
+            raise RuntimeError(f"{latest} 無任何符合欄位的工作表。")
 
     return pd.concat(frames, ignore_index=True)
 
 # =========================
 # 前處理與彙總
 # =========================
+SUBTOTAL_PREFIX = "小結"
+BLANK_TEXTS = ("", "nan", "nat")
+
+def _subtotal_mask(df: pd.DataFrame) -> pd.Series:
+    """任一格（去頭空白後）以「小結」開頭的列；只掃文字欄，category 欄只掃類別值"""
+    mask = np.zeros(len(df), dtype=bool)
+    for i in range(df.shape[1]):
+        s = df.iloc[:, i]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            hit = s.cat.categories.astype(str).str.lstrip().str.startswith(SUBTOTAL_PREFIX)
+            codes = s.cat.codes.to_numpy()
+            mask |= np.where(codes >= 0, np.asarray(hit, dtype=bool)[codes], False)
+        elif is_text_dtype(s):
+            try:
+                hit = s.str.lstrip().str.startswith(SUBTOTAL_PREFIX, na=False)
+            except AttributeError:
+                continue   # 整欄都不是字串（例如全是數字的 object 欄）
+            mask |= hit.to_numpy(dtype=bool)
+    return pd.Series(mask, index=df.index)
+
+def _blank_mask(s: pd.Series) -> pd.Series:
+    """str(值) 去空白後為空字串 / nan / nat（與逐格 str(v).strip() 判斷相同）"""
+    return s.astype(str).str.strip().str.lower().isin(BLANK_TEXTS)
+
 def aggregate(df_all: pd.DataFrame) -> pd.DataFrame:
     """
     1) 先把「含有『小結』字樣的列」略過（不要統計）
     2) 再把「單據日期 + 付款條件名稱 + 預計付款日 都空白」的列略過（如果有這些欄位）
     3) 最後把分類或金額為空白 / 非數字的列略過，做彙總
+    全部以整欄向量化運算：每個文字欄只掃一次，兩種略過條件合併成一個遮罩，過濾一次
     """
+    t0 = time.perf_counter()
 
-    df = df_all.copy()
-
-    # 0) 先略過「小結」列（例如某欄是 '小結:'、'小結' 等）
-    subtotal_mask = df.apply(
-        lambda row: row.astype(str)
-                    .str.strip()
-                    .str.startswith("小結")
-                    .any(),
-        axis=1,
-    )
+    # 0) 「小結」列（例如某欄是 '小結:'、'小結' 等）
+    subtotal_mask = _subtotal_mask(df_all)
     skipped_subtotal = int(subtotal_mask.sum())
     if skipped_subtotal > 0:
         print(f"[INFO] 已略過 {skipped_subtotal} 筆『小結』小計列")
 
-    df = df.loc[~subtotal_mask].copy()
-
-    # 1) 三欄都空白就略過（如果這三欄存在）
+    # 1) 三欄都空白就略過（如果這三欄存在）；不再印出略過幾筆，只做過濾
+    drop_mask = subtotal_mask
     needed_cols = ["單據日期", CATEGORY_COL, "預計付款日"]
-    if all(col in df.columns for col in needed_cols):
-
-        def _is_blank(v) -> bool:
-            s = str(v).strip()
-            return s == "" or s.lower() in ("nan", "nat")
-
-        mask_all_blank = (
-            df["單據日期"].map(_is_blank) &
-            df[CATEGORY_COL].map(_is_blank) &
-            df["預計付款日"].map(_is_blank)
-        )
+    if all(col in df_all.columns for col in needed_cols):
+        mask_all_blank = _blank_mask(df_all["單據日期"])
+        for col in needed_cols[1:]:
+            mask_all_blank &= _blank_mask(df_all[col])
+        drop_mask = drop_mask | mask_all_blank
 
-        # 不再印出略過幾筆，只做過濾
-        df = df.loc[~mask_all_blank].copy()
+    df = df_all.loc[~drop_mask]
+    t1 = time.perf_counter()
 
     # 2) 後續只看 分類 + 金額
     tmp = df[[CATEGORY_COL, VALUE_COL]].copy()
@@ -282,15 +264,16 @@ def aggregate(df_all: pd.DataFrame) -> pd.DataFrame:
     tmp[CATEGORY_COL] = tmp[CATEGORY_COL].astype(str).str.strip()
     tmp.loc[tmp[CATEGORY_COL] == "", CATEGORY_COL] = pd.NA
 
-    # 金額：去逗號 / 空白 → 轉數字
-    raw_val = (
-        tmp[VALUE_COL]
-        .astype(str)
-        .str.replace(",", "", regex=False)
-        .str.strip()
-    )
-    raw_val = raw_val.replace("", pd.NA)
-    tmp[VALUE_COL] = pd.to_numeric(raw_val, errors="coerce")
+    # 金額：已是整數 / 浮點欄就直接用（轉字串再轉回來結果相同）；否則去逗號 / 空白 → 轉數字（整欄一次）
+    if tmp[VALUE_COL].dtype.kind not in "iuf":
+        raw_val = (
+            tmp[VALUE_COL]
+            .astype(str)
+            .str.replace(",", "", regex=False)
+            .str.strip()
+        )
+        raw_val = raw_val.replace("", pd.NA)
+        tmp[VALUE_COL] = pd.to_numeric(raw_val, errors="coerce")
 
     before = len(tmp)
     tmp = tmp.dropna(subset=[CATEGORY_COL, VALUE_COL])
@@ -301,8 +284,13 @@ def aggregate(df_all: pd.DataFrame) -> pd.DataFrame:
     if tmp.empty:
         raise RuntimeError("全部資料列的『分類』或『金額』都是空白/非數字，無法繪製圓餅圖。")
 
+    t2 = time.perf_counter()
+
     agg = tmp.groupby(CATEGORY_COL, dropna=False, as_index=False)[VALUE_COL].sum()
     agg = agg.sort_values(VALUE_COL, ascending=False, ignore_index=True)
+    t3 = time.perf_counter()
+    print(f"[INFO] 彙總 {len(df_all)} 列：略過小結 / 空白列 {t1 - t0:.2f} 秒、"
+          f"分類 / 金額轉換 {t2 - t1:.2f} 秒、分組加總 {t3 - t2:.2f} 秒")
 
     if TOP_K and len(agg) > TOP_K:
         head = agg.iloc[:TOP_K].copy()
@@ -0,0 +1,97 @@
+"""
+Excel 讀取引擎效能比較
+
+用法：
+    python bench_excel_readers.py <檔案或資料夾> [...] [--engines calamine stream pandas] [--repeat 3] [--json out.json]
+
+每個檔案、每個引擎量兩種情境（取 repeat 次中位數）：
+- head ：每張工作表只讀前 HEADER_SCAN_ROWS 列（找表頭用）
+- full ：每張工作表整張讀（header=None, dtype=object）
+"""
+import os
+import json
+import glob
+import time
+import argparse
+import statistics
+from excel_reader import HEADER_SCAN_ROWS, available_engines, open_workbook
+
+EXCEL_EXTS = ("*.xlsx", "*.xlsm", "*.xls", "*.xlsb")
+
+
+def collect_files(paths):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for ext in EXCEL_EXTS:
+                files += glob.glob(os.path.join(p, "**", ext), recursive=True)
+        else:
+            files.append(p)
+    return sorted(f for f in files if not os.path.basename(f).startswith("~$"))
+
+
+def _read_all(path, engine, nrows):
+    rows = 0
+    with open_workbook(path, engine) as book:
+        for sheet in book.sheet_names:
+            rows += len(book.parse(sheet, header=None, nrows=nrows, dtype=object))
+    return rows
+
+
+def bench_file(path, engine, repeat):
+    out = {}
+    for mode, nrows in (("head", HEADER_SCAN_ROWS), ("full", None)):
+        times, rows = [], 0
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            rows = _read_all(path, engine, nrows)
+            times.append(time.perf_counter() - t0)
+        out[mode] = {"seconds": statistics.median(times), "rows": rows}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark Excel reader engines.")
+    ap.add_argument("paths", nargs="+", help="Excel files or folders (searched recursively).")
+    ap.add_argument("--engines", nargs="+", default=None, help=f"Engines to test. Default: {' '.join(available_engines())}")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per file/engine (median is reported).")
+    ap.add_argument("--json", default=None, help="Write raw results to this JSON file.")
+    args = ap.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        raise SystemExit("[Error] 找不到任何 Excel 檔")
+    engines = args.engines or available_engines()
+
+    results = []
+    for f in files:
+        size_kb = os.path.getsize(f) / 1024
+        for eng in engines:
+            try:
+                r = bench_file(f, eng, args.repeat)
+            except Exception as e:
+                print(f"[SKIP] {os.path.basename(f)} / {eng}：{e}")
+                continue
+            results.append({"file": f, "size_kb": round(size_kb, 1), "engine": eng, **r})
+            print(f"{os.path.basename(f):<40} {eng:<9} "
+                  f"head {r['head']['seconds']:8.3f}s   "
+                  f"full {r['full']['seconds']:8.3f}s ({r['full']['rows']} rows)")
+
+    # 各引擎合計
+    print("\n==== 合計（全部檔案）====")
+    for eng in engines:
+        rows = [r for r in results if r["engine"] == eng]
+        if not rows:
+            continue
+        head = sum(r["head"]["seconds"] for r in rows)
+        full = sum(r["full"]["seconds"] for r in rows)
+        print(f"{eng:<9} head {head:8.3f}s   full {full:8.3f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, ensure_ascii=False, indent=2)
+        print(f"已輸出：{args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+資料工具端到端效能測試
+
+用法：
+    python bench_tools.py [--scales 2x3x500 4x5x2000] [--root 暫存資料夾] [--json out.json] [--baseline old.json]
+
+每個規模（資料夾數 x 每資料夾檔案數 x 每張工作表列數）：
+1) make_sample_vouchers 產生測試資料到 <root>/<規模>/（預設在系統暫存資料夾，不會碰到實際資料）
+2) 把各工具 .py 複製過去（各工具都以自身所在資料夾為基準找資料）
+3) 依序量測：
+   - merge_cold / merge_warm ：merge_all_data.run_merge（清空解析快取 / 快取已建立），含各階段耗時
+   - excel_error_log         ：付款日檢查（讀最新 TOTAL）
+   - pie_chart               ：圓餅圖彙總
+   - compare                 ：TOTAL 與修改過約 1% 金額、刪掉部分列的副本比對
+結果存成 JSON；指定 --baseline 時列出與上次結果的倍數，變慢超過 REGRESSION_RATIO 標示 [SLOW]。
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+import pandas as pd
+import make_sample_vouchers
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCALES = ["2x3x500", "4x5x2000"]
+DEFAULT_ROOT = os.path.join(tempfile.gettempdir(), "voucher_bench")
+MARKER = ".voucher_bench"
+SCRIPT_FILES = ("*.py", "*.json", "*.csv")   # 複製到測試資料夾的檔案
+SHEETS = 2
+REGRESSION_RATIO = 1.2
+COMPARE_KEYS = ["憑單單號", "序號"]
+
+
+def parse_scale(text):
+    try:
+        folders, files, rows = (int(x) for x in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"規模格式應為 資料夾數x檔案數x列數，例如 4x5x2000：{text}")
+    return folders, files, rows
+
+
+def prepare_dir(path):
+    """只清掉本程式自己建立的資料夾（有 MARKER 檔），避免誤刪"""
+    if os.path.exists(path):
+        if not os.path.exists(os.path.join(path, MARKER)):
+            raise SystemExit(f"[Error] {path} 已存在且不是測試資料夾，請換一個 --root")
+        shutil.rmtree(path)
+    os.makedirs(path)
+    open(os.path.join(path, MARKER), "w").close()
+    # 程式 + 同資料夾的設定檔（pay_rules.json、holidays.csv 等）
+    for pattern in SCRIPT_FILES:
+        for src in glob.glob(os.path.join(HERE, pattern)):
+            shutil.copy2(src, path)
+
+
+def run_script(workdir, args, timeout=None):
+    env = dict(os.environ, MPLBACKEND="Agg", PYTHONIOENCODING="utf-8")
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, cwd=workdir, env=env, capture_output=True,
+                          text=True, encoding="utf-8", errors="replace", timeout=timeout)
+    seconds = time.perf_counter() - t0
+    out = {"seconds": round(seconds, 3), "returncode": proc.returncode}
+    if proc.returncode != 0:
+        out["stderr"] = proc.stderr[-2000:]
+    return out
+
+
+def make_compare_right(total_path, out_path, seed=1):
+    """TOTAL 副本：約 1% 金額 +1、刪掉約 0.5% 的列"""
+    df = pd.read_excel(total_path, sheet_name="TOTAL")
+    rng = pd.Series(range(len(df))).sample(frac=1.0, random_state=seed).to_numpy()
+    n_mod, n_drop = max(1, len(df) // 100), max(1, len(df) // 200)
+    if "本幣貨款金額" in df.columns:
+        df.loc[rng[:n_mod], "本幣貨款金額"] = df.loc[rng[:n_mod], "本幣貨款金額"] + 1
+    df = df.drop(index=rng[n_mod:n_mod + n_drop])
+    df.to_excel(out_path, index=False, sheet_name="TOTAL", engine="xlsxwriter")
+
+
+def bench_scale(root, scale, timeout):
+    folders, files, rows = scale
+    name = f"{folders}x{files}x{rows}"
+    workdir = os.path.join(root, name)
+    prepare_dir(workdir)
+    print(f"\n==== 規模 {name}（約 {folders * files * SHEETS * rows} 列）====")
+
+    t0 = time.perf_counter()
+    make_sample_vouchers.generate(workdir, folders, files, rows, SHEETS)
+    result = {"scale": name, "folders": folders, "files": folders * files, "rows_per_sheet": rows,
+              "generate_seconds": round(time.perf_counter() - t0, 3), "tools": {}}
+
+    # merge：同一個行程內呼叫，取得各階段耗時
+    import merge_all_data as merge
+    output_dir = os.path.join(workdir, "total")
+    for label in ("merge_cold", "merge_warm"):
+        if label == "merge_cold":
+            shutil.rmtree(os.path.join(output_dir, merge.CACHE_SUBDIR), ignore_errors=True)
+        t0 = time.perf_counter()
+        r = merge.run_merge(base_dir=workdir, output_dir=output_dir, use_cache=True)
+        result["tools"][label] = {
+            "seconds": round(time.perf_counter() - t0, 3),
+            "rows": len(r["total_df"]),
+            "stages": r["timings"].to_dict(orient="records"),
+        }
+    total_path = r["output_files"][0]
+    result["total_rows"] = len(r["total_df"])
+
+    result["tools"]["excel_error_log"] = run_script(workdir, ["excel_error_log.py"], timeout)
+    result["tools"]["pie_chart"] = run_script(workdir, ["Pie_Chart.py"], timeout)
+
+    right = os.path.join(workdir, "compare_right.xlsx")
+    make_compare_right(total_path, right)
+    result["tools"]["compare"] = run_script(
+        workdir,
+        ["compare.py", total_path, right, "--keys", *COMPARE_KEYS, "--output", os.path.join(workdir, "compare_report.xlsx")],
+        timeout,
+    )
+
+    for tool, r in result["tools"].items():
+        flag = "" if r.get("returncode", 0) == 0 else f"   [Error] returncode={r['returncode']}"
+        print(f"{tool:<16} {r['seconds']:8.3f}s{flag}")
+    return result
+
+
+def compare_baseline(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        base = json.load(f)
+    old = {(s["scale"], tool): r["seconds"] for s in base.get("scales", []) for tool, r in s["tools"].items()}
+    print(f"\n==== 與基準比較：{baseline_path} ====")
+    slow = 0
+    for s in results:
+        for tool, r in s["tools"].items():
+            prev = old.get((s["scale"], tool))
+            if not prev:
+                continue
+            ratio = r["seconds"] / prev
+            mark = "  [SLOW]" if ratio > REGRESSION_RATIO else ""
+            slow += bool(mark)
+            print(f"{s['scale']:<12} {tool:<16} {prev:8.3f}s → {r['seconds']:8.3f}s  x{ratio:5.2f}{mark}")
+    return slow
+
+
+def main():
+    ap = argparse.ArgumentParser(description="End-to-end benchmark of the data tools on synthetic vouchers.")
+    ap.add_argument("--scales", nargs="+", type=parse_scale, default=[parse_scale(s) for s in DEFAULT_SCALES],
+                    help=f"FOLDERSxFILESxROWS per scale. Default: {' '.join(DEFAULT_SCALES)}")
+    ap.add_argument("--root", default=DEFAULT_ROOT, help=f"Working folder for generated data. Default: {DEFAULT_ROOT}")
+    ap.add_argument("--json", default=None, help="Results file. Default: <root>/bench_<timestamp>.json")
+    ap.add_argument("--baseline", default=None, help="Previous results JSON to compare against.")
+    ap.add_argument("--timeout", type=float, default=None, help="Per-tool timeout in seconds for subprocess tools.")
+    args = ap.parse_args()
+
+    os.makedirs(args.root, exist_ok=True)
+    results = [bench_scale(args.root, scale, args.timeout) for scale in args.scales]
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "scales": results,
+    }
+    json_path = args.json or os.path.join(args.root, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n已輸出：{json_path}")
+
+    if args.baseline:
+        slow = compare_baseline(results, args.baseline)
+        if slow:
+            print(f"[Warn] {slow} 項比基準慢超過 {REGRESSION_RATIO:g} 倍")
+
+
+if __name__ == "__main__":
+    main()
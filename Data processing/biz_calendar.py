@@ -0,0 +1,120 @@
+"""
+營業日行事曆（pay_rules.py 的假日調整使用）
+
+- 國定假日 / 補班日從本機 CSV 讀取（預設 holidays.csv：日期, 類型, 說明；類型為 假日 或 補班）
+- 週六、週日預設為非營業日；補班日即使是週六也算營業日
+- 假日檔有列到的年份才算涵蓋（years）；調整的日期落在沒涵蓋的年份時提出警告（每個年份一次），
+  這些日期只能以週六、週日判斷，國定假日不會被調整
+- 對一段日期範圍預先算好每一天的「下一個營業日 / 上一個營業日」查表陣列，
+  調整時整欄日期換算成陣列索引一次查完，不逐列迴圈；範圍不夠時自動擴大重算
+
+調整方式（SHIFT_POLICIES）：
+  none                ：不調整
+  following           ：遇非營業日順延到下一個營業日
+  preceding           ：遇非營業日提前到上一個營業日
+  modified_following  ：順延，但跨月時改為提前（月底付款常用）
+  modified_preceding  ：提前，但跨月時改為順延
+"""
+import numpy as np
+import pandas as pd
+
+SHIFT_POLICIES = ("none", "following", "preceding", "modified_following", "modified_preceding")
+HOLIDAY_TYPES = {"假日": "holiday", "holiday": "holiday", "補班": "workday", "workday": "workday"}
+WEEKMASK = "1111100"        # 週一 ~ 週五上班
+RANGE_MARGIN_DAYS = 62      # 查表範圍前後多留的天數（順延 / 提前不會超出）
+
+
+class BusinessCalendar:
+    def __init__(self, holidays=(), workdays=(), weekmask=WEEKMASK):
+        self.holidays = np.unique(np.asarray(holidays, dtype="datetime64[D]"))
+        self.workdays = np.unique(np.asarray(workdays, dtype="datetime64[D]"))
+        self.weekmask = weekmask
+        self.start = self.end = None
+        self.source = None      # 從檔案載入時為假日檔路徑
+        listed = np.concatenate([self.holidays, self.workdays]).astype("datetime64[Y]").astype(np.int64) + 1970
+        self.years = set(int(y) for y in np.unique(listed))    # 假日檔涵蓋的年份
+        self._warned_years = set()
+
+    @classmethod
+    def load(cls, path, weekmask=WEEKMASK) -> "BusinessCalendar":
+        """讀取假日檔（CSV，utf-8 / utf-8-sig）；無法辨識的列列出警告後略過"""
+        raw = pd.read_csv(path, dtype=str, encoding="utf-8-sig").fillna("")
+        raw.columns = [str(c).strip() for c in raw.columns]
+        if "日期" not in raw.columns or "類型" not in raw.columns:
+            raise ValueError(f"假日檔需要「日期」「類型」兩欄：{path}")
+        dates = pd.to_datetime(raw["日期"].str.strip(), errors="coerce")
+        kinds = raw["類型"].str.strip().map(HOLIDAY_TYPES)
+        bad = dates.isna() | kinds.isna()
+        if bad.any():
+            print(f"[Warn] 假日檔 {int(bad.sum())} 列無法辨識（日期或類型錯誤），已略過：第 "
+                  + "、".join(str(i + 2) for i in np.flatnonzero(bad.to_numpy())[:10]) + " 列")
+        dates, kinds = dates[~bad].to_numpy(dtype="datetime64[D]"), kinds[~bad].to_numpy()
+        cal = cls(dates[kinds == "holiday"], dates[kinds == "workday"], weekmask)
+        cal.source = path
+        return cal
+
+    def check_years(self, dates: np.ndarray):
+        """dates（datetime64[D]，不可有 NaT）有落在假日檔沒涵蓋的年份時警告；同一年份只警告一次"""
+        if len(dates) == 0:
+            return
+        years = set(int(y) for y in np.unique(dates.astype("datetime64[Y]").astype(np.int64) + 1970))
+        missing = sorted(years - self.years - self._warned_years)
+        if missing:
+            self._warned_years.update(missing)
+            where = f"假日檔 {self.source}" if self.source else "假日檔"
+            print(f"[Warn] {where} 沒有 {'、'.join(map(str, missing))} 年的資料：這些年份只以週六、週日判斷營業日，"
+                  f"國定假日不會調整（請依人事行政總處公告補上）")
+
+    # ===== 查表 =====
+    def _build(self, start, end):
+        days = np.arange(start, end + 1, dtype="datetime64[D]")
+        is_bd = np.is_busday(days, weekmask=self.weekmask, holidays=self.holidays) | np.isin(days, self.workdays)
+        n = len(days)
+        pos = np.arange(n)
+        # 下一個營業日：從後往前取最小的營業日索引；上一個：從前往後取最大
+        self._next = np.minimum.accumulate(np.where(is_bd, pos, n)[::-1])[::-1]
+        self._prev = np.maximum.accumulate(np.where(is_bd, pos, -1))
+        self._is_bd = is_bd
+        self.start, self.end = start, end
+
+    def _ensure(self, dates: np.ndarray):
+        lo = dates.min() - RANGE_MARGIN_DAYS
+        hi = dates.max() + RANGE_MARGIN_DAYS
+        if self.start is None or lo < self.start or hi > self.end:
+            start = lo if self.start is None else min(lo, self.start)
+            end = hi if self.end is None else max(hi, self.end)
+            self._build(start, end)
+
+    def is_business_day(self, dates: np.ndarray) -> np.ndarray:
+        """dates：datetime64[D] 陣列（不可有 NaT）"""
+        if len(dates) == 0:
+            return np.zeros(0, dtype=bool)
+        self._ensure(dates)
+        return self._is_bd[(dates - self.start).astype(np.int64)]
+
+    def shift(self, dates: np.ndarray, policy: str) -> np.ndarray:
+        """依 policy 調整 datetime64[D] 陣列（NaT 原樣保留）"""
+        if policy not in SHIFT_POLICIES:
+            raise ValueError(f"未知的假日調整方式：{policy}（可用：{', '.join(SHIFT_POLICIES)}）")
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        ok = ~np.isnat(dates)
+        if policy == "none" or not ok.any():
+            return dates
+        self.check_years(dates[ok])
+        self._ensure(dates[ok])
+        idx = (dates[ok] - self.start).astype(np.int64)
+        fwd = self.start + self._next[idx]
+        back = self.start + self._prev[idx]
+        if policy == "following":
+            moved = fwd
+        elif policy == "preceding":
+            moved = back
+        else:
+            month = dates[ok].astype("datetime64[M]")
+            if policy == "modified_following":
+                moved = np.where(fwd.astype("datetime64[M]") == month, fwd, back)
+            else:
+                moved = np.where(back.astype("datetime64[M]") == month, back, fwd)
+        out = dates.copy()
+        out[ok] = moved
+        return out
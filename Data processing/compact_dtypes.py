@@ -0,0 +1,55 @@
+"""
+合併後資料表的精簡型別
+
+concat 之後每一欄都是 Python 物件欄；來源資料夾 / 檔名 / 工作表、廠商、付款條件等
+在幾十萬列裡其實只有幾百種值，改成 category 只存一份字串 + 整數代碼：
+- 低基數文字欄（不重複值 ≤ 列數 × CATEGORY_MAX_RATIO）→ category（類別依字串排序，排序結果與原本相同）
+- 金額欄 → 可為空的 Int64（全為整數時）/ Float64
+- 日期欄 → datetime64
+"""
+import pandas as pd
+
+CATEGORY_MAX_RATIO = 0.5
+CATEGORY_MIN_ROWS = 1000  # 列數太少時不轉（省不了多少，反而多一層轉換）
+
+MB = 1024 * 1024
+
+
+def frame_memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True, index=True).sum() / MB
+
+
+def to_nullable_number(s: pd.Series) -> pd.Series:
+    """數字欄轉成可為空的 Int64（沒有小數時）或 Float64"""
+    s = pd.to_numeric(s, errors="coerce")
+    vals = s.dropna()
+    if len(vals) and (vals % 1 == 0).all() and vals.abs().max() < 2 ** 53:
+        return s.astype("Int64")
+    return s.astype("Float64")
+
+
+def should_categorize(s: pd.Series, max_ratio=CATEGORY_MAX_RATIO, min_rows=CATEGORY_MIN_ROWS) -> bool:
+    if len(s) < min_rows or not pd.api.types.is_object_dtype(s.dtype):
+        return False
+    return s.nunique(dropna=True) <= len(s) * max_ratio
+
+
+def compact_frame(df: pd.DataFrame, number_cols=(), date_cols=(), max_ratio=CATEGORY_MAX_RATIO,
+                  min_rows=CATEGORY_MIN_ROWS) -> pd.DataFrame:
+    """
+    回傳精簡型別後的新 DataFrame（欄位順序、值都不變）。
+    number_cols / date_cols：指定要轉數字 / 日期的欄名；其餘物件欄依基數判斷是否轉 category。
+    以欄位位置處理，欄名重複也不會出錯。
+    """
+    out = df.copy()
+    number_cols, date_cols = set(number_cols), set(date_cols)
+    for i, col in enumerate(out.columns):
+        s = out.iloc[:, i]
+        if col in number_cols:
+            out.isetitem(i, to_nullable_number(s))
+        elif col in date_cols:
+            if not pd.api.types.is_datetime64_any_dtype(s.dtype):
+                out.isetitem(i, pd.to_datetime(s, errors="coerce"))
+        elif should_categorize(s, max_ratio, min_rows):
+            out.isetitem(i, s.astype("category"))
+    return out
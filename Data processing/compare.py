@@ -1,8 +1,17 @@
+import os
 import argparse
-from collections import Counter
-from datetime import datetime
+import multiprocessing
+from datetime import date, datetime
 import numpy as np
 import pandas as pd
+from excel_reader import ENGINES, open_workbook
+from date_parse import coerce_dates, parse_unique_dates
+from row_hash import row_fingerprint
+from compare_snapshot import SnapshotStore, is_snapshot_path, load_snapshot, row_hashes
+from excel_writer import (EXCEL_MAX_ROWS, HEADER_FORMAT, CappedSheetWriter,
+                          open_streaming_workbook, write_frame, write_table)
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compare", "_snapshots")
 
 COMMON_KEY_CANDIDATES = [
     ["憑單單", "憑單號", "憑單編號", "憑單No", "憑單NO", "單號", "單據號", "單據編號"],
@@ -10,44 +19,175 @@ COMMON_KEY_CANDIDATES = [
     ["供應商代碼", "廠商代碼", "廠商代碼(代號)", "廠商代號", "VendorCode"],
 ]
 
-def normalize_df(df: pd.DataFrame, case_insensitive=False) -> pd.DataFrame:
-    """移除 Unnamed；去空白；日期統一；文字可選忽略大小寫；NaN→''"""
+# 欄位型別：依抽樣結果每欄判斷一次，只做該型別需要的轉換
+NORMALIZE_VERSION = 1        # 正規化規則有變動時 +1，舊快照自動失效
+COLUMN_TYPES = ("date", "number", "code", "text")
+TYPE_SAMPLE_ROWS = 2000      # 每欄抽樣幾個非空白值來判斷型別
+TYPE_MIN_RATIO = 0.9         # 抽樣中至少這個比例符合才算該型別
+CODE_MAX_LEN = 30
+DATE_NAME_HINTS = ("日期", "付款日", "date")   # 欄名含這些字時，數字視為 Excel 日期序號
+EXCEL_SERIAL_RANGE = (20000, 80000)           # 約 1954 ~ 2119 年
+NUMERIC_TOLERANCE = 1e-6     # 數字欄兩邊差距 ≤ 此值視為相同
+
+# 報告：欄位差異每段 DIFF_BLOCK_ROWS 組配對產生、邊算邊寫；每張表超過 REPORT_MAX_ROWS 的部分寫到溢出檔
+DIFF_BLOCK_ROWS = 50_000
+REPORT_MAX_ROWS = EXCEL_MAX_ROWS - 1
+
+_CODE_RE = r"[A-Za-z0-9][A-Za-z0-9_\-./#]*"
+_NUMBER_RE = r"[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?"
+
+def _clean_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """移除 Unnamed 欄，欄名一律轉文字"""
     df = df.loc[:, ~df.columns.astype(str).str.startswith("Unnamed")].copy()
     df.columns = df.columns.astype(str)
+    return df
 
-    for c in df.columns:
-        s = df[c]
-
-        # 先處理真正的 datetime dtype
-        if np.issubdtype(s.dtype, np.datetime64):
-            df[c] = pd.to_datetime(s, errors="coerce").dt.strftime("%Y-%m-%d")
-            continue
-
-        # 把字串/數值解析為日期字串
-        s2 = pd.to_datetime(s, errors="coerce", format="%Y/%m/%d")
-        mask = s2.isna()
-        if mask.any():
-            s3 = pd.to_datetime(s[mask], errors="coerce", format="%Y-%m-%d")
-            s2.loc[mask] = s3
-        mask = s2.isna() & pd.to_numeric(s, errors="coerce").notna()
-        if mask.any():
-            nums = pd.to_numeric(s[mask], errors="coerce")
-            s4 = pd.to_datetime(nums, unit="D", origin="1899-12-30", errors="coerce")
-            s2.loc[mask] = s4
-
-        if s2.notna().any():
-            out = s.astype(object).copy()
-            ok = s2.notna()
-            out.loc[ok] = s2.loc[ok].dt.strftime("%Y-%m-%d")
-            s = out
-
-        if s.dtype == object:
-            s = s.fillna("").astype(str).str.strip()
-            if case_insensitive:
-                s = s.str.lower()
-
-        df[c] = s.fillna("").astype(object)
-
+def _sample_values(s: pd.Series, n=TYPE_SAMPLE_ROWS) -> pd.Series:
+    """等距抽樣的非空白值（object）"""
+    s = s.dropna()
+    if s.dtype == object:
+        s = s[s.astype(str).str.strip() != ""]
+    if len(s) > n:
+        s = s.iloc[np.linspace(0, len(s) - 1, n).astype(np.int64)]
+    return s.astype(object)
+
+def classify_column(name: str, s: pd.Series) -> str:
+    """依欄位內容判斷型別：date / number / code（代碼、編號）/ text（自由文字）"""
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return "date"
+    vals = _sample_values(s)
+    n = len(vals)
+    if n == 0:
+        return "text"
+
+    is_dt = vals.map(lambda v: isinstance(v, (datetime, date, np.datetime64))).to_numpy(dtype=bool)
+    is_num = vals.map(lambda v: isinstance(v, (int, float, np.integer, np.floating))
+                      and not isinstance(v, bool)).to_numpy(dtype=bool)
+    text = vals[~is_dt & ~is_num].astype(str).str.strip()
+    num_text = text.str.replace(",", "", regex=False).str.fullmatch(_NUMBER_RE)
+
+    digits = text[num_text]
+
+    # 日期：日期物件 + 能解析成日期的非數字字串（+ 欄名像日期時，範圍合理的 Excel 序號）
+    date_text = text[~num_text]
+    n_date = int(is_dt.sum())
+    if len(date_text):
+        n_date += int(pd.notna(parse_unique_dates(date_text.to_numpy(dtype=object))).sum())
+    if any(h in name.lower() for h in DATE_NAME_HINTS):
+        nums = pd.to_numeric(pd.concat([vals[is_num], digits.str.replace(",", "", regex=False)]), errors="coerce")
+        n_date += int(nums.between(*EXCEL_SERIAL_RANGE).sum())
+    if n_date >= n * TYPE_MIN_RATIO:
+        return "date"
+
+    n_num = int(is_num.sum()) + len(digits)
+    if n_num >= n * TYPE_MIN_RATIO:
+        # 前導 0 或超過 15 位數的數字字串是編號，轉成數字會失真
+        if digits.str.match(r"0\d").any() or (digits.str.len() > 15).any():
+            return "code"
+        return "number"
+
+    if is_dt.any() or is_num.any():
+        return "text"
+    if text.str.fullmatch(_CODE_RE).mean() >= TYPE_MIN_RATIO and text.str.len().max() <= CODE_MAX_LEN:
+        return "code"
+    return "text"
+
+def infer_column_types(dfs, overrides=None, known=None) -> dict:
+    """
+    多個 DataFrame（通常是左、右兩邊）同名欄位合併抽樣後判斷型別，回傳 {欄名: 型別}；
+    overrides（{欄名: 型別}）優先，其次是 known（例如另一邊快照已決定的型別）。
+    """
+    known = dict(known or {})
+    overrides = dict(overrides or {})
+    for c, t in overrides.items():
+        if t not in COLUMN_TYPES:
+            raise SystemExit(f"[Error] 欄位 `{c}` 的型別 `{t}` 不正確，可用：{', '.join(COLUMN_TYPES)}")
+    samples = {}
+    for df in dfs:
+        keep = ~df.columns.astype(str).str.startswith("Unnamed")
+        for c, (_, s) in zip(df.columns[keep].astype(str), df.loc[:, keep].items()):
+            samples.setdefault(c, []).append(_sample_values(s))
+    types = {}
+    for c, parts in samples.items():
+        types[c] = overrides.get(c) or known.get(c) or classify_column(c, pd.concat(parts, ignore_index=True))
+    missing = [c for c in overrides if c not in types]
+    if missing:
+        print(f"[Warn] --column-type 指定的欄位不存在：{', '.join(missing)}")
+    return types
+
+def parse_type_overrides(items) -> dict:
+    """["欄名=型別", ...] → {欄名: 型別}"""
+    out = {}
+    for item in items or []:
+        col, sep, kind = item.rpartition("=")
+        if not sep or not col:
+            raise SystemExit(f"[Error] --column-type 格式應為 欄名=型別：{item}")
+        out[col] = kind.strip().lower()
+    return out
+
+def print_column_types(types: dict, overrides=None):
+    overrides = overrides or {}
+    print("[INFO] 欄位型別（可用 --column-type 欄名=型別 覆寫）：")
+    for c, t in types.items():
+        print(f"  {c}: {t}{'（指定）' if c in overrides else ''}")
+
+def column_types_frame(types: dict, overrides=None) -> pd.DataFrame:
+    overrides = overrides or {}
+    return pd.DataFrame({
+        "column": list(types),
+        "type": list(types.values()),
+        "source": ["override" if c in overrides else "auto" for c in types],
+    })
+
+def _as_date(s: pd.Series) -> pd.Series:
+    parsed = coerce_dates(s)
+    out = s.astype(object).where(s.notna(), "").astype(str).str.strip().astype(object)
+    ok = parsed.notna()
+    out[ok] = parsed[ok].dt.strftime("%Y-%m-%d")
+    return out
+
+def _as_number(s: pd.Series) -> pd.Series:
+    """數字（整數值存成 int、其餘 float）；無法轉換的值保留原字串，空白為 ''"""
+    if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+        text = pd.Series("", index=s.index, dtype=object)
+        num = pd.to_numeric(s, errors="coerce").astype("float64")
+    else:
+        text = s.astype(object).where(s.notna(), "").astype(str).str.strip()
+        num = pd.to_numeric(text.str.replace(",", "", regex=False), errors="coerce")
+    out = text.astype(object)
+    ok = num.notna().to_numpy()
+    vals = num.to_numpy()[ok]
+    integral = (vals % 1 == 0) & (np.abs(vals) < 2 ** 53)
+    conv = vals.astype(object)
+    conv[integral] = vals[integral].astype(np.int64).astype(object)
+    out[ok] = conv
+    return out
+
+def _as_text(s: pd.Series, case_insensitive=False) -> pd.Series:
+    out = s.astype(object).where(s.notna(), "").astype(str).str.strip()
+    if case_insensitive:
+        out = out.str.lower()
+    return out.astype(object)
+
+def normalize_df(df: pd.DataFrame, case_insensitive=False, types=None) -> pd.DataFrame:
+    """
+    移除 Unnamed；每欄依型別（types，未給時自行抽樣判斷）只做一種轉換，空白一律為 ''：
+    - date  ：統一為 YYYY-MM-DD 字串（無法解析的值保留原字串）
+    - number：數字（千分位逗號去掉），比對時依容許誤差
+    - code / text：去頭尾空白，可選忽略大小寫
+    """
+    types = types if types is not None else infer_column_types([df])
+    df = _clean_columns(df)
+    for i, c in enumerate(df.columns):
+        s = df.iloc[:, i]
+        kind = types.get(c) or classify_column(c, s)
+        if kind == "date":
+            out = _as_date(s)
+        elif kind == "number":
+            out = _as_number(s)
+        else:
+            out = _as_text(s, case_insensitive)
+        df.isetitem(i, out)
     return df
 
 def pick_keys(df_left: pd.DataFrame, df_right: pd.DataFrame):
@@ -73,81 +213,210 @@ def pick_keys(df_left: pd.DataFrame, df_right: pd.DataFrame):
     right_keys = [p[1] for p in chosen]
     return left_keys, right_keys
 
-def compare_with_keys(dfL, dfR, keysL, keysR):
-    """依 keys merge 後做欄位差異比較。回傳 onlyL, onlyR, col_diff(DataFrame)。"""
+def _key_frame(df, keys, names, pos_name):
+    """鍵欄（統一改名為 names）+ 同鍵第幾次出現（__occ）+ 原始列位置"""
+    kdf = pd.DataFrame({n: df[c].to_numpy() for n, c in zip(names, keys)})
+    kdf["__occ"] = kdf.groupby(names, sort=False, dropna=False).cumcount().to_numpy()
+    kdf[pos_name] = np.arange(len(df))
+    return kdf
+
+def _values_differ(lv, rv, numeric=False, tolerance=NUMERIC_TOLERANCE):
+    """逐格比較；numeric 時兩邊都是數字就依容許誤差判斷，其餘（空白、無法轉換的值）照原值比較"""
+    neq = lv != rv
+    if not numeric:
+        return neq
+    ln = pd.to_numeric(pd.Series(lv), errors="coerce").to_numpy(dtype=float)
+    rn = pd.to_numeric(pd.Series(rv), errors="coerce").to_numpy(dtype=float)
+    both = ~np.isnan(ln) & ~np.isnan(rn)
+    neq[both] = np.abs(ln[both] - rn[both]) > tolerance
+    return neq
+
+def diff_columns(n_keys) -> list:
+    """COLUMN_DIFF 的欄位：key（tuple）+ key_1..key_n + column / left_value / right_value"""
+    return ["key"] + [f"key_{i+1}" for i in range(n_keys)] + ["column", "left_value", "right_value"]
+
+def iter_column_diffs(dfL, dfR, keysL, pL, pR, cols, number_cols=(), tolerance=NUMERIC_TOLERANCE,
+                      block=DIFF_BLOCK_ROWS):
+    """
+    已配對的列（pL[i] 對 pR[i]，依左檔順序）逐欄比較，每 block 對產生一段差異 DataFrame；
+    各段依序接起來就是完整的 COLUMN_DIFF（依配對、欄位順序），不必一次留在記憶體。
+    index = 左檔列的 index（分割比對後可依此還原原本順序）
+    """
+    key_cols = [f"key_{i+1}" for i in range(len(keysL))]
+    valsL = {c: dfL[c].to_numpy(dtype=object) for c in cols}
+    valsR = {c: dfR[c].to_numpy(dtype=object) for c in cols}
+    keyvals = [dfL[c].to_numpy(dtype=object) for c in keysL]
+    for start in range(0, len(pL), block):
+        bL, bR = pL[start:start + block], pR[start:start + block]
+        parts = []
+        for j, col in enumerate(cols):
+            lv, rv = valsL[col][bL], valsR[col][bR]
+            idx = np.flatnonzero(_values_differ(lv, rv, col in number_cols, tolerance))
+            if len(idx):
+                parts.append(pd.DataFrame({"__pair": idx, "__col": j, "column": col,
+                                           "left_value": lv[idx], "right_value": rv[idx]}))
+        if not parts:
+            continue
+        diff = pd.concat(parts, ignore_index=True).sort_values(["__pair", "__col"], kind="stable")
+        rowsL = bL[diff["__pair"].to_numpy()]
+        # 把 key 展開到欄位，方便篩選
+        for name, vals in zip(key_cols, keyvals):
+            diff[name] = vals[rowsL]
+        diff["key"] = list(zip(*(diff[name] for name in key_cols)))
+        out = diff[diff_columns(len(keysL))]
+        out.index = dfL.index[rowsL]
+        yield out
+
+def compare_with_keys(dfL, dfR, keysL, keysR, number_cols=(), tolerance=NUMERIC_TOLERANCE, lazy=False):
+    """
+    依 keys 配對後做欄位差異比較。回傳 onlyL, onlyR, col_diff(DataFrame)。
+    同一個鍵在兩邊出現多次時，依出現順序一對一配對（左邊第 n 筆對右邊第 n 筆），多出來的列算單邊。
+    number_cols 內的欄位兩邊差距 ≤ tolerance 視為相同。
+    lazy=True 時 col_diff 改為逐段產生的 generator（iter_column_diffs），給串流寫報告用。
+    """
     # 對齊欄位集合
     all_cols = sorted(set(dfL.columns) | set(dfR.columns))
+    knames = [f"__k{i}" for i in range(len(keysL))]
+
+    # 一次 hash join：鍵 + 出現序號，indicator 區分兩邊都有 / 只在單邊
+    m = _key_frame(dfL, keysL, knames, "__posL").merge(
+        _key_frame(dfR, keysR, knames, "__posR"),
+        on=knames + ["__occ"], how="outer", indicator=True, sort=False,
+    )
 
-    # 先內外連接，找到只在單邊的 key
-    left_key_df = dfL[keysL].copy()
-    right_key_df = dfR[keysR].copy()
-    left_key_df.columns = [f"__k{i}" for i in range(len(keysL))]
-    right_key_df.columns = [f"__k{i}" for i in range(len(keysR))]
-
-    left_key_df["__join_key"] = left_key_df.apply(lambda r: tuple(r.values), axis=1)
-    right_key_df["__join_key"] = right_key_df.apply(lambda r: tuple(r.values), axis=1)
-
-    setL = Counter(left_key_df["__join_key"].tolist())
-    setR = Counter(right_key_df["__join_key"].tolist())
-
-    onlyL_keys = list((setL - setR).elements())
-    onlyR_keys = list((setR - setL).elements())
-
-    # 取出只在左/只在右的列
-    def rows_by_keys(df, keys, key_tuples):
-        if not key_tuples:
-            return df.iloc[0:0].copy()
-        mask = pd.Series(False, index=df.index)
-        kdf = df[keys].apply(lambda r: tuple(r.values), axis=1)
-        for k in set(key_tuples):
-            # 若重複出現 n 次，就取前 n 列
-            idx = kdf[kdf == k].index
-            n = key_tuples.count(k)
-            mask.loc[idx[:n]] = True
-        return df.loc[mask].copy()
-
-    only_in_left = rows_by_keys(dfL, keysL, onlyL_keys)
-    only_in_right = rows_by_keys(dfR, keysR, onlyR_keys)
-
-    # 對齊可一一對上的鍵（兩邊最小相同次數）
-    common_keys = list((setL & setR).elements())
-
-    # 建立「鍵 → 行列索引佇列」
-    def build_index_map(df, keys):
-        kseries = df[keys].apply(lambda r: tuple(r.values), axis=1)
-        mp = {}
-        for i, k in zip(df.index, kseries):
-            mp.setdefault(k, []).append(i)
-        return mp
-
-    mapL = build_index_map(dfL, keysL)
-    mapR = build_index_map(dfR, keysR)
-
-    diffs = []
-    # 逐鍵、逐筆配對，檢查所有共同欄位的值是否相同
+    def side_rows(df, which, pos_col):
+        pos = np.sort(m.loc[m["_merge"] == which, pos_col].to_numpy(dtype=np.int64))
+        return df.iloc[pos].copy()
+
+    only_in_left = side_rows(dfL, "left_only", "__posL")
+    only_in_right = side_rows(dfR, "right_only", "__posR")
+
+    pairs = m.loc[m["_merge"] == "both", ["__posL", "__posR"]].astype(np.int64).sort_values("__posL")
+    pL, pR = pairs["__posL"].to_numpy(), pairs["__posR"].to_numpy()
+
+    # 逐欄向量化比對所有共同欄位（避免把 key 欄也當成比較欄）
     common_cols = [c for c in all_cols if c in dfL.columns and c in dfR.columns
-                   and c not in keysL and c not in keysR]  # 避免把 key 欄也當成比較欄
-
-    for k in common_keys:
-        # 取兩邊對應的最小次數配對
-        n = min(len(mapL[k]), len(mapR[k]))
-        for t in range(n):
-            iL = mapL[k][t]
-            iR = mapR[k][t]
-            rowL = dfL.loc[iL]
-            rowR = dfR.loc[iR]
-            ne = rowL[common_cols] != rowR[common_cols]
-            if ne.any():
-                for col in common_cols:
-                    if ne[col]:
-                        entry = { "key": k, "column": col, "left_value": rowL[col], "right_value": rowR[col] }
-                        # 把 key 展開到欄位，方便篩選
-                        for ix, kk in enumerate(k):
-                            entry[f"key_{ix+1}"] = kk
-                        diffs.append(entry)
-
-    col_diff = pd.DataFrame(diffs, columns=["key"] + [f"key_{i+1}" for i in range(len(keysL))] + ["column", "left_value", "right_value"])
-    return only_in_left, only_in_right, col_diff
+                   and c not in keysL and c not in keysR]
+    chunks = iter_column_diffs(dfL, dfR, keysL, pL, pR, common_cols, number_cols, tolerance)
+    if lazy:
+        return only_in_left, only_in_right, chunks
+    chunks = list(chunks)
+    if not chunks:
+        return only_in_left, only_in_right, pd.DataFrame(columns=diff_columns(len(keysL)))
+    return only_in_left, only_in_right, pd.concat(chunks)
+
+def _multiset_pairs(valsL, valsR):
+    """
+    每列一個比對值（雜湊或整列內容）；同值依出現順序一對一配對（左邊第 n 筆對右邊第 n 筆），
+    回傳配對到的 (左位置, 右位置)
+    """
+    m = _key_frame(pd.DataFrame({"v": valsL}), ["v"], ["__k0"], "__posL").merge(
+        _key_frame(pd.DataFrame({"v": valsR}), ["v"], ["__k0"], "__posR"),
+        on=["__k0", "__occ"], how="inner", sort=False,
+    )
+    return m["__posL"].to_numpy(dtype=np.int64), m["__posR"].to_numpy(dtype=np.int64)
+
+def compare_keyless(L, R, hL=None, hR=None):
+    """
+    沒 key：整列比對，回傳 onlyL, onlyR, 空的 col_diff。
+    重複列照次數算（左邊兩筆相同、右邊一筆 → 左邊多一筆）。
+    整列 64-bit 雜湊 + 出現序號一次配對，配對後逐欄核對內容；
+    雜湊碰撞（極少見）的那幾組改用整列內容重新配對。
+    hL / hR：現成的整列雜湊（例如快照裡存的，欄位依名稱排序計算），沒給時現算。
+    """
+    cols = sorted(set(L.columns) | set(R.columns))
+    L = L.reindex(columns=cols, fill_value="")
+    R = R.reindex(columns=cols, fill_value="")
+    hL = row_fingerprint(L) if hL is None else hL
+    hR = row_fingerprint(R) if hR is None else hR
+    pL, pR = _multiset_pairs(hL, hR)
+
+    # 核對：雜湊相同但內容不同的配對
+    ok = np.ones(len(pL), dtype=bool)
+    for c in cols:
+        ok &= L[c].to_numpy(dtype=object)[pL] == R[c].to_numpy(dtype=object)[pR]
+    if not ok.all():
+        bad = np.unique(hL[pL[~ok]])
+        print(f"[Warn] {len(bad)} 組整列雜湊碰撞，改用整列內容重新配對")
+        inL, inR = np.isin(hL, bad), np.isin(hR, bad)
+        subL, subR = np.flatnonzero(inL), np.flatnonzero(inR)
+        sL, sR = _multiset_pairs(list(L.iloc[subL].itertuples(index=False, name=None)),
+                                 list(R.iloc[subR].itertuples(index=False, name=None)))
+        keep = ~inL[pL]
+        pL = np.concatenate([pL[keep], subL[sL]])
+        pR = np.concatenate([pR[keep], subR[sR]])
+
+    matchedL = np.zeros(len(L), dtype=bool); matchedL[pL] = True
+    matchedR = np.zeros(len(R), dtype=bool); matchedR[pR] = True
+    onlyL = L[~matchedL]
+    onlyR = R[~matchedR]
+    return onlyL, onlyR, pd.DataFrame(columns=["key", "column", "left_value", "right_value"])
+
+def write_report(path, summary: dict, onlyL, onlyR, diff_chunks=None, n_keys=0, column_types=None,
+                 max_rows=REPORT_MAX_ROWS, spill_format="csv") -> dict:
+    """
+    以 constant_memory 串流寫報告；diff_chunks 為 COLUMN_DIFF 的各段（None 表示沒有 key、不做欄位比較）。
+    onlyL / onlyR 可為 DataFrame，或依序產生 DataFrame 的 iterable（至少一段，表頭取第一段的欄位）。
+    每張表最多 max_rows 筆，其餘寫到報告旁的溢出檔（spill_format = csv / parquet）。
+    DIFF_COUNTS（各欄差異筆數）邊寫邊累計，SUMMARY 最後才填（兩張表建立在前面，分頁順序不變）。
+    回傳補上差異筆數、溢出檔等資訊後的 summary。
+    """
+    wb = open_streaming_workbook(path, strings_as_text=True)
+    head_fmt = wb.add_format(HEADER_FORMAT)
+    ws_summary = wb.add_worksheet("SUMMARY")
+    if column_types is not None:
+        write_frame(wb, column_types, "COLUMN_TYPES")
+    ws_counts = wb.add_worksheet("DIFF_COUNTS") if diff_chunks is not None else None
+
+    sinks = []
+    only_rows = []
+    for name, frames in (("ONLY_IN_LEFT", onlyL), ("ONLY_IN_RIGHT", onlyR)):
+        sink = None
+        for df in [frames] if isinstance(frames, pd.DataFrame) else frames:
+            if sink is None:
+                sink = CappedSheetWriter(wb, name, path, df.columns, max_rows, spill_format)
+            sink.write(df)
+        sinks.append(sink.close())
+        only_rows.append(sinks[-1]["rows"] + sinks[-1]["spilled"])
+
+    counts = pd.Series(dtype=np.int64)
+    sink = None
+    for chunk in diff_chunks if diff_chunks is not None else ():
+        if chunk.empty:
+            continue
+        if sink is None:
+            sink = CappedSheetWriter(wb, "COLUMN_DIFF", path, diff_columns(n_keys), max_rows, spill_format)
+        counts = counts.add(chunk["column"].value_counts(sort=False), fill_value=0)
+        sink.write(chunk.assign(key=chunk["key"].map(str)))
+    if sink is not None:
+        sinks.append(sink.close())
+
+    if ws_counts is not None:
+        counts = counts.astype(np.int64).sort_values(ascending=False, kind="stable")
+        write_table(ws_counts, pd.DataFrame({"column": counts.index, "diff_rows": counts.to_numpy()}), 0, head_fmt)
+        ws_counts.freeze_panes(1, 0)
+
+    spills = [f"{s['sheet']}: {s['spilled']} → {s['spill_path']}" for s in sinks if s["spilled"]]
+    summary = {
+        **summary,
+        "same": bool(only_rows == [0, 0] and counts.sum() == 0),
+        "only_in_left_rows": int(only_rows[0]),
+        "only_in_right_rows": int(only_rows[1]),
+        "column_diff_rows": int(counts.sum()),
+        "rows_per_sheet_cap": int(max_rows),
+        "spilled": "; ".join(spills) if spills else "(無)",
+    }
+    write_table(ws_summary, pd.DataFrame([summary]), 0, head_fmt)
+    wb.close()
+    return summary
+
+def _pick_sheet(book, wanted, side):
+    """指定的工作表不存在就結束；沒指定時用第一張"""
+    if wanted:
+        if wanted not in book.sheet_names:
+            raise SystemExit(f"[Error] {side}檔沒有工作表：{wanted}")
+        return wanted
+    return book.sheet_names[0]
 
 def main():
     ap = argparse.ArgumentParser(description="Compare two Excel files with column-level diff.")
@@ -158,27 +427,57 @@ def main():
     ap.add_argument("--keys", nargs="+", help="Column names (in both files) to use as join keys (order matters).")
     ap.add_argument("--case-insensitive", action="store_true", help="Case-insensitive for text comparison.")
     ap.add_argument("--output", default="excel_diff_report_detailed.xlsx", help="Output Excel filename.")
+    ap.add_argument("--engine", choices=ENGINES, default=None, help="Excel reader engine. Default: EXCEL_ENGINE (auto).")
+    ap.add_argument("--out-of-core", action="store_true",
+                    help="Stream both files into on-disk hash partitions and compare them in parallel.")
+    ap.add_argument("--memory-limit", type=int, default=None, metavar="MB",
+                    help="Approximate peak memory budget in MB (implies --out-of-core).")
+    ap.add_argument("--workers", type=int, default=None, help="Parallel processes for --out-of-core. Default: CPU count.")
+    ap.add_argument("--partitions", type=int, default=None,
+                    help="Number of hash partitions for --out-of-core. Default: estimated from file size and memory limit.")
+    ap.add_argument("--snapshot-dir", default=SNAPSHOT_DIR,
+                    help=f"Where normalized snapshots are kept. Default: {SNAPSHOT_DIR}")
+    ap.add_argument("--no-snapshot", action="store_true", help="Do not load or save snapshots.")
+    ap.add_argument("--column-type", nargs="+", default=[], metavar="COLUMN=TYPE",
+                    help=f"Override inferred column types ({'/'.join(COLUMN_TYPES)}), e.g. 行號=code.")
+    ap.add_argument("--tolerance", type=float, default=NUMERIC_TOLERANCE,
+                    help=f"Numeric columns differing by at most this much are equal. Default: {NUMERIC_TOLERANCE:g}")
+    ap.add_argument("--max-rows", type=int, default=REPORT_MAX_ROWS,
+                    help=f"Max data rows per report sheet; the rest goes to a spill file next to the report. "
+                         f"Default: {REPORT_MAX_ROWS}")
+    ap.add_argument("--spill-format", choices=("csv", "parquet"), default="csv",
+                    help="Spill file format for rows over --max-rows: csv (.csv.gz) or parquet. Default: csv")
     args = ap.parse_args()
-
-    # 讀左檔 & 指定工作表
-    left_sheets = pd.read_excel(args.left_file, sheet_name=None)
-    if args.left_sheet not in left_sheets:
-        raise SystemExit(f"[Error] 左檔沒有工作表：{args.left_sheet}")
-    dfL = left_sheets[args.left_sheet]
-
-    # 讀右檔 & 工作表
-    right_sheets = pd.read_excel(args.right_file, sheet_name=None)
-    if args.right_sheet:
-        if args.right_sheet not in right_sheets:
-            raise SystemExit(f"[Error] 右檔沒有工作表：{args.right_sheet}")
-        rs_name = args.right_sheet
-    else:
-        rs_name = next(iter(right_sheets))  # 第一張
-    dfR = right_sheets[rs_name]
-
-    # 正規化
-    L = normalize_df(dfL, case_insensitive=args.case_insensitive)
-    R = normalize_df(dfR, case_insensitive=args.case_insensitive)
+    out_of_core = args.out_of_core or args.memory_limit is not None
+    overrides = parse_type_overrides(args.column_type)
+
+    # 讀左右兩邊：.snap.json 直接載入；一般檔案先找內容相同的快照，沒有才讀工作表（只讀要比對的那一張）
+    store = None if (args.no_snapshot or out_of_core) else SnapshotStore(args.snapshot_dir, NORMALIZE_VERSION)
+    snapL, ls_name, dfL = _open_side(args.left_file, args.left_sheet, "左", args, store, overrides, out_of_core)
+    snapR, rs_name, dfR = _open_side(args.right_file, args.right_sheet, "右", args, store, overrides, out_of_core)
+
+    if out_of_core:
+        from compare_ooc import compare_files_ooc
+        with compare_files_ooc(
+            args.left_file, ls_name, args.right_file, rs_name, keys=args.keys,
+            case_insensitive=args.case_insensitive, memory_limit_mb=args.memory_limit,
+            workers=args.workers, partitions=args.partitions, overrides=overrides, tolerance=args.tolerance,
+        ) as (keysL, types, onlyL, onlyR, col_diff):
+            _finish(args, (args.left_file, ls_name), (args.right_file, rs_name), keysL, onlyL, onlyR, col_diff,
+                    column_types_frame(types, overrides))
+        return
+
+    # 欄位型別：快照已決定的沿用，其餘由新讀的一邊（或兩邊）合併抽樣判斷一次 + 正規化
+    known = {}
+    for snap in (snapL, snapR):
+        for c, t in (snap.types.items() if snap else ()):
+            if known.setdefault(c, t) != t:
+                print(f"[Warn] 欄位 `{c}` 在兩邊快照的型別不同（{known[c]} / {t}），可加 --no-snapshot 重新讀取")
+    raw = [df for df in (dfL, dfR) if df is not None]
+    types = {**known, **infer_column_types(raw, overrides, known)} if raw else known
+    print_column_types(types, overrides)
+    L = snapL.df if snapL else normalize_df(dfL, case_insensitive=args.case_insensitive, types=types)
+    R = snapR.df if snapR else normalize_df(dfR, case_insensitive=args.case_insensitive, types=types)
 
     # 決定 keys
     if args.keys:
@@ -195,45 +494,65 @@ def main():
             print("[Warn] 自動找不到合適的 key，將僅產生 ONLY_IN_LEFT / ONLY_IN_RIGHT，不做 COLUMN_DIFF。")
             keysL, keysR = [], []
 
+    # 整列雜湊：快照裡已有；新讀的一邊算一次，存快照與無 key 比對共用
+    hL = snapL.row_hash if snapL else row_hashes(L)
+    hR = snapR.row_hash if snapR else row_hashes(R)
+    if store is not None:
+        for snap, path, sheet, df, h, keys in ((snapL, args.left_file, ls_name, L, hL, keysL),
+                                                (snapR, args.right_file, rs_name, R, hR, keysR)):
+            if snap is None:
+                key_hash = row_fingerprint(df, keys) if keys else None
+                meta_path = store.save(path, sheet, df, types, h, args.case_insensitive, overrides, keys, key_hash)
+                print(f"[INFO] 已存快照：{meta_path}")
+
     # 產出差異
     if keysL:
-        onlyL, onlyR, col_diff = compare_with_keys(L, R, keysL, keysR)
+        number_cols = {c for c, t in types.items() if t == "number"}
+        onlyL, onlyR, col_diff = compare_with_keys(L, R, keysL, keysR, number_cols, args.tolerance, lazy=True)
     else:
-        # 沒 key：只做集合差異
-        cols = sorted(set(L.columns) | set(R.columns))
-        for c in cols:
-            if c not in L.columns: L[c] = ""
-            if c not in R.columns: R[c] = ""
-        L = L[cols]; R = R[cols]
-        sigL = L.apply(lambda row: tuple(row.tolist()), axis=1)
-        sigR = R.apply(lambda row: tuple(row.tolist()), axis=1)
-        onlyL = L[~sigL.isin(sigR)]
-        onlyR = R[~sigR.isin(sigL)]
-        col_diff = pd.DataFrame(columns=["key", "column", "left_value", "right_value"])
-
-    # 寫報告
-    with pd.ExcelWriter(args.output, engine="openpyxl") as w:
-        # Summary
-        summary = pd.DataFrame([{
-            "left_file": args.left_file,
-            "left_sheet": args.left_sheet,
-            "right_file": args.right_file,
-            "right_sheet": rs_name,
-            "keys_used": ", ".join(keysL) if keysL else "(無)",
-            "same": bool(onlyL.empty and onlyR.empty and (col_diff is None or col_diff.empty)),
-            "only_in_left_rows": int(len(onlyL)),
-            "only_in_right_rows": int(len(onlyR)),
-            "column_diff_rows": int(0 if (col_diff is None or col_diff.empty) else len(col_diff)),
-        }])
-        summary.to_excel(w, index=False, sheet_name="SUMMARY")
-        onlyL.to_excel(w, index=False, sheet_name="ONLY_IN_LEFT")
-        onlyR.to_excel(w, index=False, sheet_name="ONLY_IN_RIGHT")
-        if col_diff is not None and not col_diff.empty:
-            col_diff.to_excel(w, index=False, sheet_name="COLUMN_DIFF")
+        # 沒 key：只做集合差異（兩邊欄位相同時直接用現成的整列雜湊）
+        same_cols = set(L.columns) == set(R.columns)
+        onlyL, onlyR, col_diff = compare_keyless(L, R, *((hL, hR) if same_cols else ()))
+
+    _finish(args, (snapL.label if snapL else args.left_file, ls_name),
+            (snapR.label if snapR else args.right_file, rs_name),
+            keysL, onlyL, onlyR, col_diff, column_types_frame(types, overrides))
+
+def _open_side(path, wanted_sheet, side, args, store, overrides, out_of_core):
+    """回傳 (快照或 None, 工作表名稱, 原始 DataFrame 或 None)"""
+    if is_snapshot_path(path):
+        if out_of_core:
+            raise SystemExit("[Error] --out-of-core 不支援以快照作為比對對象")
+        snap = load_snapshot(path)
+        print(f"[INFO] {side}邊使用快照：{snap.label}")
+        return snap, snap.meta["sheet"], None
+    with open_workbook(path, args.engine) as book:
+        sheet = _pick_sheet(book, wanted_sheet, side)
+        if store is not None:
+            snap = store.find(path, sheet, args.case_insensitive, overrides)
+            if snap is not None:
+                print(f"[INFO] {side}檔內容沒有變動，使用快照：{snap.label}")
+                return snap, sheet, None
+        return None, sheet, (None if out_of_core else book.parse(sheet))
+
+def _finish(args, left, right, keysL, onlyL, onlyR, diff_chunks, column_types=None):
+    # 寫報告（left / right：(檔案或快照說明, 工作表)；diff_chunks：COLUMN_DIFF 各段，沒 key 時為 None）
+    summary = {
+        "left_file": left[0],
+        "left_sheet": left[1],
+        "right_file": right[0],
+        "right_sheet": right[1],
+        "keys_used": ", ".join(keysL) if keysL else "(無)",
+    }
+    summary = write_report(args.output, summary, onlyL, onlyR, diff_chunks if keysL else None, len(keysL),
+                           column_types, args.max_rows, args.spill_format)
 
     print(f"已輸出：{args.output}")
+    if summary["spilled"] != "(無)":
+        print(f"[INFO] 超過每張 {args.max_rows} 列的部分另存：{summary['spilled']}")
     if not keysL:
         print("ℹ建議改用 --keys 指定主鍵欄位，才能得到 COLUMN_DIFF 欄位級報表。")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()   # 打包成 EXE 時 --out-of-core 的多行程需要
     main()
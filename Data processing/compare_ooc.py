@@ -0,0 +1,319 @@
+"""
+比對記憶體放不下的大檔（compare.py --out-of-core / --memory-limit 時使用）
+
+1) 兩邊工作表逐列串流讀取（excel_reader.iter_sheet_rows），原始值每段暫存到磁碟，同時每段等距抽樣各欄非空白值；
+   欄位型別由整欄的抽樣判斷一次（與 compare._sample_values 相同做法），之後各段依同一組型別正規化
+2) 依 key 的雜湊（沒有 key 時用整列雜湊）分成 P 個分區，寫到暫存資料夾；
+   同一個 key 的列一定落在同一個分區，所以各分區可以獨立比對
+3) 各分區對（左 p, 右 p）用多個行程平行比對，沿用 compare.compare_with_keys / compare_keyless
+4) 各分區結果（各自已依原始列號排序）分塊存檔，主程式依原始列號 k 路合併、逐段直接寫進報告，
+   輸出與一次讀進記憶體時相同的 ONLY_IN_LEFT / ONLY_IN_RIGHT / COLUMN_DIFF
+
+記憶體大約受 --memory-limit 控制：主程式一次只持有一段（chunk）或各分區各一塊結果，每個工作行程一次只持有一個分區對。
+分區數依檔案大小估計；key 分布極度集中（同一個 key 佔大半）時單一分區仍可能超過預算，會提出警告。
+"""
+import os
+import glob
+import math
+import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from excel_reader import iter_sheet_rows
+from row_hash import row_fingerprint
+from compact_dtypes import frame_memory_mb
+import compare
+
+DEFAULT_MEMORY_MB = 1024
+XLSX_EXPANSION = 25      # xlsx 檔案大小 → 讀進 DataFrame（物件欄）後的大約倍數
+COMPARE_OVERHEAD = 4     # 比對時兩邊資料 + 配對表 + 差異表，約為資料本身的幾倍
+BYTES_PER_CELL = 100     # 估計每段列數用：一個物件儲存格約佔的位元組
+MIN_CHUNK_ROWS = 1_000
+MAX_CHUNK_ROWS = 200_000
+
+MB = 1024 * 1024
+
+
+# ===== 串流讀取 =====
+def _is_blank(row) -> bool:
+    return all(v == "" for v in row)
+
+
+def _header_names(row):
+    """與 pandas 相同的欄名規則：空白 → Unnamed: n；重複 → 名稱.1、名稱.2 …"""
+    names, counts = [], {}
+    for i, v in enumerate(row):
+        name = f"Unnamed: {i}" if v == "" else v
+        cur = counts.get(name, 0)
+        while cur > 0:
+            counts[name] = cur + 1
+            name = f"{name}.{cur}"
+            cur = counts.get(name, 0)
+        counts[name] = cur + 1
+        names.append(name)
+    return names
+
+
+def iter_chunks(path, sheet_name, chunk_rows):
+    """
+    逐段產生原始值的 DataFrame（object）；第一個非空白列為表頭，整列空白的列略過（與 pandas 預設相同）。
+    index 為資料列序號（跨段連續），用來在合併各分區結果時還原原本順序。
+    chunk_rows 也可以是函式：依欄數決定每段列數。
+    """
+    rows = iter_sheet_rows(path, sheet_name)
+    header = None
+    for row in rows:
+        if not _is_blank(row):
+            header = _header_names(row)
+            break
+    if header is None:
+        return
+    width = len(header)
+    if callable(chunk_rows):
+        chunk_rows = chunk_rows(width)
+
+    def frame(buf, start):
+        df = pd.DataFrame(buf, columns=header, dtype=object)
+        df.index = pd.RangeIndex(start, start + len(buf))
+        return df
+
+    buf, start = [], 0
+    for row in rows:
+        if _is_blank(row):
+            continue
+        row = list(row[:width])
+        buf.append(row + [""] * (width - len(row)))
+        if len(buf) >= chunk_rows:
+            yield frame(buf, start)
+            start += len(buf)
+            buf = []
+    if buf or start == 0:
+        yield frame(buf, start)
+
+
+# ===== 分區 =====
+def estimate_partitions(paths, memory_limit_mb, workers) -> int:
+    size = sum(os.path.getsize(p) for p in paths)
+    per_worker = memory_limit_mb * MB / max(1, workers)
+    return max(1, math.ceil(size * XLSX_EXPANSION * COMPARE_OVERHEAD / per_worker))
+
+
+def chunk_rows_for(memory_limit_mb, n_cols) -> int:
+    rows = memory_limit_mb * MB // (COMPARE_OVERHEAD * BYTES_PER_CELL * max(1, n_cols))
+    return int(min(MAX_CHUNK_ROWS, max(MIN_CHUNK_ROWS, rows)))
+
+
+def _raw_path(tmp, side, chunk_no):
+    return os.path.join(tmp, f"raw{side}_{chunk_no:06d}.pkl")
+
+
+def _spool(path, sheet_name, memory_limit_mb, tmp, side):
+    """
+    串流讀工作表，原始值每段存一個暫存檔（分區時不必再解析一次 xlsx），同時每段等距抽樣各欄非空白值，
+    最後再從各段的抽樣等距取 TYPE_SAMPLE_ROWS 個，近似整欄等距抽樣。回傳 (段數, 每段列數, 抽樣 DataFrame)
+    """
+    chunk_rows = []
+
+    def rows_for(width):
+        chunk_rows.append(chunk_rows_for(memory_limit_mb, width))
+        return chunk_rows[-1]
+
+    samples, n_chunks = {}, 0
+    for n_chunks, raw in enumerate(iter_chunks(path, sheet_name, rows_for), 1):
+        with open(_raw_path(tmp, side, n_chunks - 1), "wb") as f:
+            pickle.dump(raw, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for c, s in raw.items():
+            samples.setdefault(c, []).append(compare._sample_values(s))
+    sample = pd.DataFrame({c: compare._sample_values(pd.concat(parts, ignore_index=True)).reset_index(drop=True)
+                           for c, parts in samples.items()})
+    return n_chunks, (chunk_rows or [MIN_CHUNK_ROWS])[0], sample
+
+
+def _load_raw(tmp, side, chunk_no):
+    """讀回一段原始值，讀完就刪掉暫存檔"""
+    path = _raw_path(tmp, side, chunk_no)
+    with open(path, "rb") as f:
+        raw = pickle.load(f)
+    os.remove(path)
+    return raw
+
+
+def _part_path(tmp, side, p, chunk_no):
+    return os.path.join(tmp, f"{side}_{p:05d}_{chunk_no:06d}.pkl")
+
+
+def _write_partitions(df, hash_cols, n_parts, tmp, side, chunk_no):
+    if df.empty:
+        return
+    part = row_fingerprint(df, hash_cols) % n_parts
+    for p, sub in df.groupby(part, sort=False):
+        with open(_part_path(tmp, side, int(p), chunk_no), "wb") as f:
+            pickle.dump(sub, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_partition(tmp, side, p, columns):
+    files = sorted(glob.glob(os.path.join(tmp, f"{side}_{p:05d}_*.pkl")))
+    if not files:
+        return pd.DataFrame(columns=columns, dtype=object)
+    parts = []
+    for fp in files:
+        with open(fp, "rb") as f:
+            parts.append(pickle.load(f))
+    return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+
+def _block_path(tmp, kind, p, block_no):
+    return os.path.join(tmp, f"{kind}_{p:05d}_{block_no:06d}.pkl")
+
+
+def _write_blocks(frames, tmp, kind, p, block_rows):
+    """
+    一個分區的結果（依序產生的各段，整體已依原始列號排序）每塊最多 block_rows 列存一個檔，
+    合併時每個分區一次只讀一塊；各段邊產生邊寫，不必整個分區的結果一起留在記憶體
+    """
+    block_no = 0
+    for df in frames:
+        for start in range(0, len(df), block_rows):
+            with open(_block_path(tmp, kind, p, block_no), "wb") as f:
+                pickle.dump(df.iloc[start:start + block_rows], f, protocol=pickle.HIGHEST_PROTOCOL)
+            block_no += 1
+
+
+def _iter_blocks(tmp, kind, p):
+    for fp in sorted(glob.glob(os.path.join(tmp, f"{kind}_{p:05d}_*.pkl"))):
+        with open(fp, "rb") as f:
+            yield pickle.load(f)
+
+
+def merge_sorted(tmp, kind, n_parts, columns):
+    """
+    各分區的結果塊依原始列號（index）k 路合併，逐段產生 DataFrame（至少一段，沒有資料時為只有欄位的空表）。
+    每個分區一次只讀一塊；還沒讀完的分區之後的列不會小於它目前這塊的最後一列，
+    所以不大於其中最小者的列順序已確定，先產出。同一個原始列只會在一個分區，排序穩定即可保留原本的欄位順序。
+    """
+    sources = {p: _iter_blocks(tmp, kind, p) for p in range(n_parts)}
+    pending = {}
+    emitted = False
+    while sources or pending:
+        for p in list(sources):
+            if p not in pending:
+                block = next(sources[p], None)
+                if block is None:
+                    del sources[p]
+                else:
+                    pending[p] = block
+        bound = min((pending[p].index[-1] for p in sources), default=None)
+        ready, rest = [], {}
+        for p, block in pending.items():
+            cut = len(block) if bound is None else block.index.searchsorted(bound, side="right")
+            if cut:
+                ready.append(block.iloc[:cut])
+            if cut < len(block):
+                rest[p] = block.iloc[cut:]
+        pending = rest
+        if ready:
+            emitted = True
+            yield pd.concat(ready).sort_index(kind="stable") if len(ready) > 1 else ready[0]
+    if not emitted:
+        yield pd.DataFrame(columns=columns)
+
+
+# ===== 分區比對（工作行程）=====
+def _compare_partition(task):
+    tmp, p, colsL, colsR, keysL, keysR, number_cols, tolerance, block_rows = task
+    L = _load_partition(tmp, "L", p, colsL)
+    R = _load_partition(tmp, "R", p, colsR)
+    peak_mb = frame_memory_mb(L) + frame_memory_mb(R)
+    if keysL:
+        # 欄位差異依左檔列序逐段產生（iter_column_diffs），本身就依原始列號排序
+        onlyL, onlyR, diffs = compare.compare_with_keys(L, R, keysL, keysR, number_cols, tolerance, lazy=True)
+    else:
+        onlyL, onlyR, _ = compare.compare_keyless(L, R)
+        diffs = ()
+    _write_blocks([onlyL.sort_index(kind="stable")], tmp, "onlyL", p, block_rows)
+    _write_blocks([onlyR.sort_index(kind="stable")], tmp, "onlyR", p, block_rows)
+    _write_blocks(diffs, tmp, "diff", p, block_rows)
+    return peak_mb
+
+
+# ===== 主流程 =====
+@contextmanager
+def compare_files_ooc(left_file, left_sheet, right_file, right_sheet, keys=None, case_insensitive=False,
+                      memory_limit_mb=None, workers=None, partitions=None, temp_dir=None, overrides=None,
+                      tolerance=compare.NUMERIC_TOLERANCE):
+    """
+    分割比對兩個工作表，with 區塊內得到 (keysL, 欄位型別, onlyL, onlyR, col_diff)，內容與 compare.py 一次讀進記憶體的結果相同。
+    onlyL / onlyR / col_diff 為依原始列順序逐段產生 DataFrame 的 generator（可直接交給 compare.write_report）；
+    暫存資料夾離開 with 時才刪除，所以要在區塊內寫完報告。
+    keys 為 None 時用 compare.pick_keys 自動挑選；找不到 key 時只做集合差異。
+    """
+    memory_limit_mb = memory_limit_mb or DEFAULT_MEMORY_MB
+    workers = max(1, workers or os.cpu_count() or 1)
+    tmp = tempfile.mkdtemp(prefix="compare_ooc_", dir=temp_dir)
+    try:
+        # 第一遍：兩邊串流讀進暫存檔並逐段抽樣，由整欄的抽樣決定欄位型別；第一段決定欄位與 key
+        spooled = {side: _spool(path, sheet, memory_limit_mb, tmp, side)
+                   for side, path, sheet in (("L", left_file, left_sheet), ("R", right_file, right_sheet))}
+        types = compare.infer_column_types([spooled["L"][2], spooled["R"][2]], overrides)
+        compare.print_column_types(types, overrides)
+
+        def first_chunk(side):
+            if not spooled[side][0]:
+                return pd.DataFrame()
+            with open(_raw_path(tmp, side, 0), "rb") as f:
+                return compare.normalize_df(pickle.load(f), case_insensitive, types)
+
+        firstL, firstR = first_chunk("L"), first_chunk("R")
+
+        if keys:
+            for k in keys:
+                if k not in firstL.columns or k not in firstR.columns:
+                    raise SystemExit(f"[Error] 指定的 key 欄位 `{k}` 不同時存在於兩檔。")
+            keysL, keysR = list(keys), list(keys)
+        else:
+            keysL, keysR = compare.pick_keys(firstL, firstR)
+            if not keysL:
+                print("[Warn] 自動找不到合適的 key，將僅產生 ONLY_IN_LEFT / ONLY_IN_RIGHT，不做 COLUMN_DIFF。")
+
+        n_parts = partitions or estimate_partitions([left_file, right_file], memory_limit_mb, workers)
+        workers = min(workers, n_parts)
+        all_cols = sorted(set(firstL.columns) | set(firstR.columns))
+        colsL = all_cols if not keysL else list(firstL.columns)
+        colsR = all_cols if not keysL else list(firstR.columns)
+        del firstL, firstR
+        print(f"[INFO] 分割比對：{n_parts} 個分區、{workers} 個行程、記憶體預算約 {memory_limit_mb} MB")
+
+        # 串流寫入分區；沒有 key 時兩邊先對齊欄位，整列雜湊才會一致
+        for side, label, hash_keys in (("L", "左", keysL), ("R", "右", keysR)):
+            n_chunks, chunk_rows, _ = spooled[side]
+            rows = 0
+            for chunk_no in range(n_chunks):
+                df = compare.normalize_df(_load_raw(tmp, side, chunk_no), case_insensitive, types)
+                if not hash_keys:
+                    df = df.reindex(columns=all_cols, fill_value="")
+                _write_partitions(df, hash_keys or None, n_parts, tmp, side, chunk_no)
+                rows += len(df)
+            print(f"[INFO] {label}檔 {rows} 列已分區（每段 {chunk_rows} 列）")
+
+        number_cols = {c for c, t in types.items() if t == "number"}
+        # 結果塊大小：合併時各分區各一塊，合計約一段（chunk）
+        block_rows = max(MIN_CHUNK_ROWS, chunk_rows_for(memory_limit_mb, len(all_cols)) // n_parts)
+        tasks = [(tmp, p, colsL, colsR, keysL, keysR, number_cols, tolerance, block_rows) for p in range(n_parts)]
+        if workers == 1:
+            peaks = [_compare_partition(t) for t in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                peaks = list(ex.map(_compare_partition, tasks))
+
+        budget = memory_limit_mb / workers
+        big = [mb for mb in peaks if mb * COMPARE_OVERHEAD > budget]
+        if big:
+            print(f"[Warn] {len(big)} 個分區超過每行程記憶體預算（最大約 {max(big):.0f} MB 資料），"
+                  f"可加大 --partitions 或 --memory-limit")
+
+        yield (keysL, types, merge_sorted(tmp, "onlyL", n_parts, colsL), merge_sorted(tmp, "onlyR", n_parts, colsR),
+               merge_sorted(tmp, "diff", n_parts, compare.diff_columns(len(keysL))))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
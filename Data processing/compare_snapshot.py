@@ -0,0 +1,174 @@
+"""
+compare.py 的比對快照
+
+每天拿今天的匯出檔和昨天的比，昨天的檔案前一天已經讀過、正規化過了。
+比對時每一邊正規化後存成快照，下次同一個檔案（內容雜湊相同）、同一張工作表再出現時直接載入：
+
+    <快照資料夾>/<檔名>_<工作表>_<內容雜湊前 8 碼>.snap.json     # 中繼資料
+    <快照資料夾>/<檔名>_<工作表>_<內容雜湊前 8 碼>.parquet|.pkl  # 正規化後的資料 + 整列 / key 雜湊
+
+- 檔案指紋沿用 parse_cache.file_fingerprint（內容 SHA-1），檔案搬移、改名不影響
+- 正規化方式（NORMALIZE_VERSION、忽略大小寫、--column-type）不同的快照不會被拿來用
+- 欄位型別存在快照裡；另一邊是新檔時沿用快照的型別正規化，兩邊才會一致
+- compare.py 的左右兩邊都可以直接給 .snap.json
+"""
+import os
+import json
+import glob
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from parse_cache import file_fingerprint, save_frame, load_frame
+from row_hash import row_fingerprint
+
+SNAPSHOT_SUFFIX = ".snap.json"
+SNAPSHOT_KEEP = 60          # 最多保留幾份快照（依建立時間，舊的刪除）
+ROW_HASH_COL = "__row_hash"
+KEY_HASH_COL = "__key_hash"
+
+
+def is_snapshot_path(path) -> bool:
+    return str(path).lower().endswith(SNAPSHOT_SUFFIX)
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """整列雜湊，欄位依名稱排序（與 compare.compare_keyless 對齊欄位的方式相同）"""
+    return row_fingerprint(df, sorted(df.columns))
+
+
+# ===== 存檔格式 =====
+def _to_storable(df: pd.DataFrame, types: dict) -> pd.DataFrame:
+    """number 欄全為數字 / 空白時轉成 Float64，讓整張表能存成 Parquet"""
+    out = df.copy()
+    for i, c in enumerate(out.columns):
+        if types.get(c) != "number":
+            continue
+        s = out.iloc[:, i]
+        blank = s.eq("")
+        num = pd.to_numeric(s.mask(blank), errors="coerce")
+        if (num.notna() | blank).all():
+            out.isetitem(i, num.astype("Float64"))
+    return out
+
+
+def _from_storable(df: pd.DataFrame) -> pd.DataFrame:
+    """_to_storable 的反向：Float64 → 整數值為 int、其餘 float，空白為 ''（與 compare.normalize_df 相同）"""
+    for i, c in enumerate(df.columns):
+        s = df.iloc[:, i]
+        if not isinstance(s.dtype, pd.Float64Dtype):
+            continue
+        vals = s.to_numpy(dtype=float, na_value=np.nan)
+        out = np.full(len(vals), "", dtype=object)
+        ok = ~np.isnan(vals)
+        integral = ok & (vals % 1 == 0) & (np.abs(vals) < 2 ** 53)
+        out[ok] = vals[ok]
+        out[integral] = vals[integral].astype(np.int64)
+        df.isetitem(i, pd.Series(out, index=df.index, dtype=object))
+    return df
+
+
+# ===== 快照 =====
+class Snapshot:
+    def __init__(self, meta: dict, df: pd.DataFrame, row_hash: np.ndarray, key_hash=None):
+        self.meta = meta
+        self.df = df
+        self.row_hash = row_hash
+        self.key_hash = key_hash
+
+    @property
+    def types(self) -> dict:
+        return self.meta["types"]
+
+    @property
+    def label(self) -> str:
+        return f"{self.meta['source']}（快照 {self.meta['created']}）"
+
+
+def load_snapshot(meta_path) -> Snapshot:
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    raw = load_frame(os.path.join(os.path.dirname(os.path.abspath(meta_path)), meta["data"]))
+    row_hash = raw.pop(ROW_HASH_COL).to_numpy(dtype=np.uint64)
+    key_hash = raw.pop(KEY_HASH_COL).to_numpy(dtype=np.uint64) if KEY_HASH_COL in raw.columns else None
+    return Snapshot(meta, _from_storable(raw), row_hash, key_hash)
+
+
+class SnapshotStore:
+    def __init__(self, root, normalize_version, keep=SNAPSHOT_KEEP):
+        self.root = root
+        self.version = normalize_version
+        self.keep = keep
+        self._sha1 = {}
+        os.makedirs(root, exist_ok=True)
+
+    def sha1(self, path) -> str:
+        key = os.path.abspath(path)
+        if key not in self._sha1:
+            self._sha1[key] = file_fingerprint(path)["sha1"]
+        return self._sha1[key]
+
+    def _metas(self):
+        for path in glob.glob(os.path.join(self.root, "*" + SNAPSHOT_SUFFIX)):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    yield path, json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def _matches(self, meta, sha1, sheet, case_insensitive, overrides) -> bool:
+        return (meta.get("version") == self.version and meta.get("sha1") == sha1 and meta.get("sheet") == sheet
+                and meta.get("case_insensitive") == bool(case_insensitive)
+                and meta.get("overrides", {}) == dict(overrides or {}))
+
+    def find(self, path, sheet, case_insensitive=False, overrides=None):
+        """同內容、同工作表、同正規化方式的快照；沒有時回傳 None"""
+        sha1 = self.sha1(path)
+        for meta_path, meta in self._metas():
+            if self._matches(meta, sha1, sheet, case_insensitive, overrides):
+                try:
+                    return load_snapshot(meta_path)
+                except Exception:
+                    # 資料檔缺損：當作沒有快照
+                    return None
+        return None
+
+    def save(self, path, sheet, df, types, row_hash, case_insensitive=False, overrides=None,
+             keys=(), key_hash=None) -> str:
+        sha1 = self.sha1(path)
+        stem = f"{os.path.splitext(os.path.basename(path))[0]}_{sheet}_{sha1[:8]}"
+        stored = _to_storable(df, types)
+        stored[ROW_HASH_COL] = row_hash
+        if key_hash is not None:
+            stored[KEY_HASH_COL] = key_hash
+        data = save_frame(stored.reset_index(drop=True), os.path.join(self.root, stem))
+        meta = {
+            "version": self.version,
+            "source": os.path.abspath(path),
+            "sha1": sha1,
+            "sheet": sheet,
+            "case_insensitive": bool(case_insensitive),
+            "overrides": dict(overrides or {}),
+            "types": {c: types[c] for c in df.columns if c in types},
+            "columns": list(df.columns),
+            "keys": list(keys),
+            "rows": int(len(df)),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "data": data,
+        }
+        meta_path = os.path.join(self.root, stem + SNAPSHOT_SUFFIX)
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, meta_path)
+        self.prune()
+        return meta_path
+
+    def prune(self):
+        """只保留最新 keep 份；資料檔與中繼資料一起刪"""
+        metas = sorted(self._metas(), key=lambda pm: pm[1].get("created", ""), reverse=True)
+        for meta_path, meta in metas[self.keep:]:
+            for p in [meta_path] + ([os.path.join(self.root, meta["data"])] if meta.get("data") else []):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
@@ -0,0 +1,254 @@
+"""
+多份 TOTAL 的變動時間軸（稽核：某張憑單的預計付款日什麼時候改過、改了幾次）
+
+用法：
+    python compare_timeline.py <資料夾> --keys 憑單單號 序號 [--pattern "TOTAL_*.xlsx"] [--output timeline.xlsx]
+
+資料夾內符合 pattern 的檔案依檔名排序（TOTAL_YYYYMMDD_HHMM 即時間順序），相鄰兩份依序比對，串成每個 key 的歷程：
+- FILES       ：每份檔案的列數，以及與前一份相比新增 / 消失 / 有變動的 key 數
+- HISTORY     ：每個 key 第一次 / 最後一次出現的檔案、出現在幾份檔案、變動幾次、變動過的欄位
+- TRANSITIONS ：每一次欄位值的變化（從哪份檔案到哪份檔案、舊值 → 新值）
+
+- 每份檔案只讀一次：有快照（compare_snapshot）時直接載入，沒有時讀完存成快照，與 compare.py 共用
+- 相鄰兩份以 key + 同 key 第幾筆配對，先比整列雜湊，只有雜湊不同的列才逐欄比對，時間約與總列數成正比
+- 欄位型別由第一份檔案判斷，之後的檔案沿用（新出現的欄位才另外判斷）；
+  快照裡的型別和時間軸已決定的不同時不用該快照，改讀原檔依時間軸的型別正規化，避免 1 / "1" 這類假變動
+"""
+import os
+import glob
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import compare
+from compare_snapshot import SnapshotStore, row_hashes
+from excel_reader import ENGINES, open_workbook
+from excel_writer import open_streaming_workbook, write_frame
+from row_hash import row_fingerprint
+
+DEFAULT_PATTERN = "TOTAL_*.xlsx"
+COL_WIDTH = 16
+
+
+def list_files(folder, pattern=DEFAULT_PATTERN):
+    """符合 pattern 的檔案依檔名排序；略過 Excel 暫存檔 ~$"""
+    files = [p for p in glob.glob(os.path.join(folder, pattern)) if not os.path.basename(p).startswith("~$")]
+    return sorted(files, key=lambda p: os.path.basename(p))
+
+
+class Timeline:
+    def __init__(self, keys=None, sheet="TOTAL", case_insensitive=False, overrides=None,
+                 tolerance=compare.NUMERIC_TOLERANCE, store=None, engine=None):
+        self.keys = list(keys or [])
+        self.sheet = sheet
+        self.case_insensitive = case_insensitive
+        self.overrides = dict(overrides or {})
+        self.tolerance = tolerance
+        self.store = store
+        self.engine = engine
+        self.types = {}
+
+    # ===== 讀檔（快照優先）=====
+    def _load(self, path):
+        """
+        回傳 (正規化後的 df, 整列雜湊, 來源)；沒有該工作表時回傳 None。
+        來源：snapshot（直接用快照）/ read（讀原檔，之後存快照）/ retyped（快照型別不同，改讀原檔、不覆寫快照）
+        """
+        snap = self.store.find(path, self.sheet, self.case_insensitive, self.overrides) if self.store else None
+        if snap is not None:
+            conflict = {c: t for c, t in snap.types.items() if self.types.get(c, t) != t}
+            if not conflict:
+                for c, t in snap.types.items():
+                    self.types.setdefault(c, t)
+                return snap.df, snap.row_hash, "snapshot"
+            print(f"[INFO] {os.path.basename(path)} 快照的欄位型別與先前的檔案不同（"
+                  + "、".join(f"{c}: {t} → {self.types[c]}" for c, t in conflict.items()) + "），改讀原檔")
+
+        with open_workbook(path, self.engine) as book:
+            if self.sheet not in book.sheet_names:
+                return None
+            raw = book.parse(self.sheet)
+        self.types.update(compare.infer_column_types([raw], self.overrides, self.types))
+        df = compare.normalize_df(raw, self.case_insensitive, self.types)
+        return df, row_hashes(df), "read" if snap is None else "retyped"
+
+    def _resolve_keys(self, df):
+        if self.keys:
+            missing = [k for k in self.keys if k not in df.columns]
+            if missing:
+                raise SystemExit(f"[Error] 指定的 key 欄位不存在：{', '.join(missing)}")
+        else:
+            self.keys, _ = compare.pick_keys(df, df)
+            if not self.keys:
+                raise SystemExit("[Error] 自動找不到合適的 key，請用 --keys 指定")
+            print(f"[INFO] 自動選用 key：{', '.join(self.keys)}")
+
+    def _key_table(self, df, row_hash):
+        """key 欄 + 同 key 第幾筆（__occ）+ 列位置（__pos）+ 整列雜湊（__h）+ key 識別雜湊（__id）"""
+        knames = [f"__k{i}" for i in range(len(self.keys))]
+        kt = compare._key_frame(df, self.keys, knames, "__pos")
+        kt["__h"] = row_hash
+        kt["__id"] = row_fingerprint(kt, knames + ["__occ"])
+        return kt
+
+    # ===== 相鄰兩份比對 =====
+    def _step(self, prev, cur, kt_prev, kt_cur, from_label, to_label):
+        knames = [f"__k{i}" for i in range(len(self.keys))]
+        # 只取兩邊都有的配對（inner）：outer merge 的單邊列會補 NaN，uint64 雜湊 / 位置被轉成 float64 而失真
+        both = kt_prev[knames + ["__occ", "__pos", "__h"]].merge(
+            kt_cur[knames + ["__occ", "__pos", "__h"]],
+            on=knames + ["__occ"], how="inner", suffixes=("_p", "_c"), sort=False,
+        )
+        changed = both[both["__h_p"] != both["__h_c"]].sort_values("__pos_c")
+        # key + 第幾筆在各自檔案內唯一，沒配到的就是新增 / 消失
+        n_new = len(kt_cur) - len(both)
+        n_gone = len(kt_prev) - len(both)
+
+        pP = changed["__pos_p"].to_numpy(dtype=np.int64)
+        pC = changed["__pos_c"].to_numpy(dtype=np.int64)
+        ids = kt_cur["__id"].to_numpy(dtype=np.uint64)[pC]
+        cols = [c for c in cur.columns if c in prev.columns and c not in self.keys]
+        parts = []
+        for j, col in enumerate(cols):
+            old = prev[col].to_numpy(dtype=object)[pP]
+            new = cur[col].to_numpy(dtype=object)[pC]
+            idx = np.flatnonzero(compare._values_differ(old, new, self.types.get(col) == "number", self.tolerance))
+            if len(idx):
+                parts.append(pd.DataFrame({"__pair": idx, "__col": j, "__id": ids[idx], "column": col,
+                                           "old_value": old[idx], "new_value": new[idx]}))
+        if parts:
+            tr = pd.concat(parts, ignore_index=True).sort_values(["__pair", "__col"], kind="stable")
+            tr.insert(0, "to_file", to_label)
+            tr.insert(0, "from_file", from_label)
+            tr = tr.drop(columns=["__pair", "__col"])
+            n_changed = tr["__id"].nunique()
+        else:
+            tr, n_changed = None, 0
+        return tr, n_new, n_gone, n_changed
+
+    # ===== 主流程 =====
+    def run(self, files):
+        labels, file_rows = [], []
+        presence, firsts, transitions = [], [], []
+        prev = kt_prev = None
+        for path in files:
+            loaded = self._load(path)
+            label = os.path.basename(path)
+            if loaded is None:
+                print(f"[SKIP] {label} 沒有工作表 {self.sheet}")
+                continue
+            df, h, source = loaded
+            if not labels:
+                self._resolve_keys(df)
+            missing = [k for k in self.keys if k not in df.columns]
+            if missing:
+                print(f"[SKIP] {label} 缺少 key 欄位：{', '.join(missing)}")
+                continue
+            if source == "read" and self.store is not None:
+                self.store.save(path, self.sheet, df, self.types, h, self.case_insensitive, self.overrides,
+                                self.keys, row_fingerprint(df, self.keys))
+
+            i = len(labels)
+            kt = self._key_table(df, h)
+            presence.append(pd.DataFrame({"__id": kt["__id"].to_numpy(), "file": i}))
+            # 第一次出現的 key：記下 key 值（之後只用識別雜湊）
+            seen_before = np.zeros(len(kt), dtype=bool) if prev is None else kt["__id"].isin(kt_prev["__id"]).to_numpy()
+            firsts.append(kt.loc[~seen_before, ["__id", "__occ"]].assign(
+                **{k: df[k].to_numpy(dtype=object)[kt.loc[~seen_before, "__pos"].to_numpy()] for k in self.keys}))
+
+            info = {"file": label, "rows": len(df), "new": len(df), "removed": 0, "changed": 0,
+                    "source": source}
+            if prev is not None:
+                tr, info["new"], info["removed"], info["changed"] = self._step(prev, df, kt_prev, kt, labels[-1], label)
+                if tr is not None:
+                    transitions.append(tr)
+            file_rows.append(info)
+            labels.append(label)
+            print(f"[INFO] {label}：{len(df)} 列，新增 {info['new']}、消失 {info['removed']}、變動 {info['changed']}"
+                  f"{'（快照）' if source == 'snapshot' else ''}")
+            prev, kt_prev = df, kt
+
+        if not labels:
+            raise SystemExit("[Error] 沒有可比對的檔案")
+        return self._build_outputs(labels, file_rows, presence, firsts, transitions)
+
+    def _build_outputs(self, labels, file_rows, presence, firsts, transitions):
+        label_arr = np.array(labels, dtype=object)
+        pres = pd.concat(presence, ignore_index=True)
+        g = pres.groupby("__id", sort=False)["file"]
+        stats = pd.DataFrame({"first": g.min(), "last": g.max(), "files_present": g.size()})
+
+        keys_first = pd.concat(firsts, ignore_index=True).drop_duplicates("__id")
+        trans = pd.concat(transitions, ignore_index=True) if transitions else \
+            pd.DataFrame(columns=["from_file", "to_file", "__id", "column", "old_value", "new_value"])
+        if len(trans):
+            tg = trans.groupby("__id", sort=False)
+            change_stats = pd.DataFrame({
+                "changes": tg["to_file"].nunique(),
+                "changed_columns": tg["column"].agg(lambda s: "、".join(dict.fromkeys(s))),
+            })
+        else:
+            change_stats = pd.DataFrame({"changes": pd.Series(dtype="int64"), "changed_columns": pd.Series(dtype=object)})
+
+        hist = keys_first.join(stats, on="__id").join(change_stats, on="__id")
+        hist["changes"] = hist["changes"].fillna(0).astype(np.int64)
+        hist["changed_columns"] = hist["changed_columns"].fillna("")
+        hist["first_seen"] = label_arr[hist["first"].to_numpy()]
+        hist["last_seen"] = label_arr[hist["last"].to_numpy()]
+        hist["in_latest"] = hist["last"].to_numpy() == len(labels) - 1
+        hist["occurrence"] = hist["__occ"] + 1
+        history = hist[self.keys + ["occurrence", "first_seen", "last_seen", "files_present", "in_latest",
+                                    "changes", "changed_columns"]].reset_index(drop=True)
+
+        # 變動明細補上 key 值
+        key_vals = keys_first.set_index("__id")[self.keys + ["__occ"]]
+        trans = trans.join(key_vals, on="__id")
+        trans["occurrence"] = trans["__occ"] + 1
+        trans = trans[self.keys + ["occurrence", "from_file", "to_file", "column", "old_value", "new_value"]]
+        return pd.DataFrame(file_rows), history, trans.reset_index(drop=True)
+
+
+def write_timeline(path, files_df, history, transitions):
+    wb = open_streaming_workbook(path)
+    try:
+        write_frame(wb, files_df, "FILES", col_width=COL_WIDTH, freeze_header=True)
+        write_frame(wb, history, "HISTORY", col_width=COL_WIDTH, freeze_header=True, autofilter=True)
+        write_frame(wb, transitions, "TRANSITIONS", col_width=COL_WIDTH, freeze_header=True, autofilter=True)
+    finally:
+        wb.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-key change history across a folder of TOTAL files.")
+    ap.add_argument("folder", help="Folder containing the TOTAL files.")
+    ap.add_argument("--pattern", default=DEFAULT_PATTERN, help=f"File name pattern. Default: {DEFAULT_PATTERN}")
+    ap.add_argument("--sheet", default="TOTAL", help="Sheet to read from each file. Default: TOTAL")
+    ap.add_argument("--keys", nargs="+", help="Key columns (order matters). Default: picked automatically.")
+    ap.add_argument("--case-insensitive", action="store_true", help="Case-insensitive for text comparison.")
+    ap.add_argument("--column-type", nargs="+", default=[], metavar="COLUMN=TYPE",
+                    help=f"Override inferred column types ({'/'.join(compare.COLUMN_TYPES)}).")
+    ap.add_argument("--tolerance", type=float, default=compare.NUMERIC_TOLERANCE,
+                    help=f"Numeric tolerance. Default: {compare.NUMERIC_TOLERANCE:g}")
+    ap.add_argument("--output", default=None, help="Output workbook. Default: <folder>/timeline_<timestamp>.xlsx")
+    ap.add_argument("--engine", choices=ENGINES, default=None, help="Excel reader engine. Default: EXCEL_ENGINE (auto).")
+    ap.add_argument("--snapshot-dir", default=compare.SNAPSHOT_DIR, help="Snapshot folder shared with compare.py.")
+    ap.add_argument("--no-snapshot", action="store_true", help="Do not load or save snapshots.")
+    args = ap.parse_args()
+
+    files = list_files(args.folder, args.pattern)
+    if len(files) < 2:
+        raise SystemExit(f"[Error] {args.folder} 內符合 {args.pattern} 的檔案少於 2 份")
+    print(f"[INFO] 共 {len(files)} 份檔案：{os.path.basename(files[0])} … {os.path.basename(files[-1])}")
+
+    store = None if args.no_snapshot else SnapshotStore(args.snapshot_dir, compare.NORMALIZE_VERSION)
+    timeline = Timeline(args.keys, args.sheet, args.case_insensitive, compare.parse_type_overrides(args.column_type),
+                        args.tolerance, store, args.engine)
+    files_df, history, transitions = timeline.run(files)
+
+    output = args.output or os.path.join(args.folder, f"timeline_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+    write_timeline(output, files_df, history, transitions)
+    print(f"已輸出：{output}（{len(history)} 個 key、{len(transitions)} 筆欄位變動）")
+
+
+if __name__ == "__main__":
+    main()
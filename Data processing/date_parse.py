@@ -0,0 +1,162 @@
+"""
+憑單日期欄共用解析
+
+一欄 20 萬列通常只有幾百個不同日期，所以：
+1) 先 factorize，只解析「不重複值」
+2) 依序嘗試：%Y/%m/%d → %Y-%m-%d → %Y.%m.%d → 含時間（%Y-%m-%d %H:%M:%S）
+   → 民國年（113/05/01、113.05.01、1130501）→ 西元 8 碼（20240501）→ Excel 序號
+3) 解析結果依代碼廣播回每一列
+4) 字串的解析結果存在有上限的快取，跨工作表 / 跨檔案共用
+"""
+import re
+from collections import OrderedDict
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+
+DATE_CACHE_SIZE = 100_000
+EXCEL_EPOCH = "1899-12-30"
+
+# 視為空白的字串（可往下填滿）
+BLANK_STRINGS = {"", "nan", "NaT"}
+
+STR_FORMATS = ["%Y/%m/%d", "%Y-%m-%d", "%Y.%m.%d", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]
+_ROC_SEP_RE = r"^(\d{2,3})[/.\-](\d{1,2})[/.\-](\d{1,2})$"
+_ROC_COMPACT_RE = r"^(\d{3})(\d{2})(\d{2})$"
+_NUMERIC_RE = re.compile(r"^[+-]?\d+(\.\d+)?$")
+
+_cache: "OrderedDict[tuple, pd.Timestamp]" = OrderedDict()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def _roc_to_datetime(parts: pd.DataFrame) -> pd.Series:
+    y = pd.to_numeric(parts[0], errors="coerce") + 1911
+    m = pd.to_numeric(parts[1], errors="coerce")
+    d = pd.to_numeric(parts[2], errors="coerce")
+    return pd.to_datetime(pd.DataFrame({"year": y, "month": m, "day": d}), errors="coerce")
+
+
+def _parse_strings(u: pd.Series, lenient: bool) -> pd.Series:
+    """u：去頭尾空白後的不重複字串。回傳同 index 的 datetime64 Series。"""
+    out = pd.Series(pd.NaT, index=u.index, dtype="datetime64[ns]")
+
+    def todo():
+        return out.isna()
+
+    for fmt in STR_FORMATS:
+        m = todo()
+        if not m.any():
+            return out
+        out[m] = pd.to_datetime(u[m], format=fmt, errors="coerce")
+
+    # 民國年
+    for pattern in (_ROC_SEP_RE, _ROC_COMPACT_RE):
+        m = todo()
+        if not m.any():
+            return out
+        parts = u[m].str.extract(pattern)
+        ok = parts[0].notna()
+        if ok.any():
+            out[parts.index[ok]] = _roc_to_datetime(parts[ok]).to_numpy()
+
+    # 西元 8 碼
+    m = todo() & u.str.fullmatch(r"\d{8}")
+    if m.any():
+        out[m] = pd.to_datetime(u[m], format="%Y%m%d", errors="coerce")
+
+    # 數字字串 → Excel 序號
+    m = todo() & u.str.match(_NUMERIC_RE)
+    if m.any():
+        nums = pd.to_numeric(u[m], errors="coerce")
+        out[m] = pd.to_datetime(nums, unit="D", origin=EXCEL_EPOCH, errors="coerce")
+
+    # 寬鬆模式：其餘交給 pandas 自行判斷（. / 統一換成 -）
+    if lenient:
+        m = todo()
+        if m.any():
+            s = u[m].str.replace(".", "-", regex=False).str.replace("/", "-", regex=False)
+            out[m] = pd.to_datetime(s, format="mixed", errors="coerce")
+
+    return out
+
+
+def parse_unique_dates(uniques, lenient=False) -> np.ndarray:
+    """
+    uniques：不重複的原始值（字串 / 數字 / 日期物件）。
+    回傳等長的 datetime64[ns] 陣列，無法解析為 NaT。
+    """
+    n = len(uniques)
+    result = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    str_idx, str_vals = [], []
+    num_idx, num_vals = [], []
+    for i, v in enumerate(uniques):
+        if isinstance(v, str):
+            s = v.strip()
+            key = (lenient, s)
+            hit = _cache.get(key)
+            if hit is not None:
+                _cache.move_to_end(key)
+                result[i] = hit
+            elif s not in BLANK_STRINGS:
+                str_idx.append(i)
+                str_vals.append(s)
+        elif isinstance(v, (datetime, date, np.datetime64)):
+            try:
+                ts = pd.Timestamp(v)
+                if ts.tzinfo is not None:
+                    ts = ts.tz_localize(None)
+                result[i] = ts.to_datetime64()
+            except (ValueError, OverflowError):
+                pass
+        elif isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool):
+            num_idx.append(i)
+            num_vals.append(v)
+
+    if num_idx:
+        parsed = pd.to_datetime(pd.Series(num_vals, dtype="float64"), unit="D", origin=EXCEL_EPOCH, errors="coerce")
+        result[num_idx] = parsed.to_numpy()
+
+    if str_idx:
+        parsed = _parse_strings(pd.Series(str_vals, dtype=object), lenient).to_numpy()
+        result[str_idx] = parsed
+        for s, ts in zip(str_vals, parsed):
+            _cache[(lenient, s)] = ts
+        while len(_cache) > DATE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return result
+
+
+def coerce_dates(s: pd.Series, ffill=False, lenient=False) -> pd.Series:
+    """
+    整欄日期解析，回傳 datetime64（只保留年月日）。
+
+    ffill   ：空白列沿用上一個非空白值（處理「只有第一列有日期，下面明細空白」）
+    lenient ：格式都對不上時，再交給 pandas 自由判斷
+    """
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        out = s.ffill() if ffill else s
+        return out.dt.floor("D")
+
+    codes, uniques = pd.factorize(s.astype(object), use_na_sentinel=True)
+    if len(uniques) == 0:
+        return pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    uniques = np.asarray(uniques, dtype=object)
+    parsed = parse_unique_dates(uniques, lenient)
+
+    if ffill:
+        # 空白（NaN / "" / "nan" / "NaT"）的代碼設成 -1，再往下沿用前一個代碼
+        blank_u = np.array(
+            [isinstance(v, str) and v.strip() in BLANK_STRINGS for v in uniques], dtype=bool
+        )
+        row_blank = (codes < 0) | blank_u[np.maximum(codes, 0)]
+        filled = pd.Series(np.where(row_blank, np.nan, codes)).ffill()
+        codes = filled.fillna(-1).to_numpy(dtype=np.int64)
+
+    values = np.where(codes >= 0, parsed[np.maximum(codes, 0)], np.datetime64("NaT"))
+    out = pd.Series(values.astype("datetime64[ns]"), index=s.index)
+    return out.dt.floor("D")
@@ -1,10 +1,37 @@
+"""
+依付款條件規則檢查 TOTAL 的預計付款日，輸出不一致報告
+
+用法：
+    python excel_error_log.py                                   # 只檢查 total/ 內最新的 TOTAL_YYYYMMDD_HHMM 檔
+    python excel_error_log.py --batch                           # 檢查 total/ 內全部 TOTAL 檔（多行程）
+    python excel_error_log.py --from 20240101 --to 20241231     # 只檢查檔名時間在範圍內的 TOTAL 檔
+    python excel_error_log.py --batch --dir <資料夾> --workers 4
+
+批次模式每份檔案各自輸出報告到 compare/batch_<時間>/，另外輸出一份趨勢活頁簿
+（各檔不一致筆數，依單據月份、依付款條件）；規則表與假日檔每個行程只載入一次。
+"""
 import os
 import glob
 import re
-import calendar
-from datetime import datetime, date
-import pandas as pd
 import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import pandas as pd
+from excel_reader import find_companion, read_columns, read_table
+from excel_sanitize import sanitize_frame
+from excel_writer import open_streaming_workbook, write_frame
+from date_parse import coerce_dates
+from pay_rules import RuleTable, expected_pay_dates, unmatched_terms, day_diff
+from biz_calendar import BusinessCalendar
+from pay_check_state import (CheckState, rules_fingerprint, input_hashes, reuse_results, status_column,
+                             STATUS_NEW_MISMATCH, STATUS_RESOLVED)
+
+USE_CHECK_STATE = True      # 沿用上次結果，只重算新增 / 變動的列（False 時每次全部重算、不寫狀態）
+BATCH_WORKERS = min(4, os.cpu_count() or 1)   # 批次模式的行程數
+TREND_COL_WIDTH = 14
 
 # ========= 路徑設定 =========
 if getattr(sys, "frozen", False):
@@ -16,268 +43,424 @@ else:
 
 folder_path = os.path.join(base_dir, "total")
 output_dir = os.path.join(base_dir, "compare")
-os.makedirs(output_dir, exist_ok=True)
+rules_path = os.path.join(base_dir, "pay_rules.json")   # 付款條件規則表
+holidays_path = os.path.join(base_dir, "holidays.csv")  # 假日 / 補班日（規則有設 shift 時使用）
+state_dir = os.path.join(output_dir, "_state")          # 增量檢查狀態（上次每列的結果）
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+# ========= 付款條件規則表 / 營業日行事曆 =========
+def load_rules(rules_file=rules_path, holidays_file=holidays_path, verbose=True):
+    """回傳 (RuleTable, BusinessCalendar 或 None)；規則有設 shift 時才載入假日檔"""
+    log = print if verbose else _quiet
+    if not os.path.exists(rules_file):
+        raise FileNotFoundError(f"找不到付款條件規則表：{rules_file}")
+    rule_table = RuleTable.load(rules_file)
 
-print("base_dir =", base_dir)       # 實際路徑
-print("folder_path =", folder_path)
-print("output_dir  =", output_dir)
+    biz_cal = None
+    if rule_table.needs_calendar:
+        if os.path.exists(holidays_file):
+            biz_cal = BusinessCalendar.load(holidays_file)
+            log(f"假日檔：{holidays_file}（假日 {len(biz_cal.holidays)} 天、補班 {len(biz_cal.workdays)} 天）")
+        else:
+            biz_cal = BusinessCalendar()
+            log(f"[Warn] 找不到假日檔 {holidays_file}，只以週六、週日為非營業日")
+    return rule_table, biz_cal
 
-# ========= 抓取最新 TOTAL_YYYYMMDD_HHMM 檔 =========
-excel_files = [f for f in glob.glob(os.path.join(folder_path, "*.xls*"))
-               if not os.path.basename(f).startswith("~$")]
-if not excel_files:
-    raise FileNotFoundError(f"在 {folder_path} 找不到任何 Excel 檔案")
 
+# ========= 抓取 TOTAL_YYYYMMDD_HHMM 檔 =========
 pattern = re.compile(r"TOTAL_(\d{8})_(\d{4})")
+month_pattern = re.compile(r"TOTAL_\d{8}_\d{4}_(\d{6})\.")   # merge 按月分檔：TOTAL_<時間>_<YYYYMM>.xlsx
 def extract_datetime(filename):
     m = pattern.search(os.path.basename(filename))
     if m:
         return datetime.strptime(m.group(1) + m.group(2), "%Y%m%d%H%M")
     return datetime.fromtimestamp(os.path.getmtime(filename))
 
-latest_file = max(excel_files, key=extract_datetime)
-print(f"最新檔案：{latest_file}")
-
-# ========= 讀取資料 =========
-df = pd.read_excel(latest_file, dtype=str)
-df.columns = [str(c).strip() for c in df.columns]
-
-# ========= 時間小工具 =========
-def to_date(val):
-    if pd.isna(val): return pd.NaT
-    s = str(val).strip().replace(".", "-").replace("/", "-")
-    return pd.to_datetime(s, errors="coerce").date()
-
-def add_months(d: date, months: int) -> date:
-    y = d.year + (d.month - 1 + months) // 12
-    m = (d.month - 1 + months) % 12 + 1
-    last = calendar.monthrange(y, m)[1]
-    return date(y, m, min(d.day, last))
-
-def set_month_day(d: date, months_ahead: int, day: int) -> date:
-    y = d.year + (d.month - 1 + months_ahead) // 12
-    m = (d.month - 1 + months_ahead) % 12 + 1
-    return date(y, m, day)
-
-def month_end(d: date) -> date:
-    last = calendar.monthrange(d.year, d.month)[1]
-    return date(d.year, d.month, last)
-
-# ========= 跳過條件 =========
-SKIP_TERMS = {
-    "月結30天(EXW date)",
-    "月結60天(FCA date)",
-    "請財務部確認付款日",
-}
-
-# ========= 規則主函式 =========
-def expected_pay_date(doc_dt: date, term_name: str):
+def total_sort_key(filename):
     """
-    優先序：
-    1) 跳過：SKIP_TERMS
-    2) 當月15號 → 當月15
-    3) 當月18號 → 當月18
-    4) 次月15號付款 → 次月15
-    5) 月結(18+30n)天 → 次月起 n 個月後的 18 日（18/48/78…）
-    6) 月結30/60/120天 → +1/2/4 月取月底
-
-    其餘 → 未支援
+    檔名時間 → 按月分檔的月份（未分檔、nodate 排最前）→ 檔名。
+    同一次 merge 按月分成多份時時間相同，最後一份固定是最新月份（merge 把 ERRORS 也寫在這份）。
     """
-    if pd.isna(doc_dt) or not term_name:
-        return pd.NaT, "無單據日期或付款條件空白"
+    m = month_pattern.search(os.path.basename(filename))
+    return extract_datetime(filename), m.group(1) if m else "", filename
 
-    term = str(term_name).strip()
-    if term in SKIP_TERMS:
-        return pd.NaT, "使用者指定：跳過比對"
+def list_total_files(folder, start=None, end=None):
+    """資料夾內的 Excel 檔（略過 ~$ 暫存檔）依 total_sort_key 排序；start / end（datetime，end 不含）限定檔名時間範圍"""
+    files = [f for f in glob.glob(os.path.join(folder, "*.xls*"))
+             if not os.path.basename(f).startswith("~$")]
+    stamped = sorted((total_sort_key(f), f) for f in files)
+    return [f for (t, _, _), f in stamped if (start is None or t >= start) and (end is None or t < end)]
 
-    t = term.replace(" ", "")
 
-    if re.fullmatch(r"當月15號", t):
-        return date(doc_dt.year, doc_dt.month, 15), "當月15號 → 當月15日"
+# ========= 時間小工具 =========
+def to_date_col(s: pd.Series) -> pd.Series:
+    """整欄轉成 datetime64（只保留年月日；已是日期型別直接取日；文字只解析不重複值，格式都不符時交給 pandas 自由判斷）"""
+    return coerce_dates(s, lenient=True)
+
+def fmt(s: pd.Series) -> pd.Series:
+    return s.dt.strftime("%Y/%m/%d").fillna("")
+
+def sanitize_df(df_in: pd.DataFrame) -> pd.DataFrame:
+    return sanitize_frame(df_in, na_rep="")
 
-    if re.fullmatch(r"當月18號付款", t):
-        # 單據日期 <= 18 號：當月 18 日
-        if doc_dt.day <= 18:
-            return date(doc_dt.year, doc_dt.month, 18), "當月18號付款（單據日≦18）→ 當月18日"
-        # 單據日期 > 18 號：次月 18 日
-        else:
-            pay_dt = set_month_day(doc_dt, 1, 18)
-            return pay_dt, "當月18號付款（單據日>18）→ 次月18日"
-
-    if re.fullmatch(r"次月15號付款", t):
-        return set_month_day(doc_dt, 1, 15), "次月15號付款 → 下個月15日"
-
-    m_any = re.fullmatch(r"月結(\d+)天", t)
-    if m_any:
-        days = int(m_any.group(1))
-        if days >= 18 and (days - 18) % 30 == 0:
-            months_ahead = 1 + (days - 18) // 30
-            return set_month_day(doc_dt, months_ahead, 18), f"月結{days}天 → +{months_ahead}個月的18日"
-        mapping_month_end = {30: 1, 60: 2, 120: 4}
-        if days in mapping_month_end:
-            months = mapping_month_end[days]
-            return month_end(add_months(doc_dt, months)), f"月結{days}天 → +{months}個月取月底"
-        return pd.NaT, f"未支援：月結{days}天"
-
-    return pd.NaT, "未支援（非月結X天/當月N號/次月N號）"
 
 # ========= 欄位對應 =========
-def pick_col(cands):
+# 報表會原樣帶出的欄位
+DISPLAY_COLS = ["憑單單號", "單據編號", "發票號碼", "供應商", "品名", "廠商代號", "廠商簡稱", "付款條件代號"]
+
+def pick_col(cands, columns):
     for c in cands:
-        if c in df.columns:
+        if c in columns:
             return c
     return None
 
-DOC_COL   = pick_col(["單據日期", "憑單日期"])
-TERM_COL  = pick_col(["付款條件名稱", "付款條件", "付款條件說明"])
-PLAN_COL  = pick_col(["預計付款日", "應付日期", "付款日期"])
-KEY_COL   = pick_col(["憑單單號", "單據編號", "憑單編號", "單號", "發票號碼"])
-VEND_COL  = pick_col(["廠商簡稱", "廠商名稱", "供應商名稱", "供應商"])
-
-if not DOC_COL or not TERM_COL:
-    miss = []
-    if not DOC_COL:  miss.append("單據日期/憑單日期")
-    if not TERM_COL: miss.append("付款條件名稱/付款條件")
-    raise ValueError("找不到必要欄位：" + "、".join(miss))
-
-# ========= 計算與比對 =========
-df["_單據日期(date)"] = df[DOC_COL].apply(to_date)
-df["_付款條件"] = df[TERM_COL].astype(str)
-
-exp_dates, reasons = [], []
-for doc_dt, term in zip(df["_單據日期(date)"], df["_付款條件"]):
-    pay, why = expected_pay_date(doc_dt, term)
-    exp_dates.append(pay)
-    reasons.append(why)
-
-df["系統預計付款日"] = exp_dates
-df["計算依據"] = reasons
-
-if "廠商簡稱" in df.columns:
-    special_mask = (
-        df["廠商簡稱"].astype(str).str.strip().eq("南科管理局")
-        & df["_付款條件"].astype(str).str.replace(" ", "").eq("次月15號付款")
-        & df["_單據日期(date)"].notna()
-    )
-
-    def _nk_custom_pay(d: date) -> date:
-        # 單據月份的 15 號
-        return date(d.year, d.month, 15)
 
-    df.loc[special_mask, "系統預計付款日"] = df.loc[special_mask, "_單據日期(date)"].apply(_nk_custom_pay)
-    df.loc[special_mask, "計算依據"] = "南科管理局特例：次月15號付款 → 當月15日"
-    
-
-if PLAN_COL:
-    df["_預計付款日(date)"] = df[PLAN_COL].apply(to_date)
-    comparable_mask = df["系統預計付款日"].notna()
-    df["是否一致"] = pd.NA
-    df.loc[comparable_mask, "是否一致"] = (
-        df.loc[comparable_mask, "_預計付款日(date)"] == df.loc[comparable_mask, "系統預計付款日"]
+# ========= 單檔檢查 =========
+def check_file(src_file, rule_table, biz_cal=None, out_path=None, use_state=USE_CHECK_STATE, verbose=True):
+    """
+    檢查一份 TOTAL，輸出報告到 out_path（預設 compare/TERMS_COMPARE_<時間>.xlsx）。
+    回傳摘要 dict：檔案、列數、各類筆數、報告路徑，以及 by_month / by_term（不一致筆數，Series）
+    """
+    log = print if verbose else _quiet
+
+    # ----- 讀取表頭（有 merge 輸出的 .parquet / .csv.gz 副本時優先讀副本）-----
+    src_path = find_companion(src_file) or src_file
+    if src_path != src_file:
+        log(f"讀取副本：{src_path}")
+    raw_cols = {str(c).strip(): c for c in read_columns(src_path)}   # 去空白欄名 → 原始欄名
+
+    DOC_COL   = pick_col(["單據日期", "憑單日期"], raw_cols)
+    TERM_COL  = pick_col(["付款條件名稱", "付款條件", "付款條件說明"], raw_cols)
+    PLAN_COL  = pick_col(["預計付款日", "應付日期", "付款日期"], raw_cols)
+    KEY_COL   = pick_col(["憑單單號", "單據編號", "憑單編號", "單號", "發票號碼"], raw_cols)
+    VEND_COL  = pick_col(["廠商簡稱", "廠商名稱", "供應商名稱", "供應商"], raw_cols)
+    VCODE_COL = pick_col(["廠商代號", "廠商代碼", "供應商代碼"], raw_cols)
+    LINE_COL  = pick_col(["序號", "項次", "行號"], raw_cols)
+
+    if not DOC_COL or not TERM_COL:
+        miss = []
+        if not DOC_COL:  miss.append("單據日期/憑單日期")
+        if not TERM_COL: miss.append("付款條件名稱/付款條件")
+        raise ValueError("找不到必要欄位：" + "、".join(miss))
+
+    # ----- 讀取資料（只讀用得到的欄位；日期保留原生型別，其餘以文字讀入）-----
+    use_cols = list(dict.fromkeys(
+        [c for c in (DOC_COL, TERM_COL, PLAN_COL, KEY_COL, VEND_COL, VCODE_COL, LINE_COL) if c]
+        + [c for c in DISPLAY_COLS if c in raw_cols]
+    ))
+    date_cols = {c for c in (DOC_COL, PLAN_COL) if c}
+    t0 = time.perf_counter()
+    df = read_table(src_path, [raw_cols[c] for c in use_cols],
+                    text_cols=[raw_cols[c] for c in use_cols if c not in date_cols])
+    df.columns = use_cols
+    log(f"[INFO] 讀取 {len(use_cols)}/{len(raw_cols)} 欄、{len(df)} 列：{time.perf_counter() - t0:.2f} 秒")
+
+    # ----- 計算與比對 -----
+    # 規則見 pay_rules.json / pay_rules.py：每個不重複的（付款條件, 廠商）只查一次規則表，整欄以 datetime64 計算
+    df["_單據日期(date)"] = to_date_col(df[DOC_COL])
+    df["_付款條件"] = df[TERM_COL].astype(str)
+    if PLAN_COL:
+        df["_預計付款日(date)"] = to_date_col(df[PLAN_COL])
+    else:
+        df["_預計付款日(date)"] = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+
+    # 增量檢查：輸入（key + 單據日期 + 付款條件 + 預計付款日 + 廠商）沒變的列直接沿用上次結果
+    row_hash, key_hash = input_hashes(
+        [df[c] for c in (KEY_COL, LINE_COL) if c],
+        df["_單據日期(date)"], df["_付款條件"], df["_預計付款日(date)"],
+        [df[c] for c in (VEND_COL, VCODE_COL) if c],
     )
-else:
-    df["_預計付款日(date)"] = pd.NaT
-    df["是否一致"] = pd.NA
-
-# ========= 顯示欄位/旗標 =========
-def fmt(d):
-    return "" if pd.isna(d) else d.strftime("%Y/%m/%d")
-
-df["單據日期(顯示)"]       = df["_單據日期(date)"].apply(fmt)
-df["預計付款日(顯示)"]     = df["_預計付款日(date)"].apply(fmt)
-df["系統預計付款日(顯示)"] = df["系統預計付款日"].apply(fmt)
-
-skip_mask = df["計算依據"].eq("使用者指定：跳過比對")
-unsupported_mask = df["系統預計付款日"].isna() & ~skip_mask
-mismatch_mask = (df["是否一致"] == False)
-
-# 相差天數
-df["相差天數"] = df.apply(
-    lambda r: (pd.Timestamp(r["_預計付款日(date)"]) - pd.Timestamp(r["系統預計付款日"])).days
-              if pd.notna(r["_預計付款日(date)"]) and pd.notna(r["系統預計付款日"]) else pd.NA,
-    axis=1
-)
-
-# ========= 別名成指定欄名 & 補空欄 =========
-if KEY_COL and KEY_COL != "憑單單號" and "憑單單號" not in df.columns:
-    df["憑單單號"] = df[KEY_COL]
-if DOC_COL and DOC_COL != "單據日期" and "單據日期" not in df.columns:
-    df["單據日期"] = df[DOC_COL]
-if TERM_COL and TERM_COL != "付款條件名稱" and "付款條件名稱" not in df.columns:
-    df["付款條件名稱"] = df[TERM_COL]
-if PLAN_COL and PLAN_COL != "預計付款日" and "預計付款日" not in df.columns:
-    df["預計付款日"] = df[PLAN_COL]
-if VEND_COL and VEND_COL != "廠商簡稱" and "廠商簡稱" not in df.columns:
-    df["廠商簡稱"] = df[VEND_COL]
-
-for col in ["憑單單號", "單據日期", "廠商代號", "廠商簡稱", "付款條件代號",
-            "付款條件名稱", "預計付款日", "系統預計付款日(顯示)", "相差天數", "計算依據"]:
-    if col not in df.columns:
-        df[col] = ""
-
-# ========= 報表 =========
-# 1) 不一致明細（依單據日期排序：由早到晚）
-mismatch_cols = [
-    "憑單單號", "單據日期", "廠商代號", "廠商簡稱", "付款條件代號",
-    "付款條件名稱", "預計付款日", "系統預計付款日(顯示)", "相差天數", "計算依據",
-]
-report_mismatch = df.loc[mismatch_mask, mismatch_cols].copy()
-report_mismatch["_sort_date"] = pd.to_datetime(report_mismatch["單據日期"], errors="coerce")
-report_mismatch = report_mismatch.sort_values(by="_sort_date", ascending=True).drop(columns=["_sort_date"])
-
-# 2) 統計（僅可比對列）
-total_mismatch = len(report_mismatch)
-by_term = (df.loc[mismatch_mask]
-             .groupby("付款條件名稱", dropna=False)
-             .size().reset_index(name="數量")
-             .sort_values("數量", ascending=False))
-summary_rows = [{"項目": "不一致總筆數（可比對）", "數量": total_mismatch}]
-if not by_term.empty:
-    summary_rows.append({"項目": "（依付款條件分組統計）", "數量": ""})
-summary_df = pd.DataFrame(summary_rows)
-
-# 3) 已跳過 / 未支援或缺資料（同欄位順序）
-report_skipped = df.loc[skip_mask, mismatch_cols].copy()
-report_unsupported = df.loc[unsupported_mask, mismatch_cols].copy()
-
-# 4) 全部檢查（原友善檢視）
-view_cols = []
-for c in ["憑單單號", "單據編號", "發票號碼", "供應商", "品名"]:
-    if c in df.columns: view_cols.append(c)
-view_cols += ["單據日期", "單據日期(顯示)", "付款條件名稱"]
-if "預計付款日" in df.columns: view_cols.append("預計付款日")
-view_cols += ["預計付款日(顯示)", "系統預計付款日(顯示)", "是否一致", "相差天數", "計算依據"]
-report_all = df[view_cols].copy()
-
-# ========= 輸出（清理控制字元 + xlsxwriter）=========
-_ILLEGAL_CTRL = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F]")
-def sanitize_df(df_in: pd.DataFrame) -> pd.DataFrame:
-    out = df_in.copy()
-    for c in out.columns:
-        if out[c].dtype == object:
-            out[c] = (
-                out[c].astype(str)
-                      .map(lambda s: "" if s == "nan" else s)
-                      .map(lambda s: _ILLEGAL_CTRL.sub("", s))
-            )
-    return out
-
-ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-out_path = os.path.join(output_dir, f"TERMS_COMPARE_{ts}.xlsx")
-
-_to_write = {
-    "不一致統計":          sanitize_df(summary_df),
-    "不一致_依付款條件":    sanitize_df(by_term) if not by_term.empty else pd.DataFrame(columns=["（無分組資料）"]),
-    "不一致明細":          sanitize_df(report_mismatch) if not report_mismatch.empty else pd.DataFrame(columns=["（恭喜！未發現不一致）"]),
-    "已跳過條件":          sanitize_df(report_skipped) if not report_skipped.empty else pd.DataFrame(columns=["（依使用者設定跳過的列）"]),
-    "未支援或缺資料":      sanitize_df(report_unsupported) if not report_unsupported.empty else pd.DataFrame(columns=["（提示：未支援規則或缺資料的列）"]),
-    "全部檢查":            sanitize_df(report_all),
-}
-
-with pd.ExcelWriter(out_path, engine="xlsxwriter") as writer:
-    for sheet, data in _to_write.items():
-        data.to_excel(writer, sheet_name=sheet[:31], index=False)
-
-print(f"不一致筆數（可比對）：{total_mismatch}")
-print(f"跳過筆數：{len(report_skipped)}")
-print(f"已輸出報告：{out_path}")
+    # 規則指紋取實際載入的規則表 / 假日檔；不是從檔案載入的規則表無法判斷是否變動，不用增量狀態
+    state = CheckState(state_dir, src_file) if use_state and rule_table.source else None
+    state_fp = rules_fingerprint([rule_table.source] + ([biz_cal.source] if biz_cal is not None else []))
+    prev_state = state.load(state_fp) if state else None
+    reused, prev_results = reuse_results(prev_state, row_hash)
+    todo = ~reused
+
+    df["系統預計付款日"] = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    df["計算依據"] = pd.Series("", index=df.index, dtype=object)
+    rule_kind = pd.Series("", index=df.index, dtype=object)
+    if reused.any():
+        df.loc[reused, "系統預計付款日"] = prev_results["系統預計付款日"].to_numpy(dtype="datetime64[ns]")
+        df.loc[reused, "計算依據"] = prev_results["計算依據"].to_numpy(dtype=object)
+        rule_kind[reused] = prev_results["規則種類"].to_numpy(dtype=object)
+    if todo.any():
+        sub = df.loc[todo]
+        expected, reasons, kinds = expected_pay_dates(
+            sub["_單據日期(date)"], sub["_付款條件"], rule_table,
+            vendors=sub[VEND_COL] if VEND_COL else None,
+            vendor_codes=sub[VCODE_COL] if VCODE_COL else None,
+            calendar=biz_cal,
+        )
+        df.loc[todo, "系統預計付款日"] = expected
+        df.loc[todo, "計算依據"] = reasons
+        rule_kind[todo] = kinds
+    if state:
+        log(f"[INFO] 增量檢查：沿用上次結果 {int(reused.sum())} 列、重新計算 {int(todo.sum())} 列")
+
+    # 規則表對不上的付款條件：列出來，補進 pay_rules.json 即可
+    unmatched_df = unmatched_terms(df["_付款條件"], rule_kind, df["計算依據"])
+    if not unmatched_df.empty:
+        log(f"[Warn] {len(unmatched_df)} 種付款條件沒有對應規則（共 {int(unmatched_df['筆數'].sum())} 筆）：")
+        for _, r in unmatched_df.iterrows():
+            log(f"  {r['付款條件名稱']}：{r['筆數']} 筆")
+
+    if PLAN_COL:
+        comparable_mask = df["系統預計付款日"].notna()
+        df["是否一致"] = pd.Series(pd.NA, index=df.index, dtype=object)
+        df.loc[comparable_mask, "是否一致"] = (
+            df.loc[comparable_mask, "_預計付款日(date)"] == df.loc[comparable_mask, "系統預計付款日"]
+        )
+    else:
+        df["是否一致"] = pd.NA
+
+    # ----- 顯示欄位/旗標 -----
+    df["單據日期(顯示)"]       = fmt(df["_單據日期(date)"])
+    df["預計付款日(顯示)"]     = fmt(df["_預計付款日(date)"])
+    df["系統預計付款日(顯示)"] = fmt(df["系統預計付款日"])
+
+    skip_mask = rule_kind.eq("skip")
+    unsupported_mask = df["系統預計付款日"].isna() & ~skip_mask
+    mismatch_mask = (df["是否一致"] == False)
+
+    # 比對狀態：未變動 / 新不一致 / 已解決 / 新增或變動（與上次檢查相比）
+    df["比對狀態"] = status_column(prev_state, key_hash, reused, mismatch_mask.to_numpy(dtype=bool))
+
+    # 相差天數
+    df["相差天數"] = day_diff(df["_預計付款日(date)"], df["系統預計付款日"])
+
+    # ----- 別名成指定欄名 & 補空欄 -----
+    if KEY_COL and KEY_COL != "憑單單號" and "憑單單號" not in df.columns:
+        df["憑單單號"] = df[KEY_COL]
+    if DOC_COL and DOC_COL != "單據日期" and "單據日期" not in df.columns:
+        df["單據日期"] = df[DOC_COL]
+    if TERM_COL and TERM_COL != "付款條件名稱" and "付款條件名稱" not in df.columns:
+        df["付款條件名稱"] = df[TERM_COL]
+    if PLAN_COL and PLAN_COL != "預計付款日" and "預計付款日" not in df.columns:
+        df["預計付款日"] = df[PLAN_COL]
+    if VEND_COL and VEND_COL != "廠商簡稱" and "廠商簡稱" not in df.columns:
+        df["廠商簡稱"] = df[VEND_COL]
+
+    for col in ["憑單單號", "單據日期", "廠商代號", "廠商簡稱", "付款條件代號",
+                "付款條件名稱", "預計付款日", "系統預計付款日(顯示)", "相差天數", "計算依據"]:
+        if col not in df.columns:
+            df[col] = ""
+
+    # ----- 報表 -----
+    mismatch_cols = [
+        "憑單單號", "單據日期", "廠商代號", "廠商簡稱", "付款條件代號",
+        "付款條件名稱", "預計付款日", "系統預計付款日(顯示)", "相差天數", "計算依據", "比對狀態",
+    ]
+    view_cols = []
+    for c in ["憑單單號", "單據編號", "發票號碼", "供應商", "品名"]:
+        if c in df.columns: view_cols.append(c)
+    view_cols += ["單據日期", "單據日期(顯示)", "付款條件名稱"]
+    if "預計付款日" in df.columns: view_cols.append("預計付款日")
+    view_cols += ["預計付款日(顯示)", "系統預計付款日(顯示)", "是否一致", "相差天數", "計算依據", "比對狀態"]
+
+    # 報表用到的欄位先統一清洗一次（控制字元、空值 → ""），各報表再從這裡切片
+    report_src = sanitize_frame(df[list(dict.fromkeys(mismatch_cols + view_cols))], na_rep="")
+
+    # 1) 不一致明細（依單據日期排序：由早到晚）
+    report_mismatch = report_src.loc[mismatch_mask, mismatch_cols].copy()
+    report_mismatch["_sort_date"] = pd.to_datetime(report_mismatch["單據日期"], errors="coerce")
+    report_mismatch = report_mismatch.sort_values(by="_sort_date", ascending=True).drop(columns=["_sort_date"])
+
+    # 2) 統計（僅可比對列）
+    total_mismatch = len(report_mismatch)
+    by_term = (df.loc[mismatch_mask]
+                 .groupby("付款條件名稱", dropna=False)
+                 .size().reset_index(name="數量")
+                 .sort_values("數量", ascending=False))
+    summary_rows = [{"項目": "不一致總筆數（可比對）", "數量": total_mismatch}]
+    if prev_state is not None:
+        summary_rows.append({"項目": "新不一致（與上次檢查相比）", "數量": int((df["比對狀態"] == STATUS_NEW_MISMATCH).sum())})
+        summary_rows.append({"項目": "已解決（與上次檢查相比）", "數量": int((df["比對狀態"] == STATUS_RESOLVED).sum())})
+    if not by_term.empty:
+        summary_rows.append({"項目": "（依付款條件分組統計）", "數量": ""})
+    summary_df = pd.DataFrame(summary_rows)
+
+    # 3) 已跳過 / 未支援或缺資料（同欄位順序）
+    report_skipped = report_src.loc[skip_mask, mismatch_cols].copy()
+    report_unsupported = report_src.loc[unsupported_mask, mismatch_cols].copy()
+
+    # 4) 全部檢查（原友善檢視）
+    report_all = report_src[view_cols].copy()
+
+    # ----- 輸出（xlsxwriter；明細已在上面清洗過）-----
+    if out_path is None:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        out_path = os.path.join(output_dir, f"TERMS_COMPARE_{ts}.xlsx")
+
+    _to_write = {
+        "不一致統計":          sanitize_df(summary_df),
+        "不一致_依付款條件":    sanitize_df(by_term) if not by_term.empty else pd.DataFrame(columns=["（無分組資料）"]),
+        "不一致明細":          report_mismatch if not report_mismatch.empty else pd.DataFrame(columns=["（恭喜！未發現不一致）"]),
+        "已跳過條件":          report_skipped if not report_skipped.empty else pd.DataFrame(columns=["（依使用者設定跳過的列）"]),
+        "未支援或缺資料":      report_unsupported if not report_unsupported.empty else pd.DataFrame(columns=["（提示：未支援規則或缺資料的列）"]),
+        "未對應付款條件":      sanitize_df(unmatched_df) if not unmatched_df.empty else pd.DataFrame(columns=["（所有付款條件都有對應規則）"]),
+        "全部檢查":            report_all,
+    }
+
+    with pd.ExcelWriter(out_path, engine="xlsxwriter") as writer:
+        for sheet, data in _to_write.items():
+            data.to_excel(writer, sheet_name=sheet[:31], index=False)
+
+    # 報告寫成功後才更新狀態，下次從這次的結果往下比
+    if state:
+        state.save(row_hash, key_hash, pd.DataFrame({
+            "系統預計付款日": df["系統預計付款日"],
+            "計算依據": df["計算依據"],
+            "規則種類": rule_kind,
+            "不一致": mismatch_mask.to_numpy(dtype=bool),
+        }), state_fp, src_file)
+
+    log(f"不一致筆數（可比對）：{total_mismatch}")
+    if prev_state is not None:
+        log(f"新不一致：{int((df['比對狀態'] == STATUS_NEW_MISMATCH).sum())}、"
+            f"已解決：{int((df['比對狀態'] == STATUS_RESOLVED).sum())}")
+    log(f"跳過筆數：{len(report_skipped)}")
+    log(f"已輸出報告：{out_path}")
+
+    # 趨勢用：不一致筆數依單據月份 / 付款條件
+    bad = df.loc[mismatch_mask]
+    return {
+        "檔案": os.path.basename(src_file),
+        "檔案時間": extract_datetime(src_file).strftime("%Y-%m-%d %H:%M"),
+        "列數": len(df),
+        "不一致": total_mismatch,
+        "跳過": len(report_skipped),
+        "未支援或缺資料": len(report_unsupported),
+        "未對應付款條件": int(unmatched_df["筆數"].sum()) if not unmatched_df.empty else 0,
+        "報告": out_path,
+        "錯誤": "",
+        "by_month": bad["_單據日期(date)"].dt.strftime("%Y-%m").fillna("（無日期）").value_counts(),
+        "by_term": bad["付款條件名稱"].fillna("").value_counts(),
+    }
+
+
+# ========= 批次模式（多份 TOTAL，多行程）=========
+_worker_rules = None   # 每個行程載入一次的 (RuleTable, BusinessCalendar)
+
+def _init_worker(rules_file, holidays_file):
+    global _worker_rules
+    _worker_rules = load_rules(rules_file, holidays_file, verbose=False)
+
+def _check_worker(task):
+    src_file, out_path = task
+    rule_table, biz_cal = _worker_rules
+    t0 = time.perf_counter()
+    try:
+        result = check_file(src_file, rule_table, biz_cal, out_path, use_state=False, verbose=False)
+    except Exception as e:
+        result = {"檔案": os.path.basename(src_file), "報告": "", "錯誤": f"{type(e).__name__}: {e}"}
+    result["秒數"] = round(time.perf_counter() - t0, 2)
+    return result
+
+def _trend_table(results, field, label):
+    """各檔的 by_month / by_term 併成一張表：列 = 月份或付款條件，欄 = 檔案"""
+    cols = {r["檔案"]: r[field] for r in results if field in r}
+    if not cols:
+        return pd.DataFrame(columns=[label])
+    table = pd.DataFrame(cols).fillna(0).astype("int64")
+    table.index.name = label
+    return table.sort_index().reset_index()
+
+def write_trend(path, results):
+    """趨勢活頁簿：檔案摘要、依月份、依付款條件"""
+    summary_cols = ["檔案", "檔案時間", "列數", "不一致", "跳過", "未支援或缺資料", "未對應付款條件", "秒數", "報告", "錯誤"]
+    summary = pd.DataFrame([{c: r.get(c, "") for c in summary_cols} for r in results], columns=summary_cols)
+    ok = [r for r in results if not r["錯誤"]]
+    wb = open_streaming_workbook(path)
+    try:
+        write_frame(wb, summary, "檔案摘要", col_width=TREND_COL_WIDTH, freeze_header=True, autofilter=True)
+        write_frame(wb, _trend_table(ok, "by_month", "單據月份"), "依月份", col_width=TREND_COL_WIDTH, freeze_header=True)
+        write_frame(wb, _trend_table(ok, "by_term", "付款條件名稱"), "依付款條件", col_width=TREND_COL_WIDTH, freeze_header=True)
+    finally:
+        wb.close()
+
+def run_batch(files, batch_dir, workers=BATCH_WORKERS):
+    """每份檔案各自輸出報告到 batch_dir，回傳各檔摘要（依檔案時間順序）"""
+    os.makedirs(batch_dir, exist_ok=True)
+    tasks = [(f, os.path.join(batch_dir, f"TERMS_COMPARE_{os.path.splitext(os.path.basename(f))[0]}.xlsx"))
+             for f in files]
+    workers = max(1, min(workers, len(tasks)))
+    print(f"[INFO] 批次檢查 {len(tasks)} 份檔案、{workers} 個行程")
+
+    def report(r):
+        if r["錯誤"]:
+            print(f"[Error] {r['檔案']}：{r['錯誤']}")
+        else:
+            print(f"  {r['檔案']}：{r['列數']} 列、不一致 {r['不一致']} 筆（{r['秒數']:.1f} 秒）")
+        return r
+
+    if workers == 1:
+        _init_worker(rules_path, holidays_path)
+        return [report(_check_worker(t)) for t in tasks]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(rules_path, holidays_path)) as ex:
+        return [report(r) for r in ex.map(_check_worker, tasks)]
+
+
+# ========= 主程式 =========
+def _parse_day(text):
+    try:
+        return datetime.strptime(text, "%Y%m%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式應為 YYYYMMDD：{text}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Check planned payment dates in TOTAL files against the payment-term rules.")
+    ap.add_argument("--batch", action="store_true",
+                    help="Check every TOTAL file in --dir instead of only the newest one.")
+    ap.add_argument("--dir", default=folder_path, help="Folder with the TOTAL files. Default: <base_dir>/total")
+    ap.add_argument("--from", dest="date_from", type=_parse_day, default=None, metavar="YYYYMMDD",
+                    help="Batch: only files stamped on or after this day (implies --batch).")
+    ap.add_argument("--to", dest="date_to", type=_parse_day, default=None, metavar="YYYYMMDD",
+                    help="Batch: only files stamped on or before this day (implies --batch).")
+    ap.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                    help=f"Batch: number of worker processes. Default: {BATCH_WORKERS}")
+    args = ap.parse_args(argv)
+
+    os.makedirs(output_dir, exist_ok=True)
+    print("base_dir =", base_dir)       # 實際路徑
+    print("folder_path =", args.dir)
+    print("output_dir  =", output_dir)
+    print("rules_path  =", rules_path)
+
+    end = args.date_to + timedelta(days=1) if args.date_to else None
+    files = list_total_files(args.dir, args.date_from, end)
+    if not files:
+        raise FileNotFoundError(f"在 {args.dir} 找不到任何（符合日期範圍的）Excel 檔案")
+
+    if not (args.batch or args.date_from or args.date_to):
+        latest_file = files[-1]
+        print(f"最新檔案：{latest_file}")
+        same_run = [f for f in files if extract_datetime(f) == extract_datetime(latest_file)]
+        if len(same_run) > 1:
+            print(f"[INFO] 最新一次 merge 按月分成 {len(same_run)} 份，只檢查最新月份；"
+                  f"要全部檢查請用 --batch --from {extract_datetime(latest_file):%Y%m%d}")
+        rule_table, biz_cal = load_rules()
+        check_file(latest_file, rule_table, biz_cal)
+        return
+
+    # 批次模式不讀寫增量狀態（狀態只記最新一次的檢查，歷史檔案之間互不相干）
+    t0 = time.perf_counter()
+    load_rules()   # 先在主行程檢查規則表 / 假日檔，有錯直接停
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    batch_dir = os.path.join(output_dir, f"batch_{ts}")
+    results = run_batch(files, batch_dir, args.workers)
+    trend_path = os.path.join(batch_dir, f"TERMS_TREND_{ts}.xlsx")
+    write_trend(trend_path, results)
+    n_err = sum(1 for r in results if r["錯誤"])
+    print(f"已輸出趨勢：{trend_path}")
+    print(f"[INFO] 完成 {len(results) - n_err} 份、失敗 {n_err} 份，共 {time.perf_counter() - t0:.1f} 秒")
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()   # 打包成 EXE 時多行程需要
+    main()
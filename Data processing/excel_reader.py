@@ -0,0 +1,359 @@
+"""
+Excel 讀取共用工具
+
+讀取引擎（EXCEL_ENGINE，可用環境變數 EXCEL_ENGINE 覆寫）：
+- "auto"     ：calamine → stream（.xlsx/.xlsm）→ pandas，沒安裝或開檔失敗就自動退回下一個
+- "calamine" ：Rust 原生讀取器，.xls / .xlsx / .xlsm / .xlsb 都支援，最快
+- "stream"   ：openpyxl read_only 逐列串流（只讀需要的列 / 欄），.xlsx / .xlsm 專用
+- "pandas"   ：pandas 預設（.xlsx/.xlsm → openpyxl、.xls → xlrd、.xlsb → pyxlsb）
+不論哪個引擎，parse() 的結果都和 pd.read_excel 相同（同一套 TextParser 規則）。
+
+表頭列偵測：
+1) 先只讀每張工作表前 HEADER_SCAN_ROWS 列（header=None）
+2) 一次向量化比對所有儲存格，找出第一個命中足夠關鍵欄名的列
+3) 再以 skiprows 從表頭下一列開始讀，只讀有欄名的欄位
+前 N 列找不到表頭時，才退回整張讀進來再找一次。
+"""
+import os
+import numpy as np
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+HEADER_SCAN_ROWS = 50
+
+EXCEL_ENGINE = os.environ.get("EXCEL_ENGINE", "auto")
+ENGINES = ("auto", "calamine", "stream", "pandas")
+STREAM_EXTS = {".xlsx", ".xlsm"}
+
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# merge_all_data.py 的 COMPANION_FORMAT 副本（與 xlsx 同名），依優先順序
+COMPANION_EXTS = (".parquet", ".csv.gz")
+
+# Excel 錯誤值（pandas 的 openpyxl 讀取器也是轉成 NaN）
+_ERROR_CODES = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"}
+
+
+# ===== 讀取引擎 =====
+class StreamingWorkbook:
+    """
+    openpyxl read_only 串流讀取；介面與 pd.ExcelFile 相同（sheet_names / parse / close）。
+    和 pandas 的差別：skiprows / nrows / usecols 直接換算成要走訪的列、欄範圍，
+    表頭之前與 nrows 之後的列不轉換、不進 DataFrame。
+    """
+
+    engine = "stream"
+
+    def __init__(self, path):
+        from openpyxl import load_workbook
+        self.path = path
+        self.book = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+        self.sheet_names = self.book.sheetnames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.book.close()
+
+    def _sheet(self, sheet_name):
+        if isinstance(sheet_name, int):
+            return self.book.worksheets[sheet_name]
+        return self.book[sheet_name]
+
+    def iter_rows(self, sheet_name=0, min_row=1, max_row=None, max_col=None):
+        """逐列產生原始值（tuple），不建 DataFrame；供需要自行串流的程式使用。"""
+        ws = self._sheet(sheet_name)
+        ws.reset_dimensions()
+        return ws.iter_rows(min_row=min_row, max_row=max_row, max_col=max_col, values_only=True)
+
+    @staticmethod
+    def _convert(v):
+        # 與 pandas OpenpyxlReader._convert_cell 一致
+        if v is None:
+            return ""
+        if isinstance(v, float) and v.is_integer():
+            return int(v)
+        if isinstance(v, str) and v in _ERROR_CODES:
+            return np.nan
+        return v
+
+    def get_sheet_data(self, sheet_name, skip=0, rows_needed=None, max_col=None):
+        data = []
+        last_row_with_data = -1
+        max_row = skip + rows_needed if rows_needed is not None else None
+        for n, row in enumerate(self.iter_rows(sheet_name, skip + 1, max_row, max_col)):
+            converted = [self._convert(v) for v in row]
+            while converted and converted[-1] == "":
+                converted.pop()
+            if converted:
+                last_row_with_data = n
+            data.append(converted)
+        data = data[: last_row_with_data + 1]
+        if data:
+            width = max(len(r) for r in data)
+            data = [r + [""] * (width - len(r)) for r in data]
+        return data
+
+    def parse(self, sheet_name=0, header=0, skiprows=None, nrows=None, usecols=None, dtype=None, **kwds):
+        if skiprows is not None and not isinstance(skiprows, int):
+            raise ValueError("stream 引擎的 skiprows 只支援整數")
+        skip = skiprows or 0
+
+        rows_needed = None
+        if nrows is not None:
+            rows_needed = nrows + (0 if header is None else header + 1)
+
+        max_col = None
+        if usecols is not None and all(isinstance(c, (int, np.integer)) for c in usecols):
+            max_col = max(usecols) + 1 if len(usecols) else 1
+
+        data = self.get_sheet_data(sheet_name, skip, rows_needed, max_col)
+        try:
+            parser = TextParser(
+                data, header=header, nrows=nrows, usecols=usecols, dtype=dtype,
+                skip_blank_lines=False, **kwds,
+            )
+            return parser.read(nrows=nrows)
+        except EmptyDataError:
+            return pd.DataFrame()
+
+
+def _engine_chain(path, engine):
+    ext = os.path.splitext(str(path))[1].lower()
+    if engine == "auto":
+        chain = ["calamine"] if HAS_CALAMINE else []
+        if ext in STREAM_EXTS:
+            chain.append("stream")
+        return chain + ["pandas"]
+    if engine == "stream" and ext not in STREAM_EXTS:
+        # .xls / .xlsb 沒有 openpyxl 可用：改走 calamine 或 pandas 預設
+        return (["calamine"] if HAS_CALAMINE else []) + ["pandas"]
+    if engine == "calamine" and not HAS_CALAMINE:
+        return ["pandas"]
+    if engine == "stream":
+        return ["stream", "pandas"]
+    return [engine]
+
+
+def open_workbook(path, engine=None):
+    """
+    依 EXCEL_ENGINE 開啟活頁簿，回傳具 sheet_names / parse() 的物件（可用 with）。
+    指定的引擎沒安裝或開檔失敗時，自動退回下一個可用引擎。
+    """
+    engine = engine or EXCEL_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"未知的 Excel 引擎：{engine}（可用：{', '.join(ENGINES)}）")
+
+    chain = _engine_chain(path, engine)
+    last_err = None
+    for name in chain:
+        try:
+            if name == "stream":
+                return StreamingWorkbook(path)
+            if name == "calamine":
+                return pd.ExcelFile(path, engine="calamine")
+            return pd.ExcelFile(path)
+        except Exception as e:
+            last_err = e
+    raise last_err
+
+
+def read_excel(path, sheet_name=0, engine=None, **kwds):
+    """pd.read_excel 的替代品：走 open_workbook 選好的引擎；sheet_name=None 回傳 dict。"""
+    with open_workbook(path, engine) as book:
+        if sheet_name is None:
+            return {name: book.parse(name, **kwds) for name in book.sheet_names}
+        if isinstance(sheet_name, list):
+            return {name: book.parse(name, **kwds) for name in sheet_name}
+        return book.parse(sheet_name, **kwds)
+
+
+def iter_sheet_rows(path, sheet_name=0):
+    """
+    逐列產生工作表的值（list），不把整張表建成 DataFrame；值依 pandas 規則轉換
+    （空白 → ""、整數浮點 → int、Excel 錯誤值 → NaN）。給記憶體放不下整張表的程式用：
+    - .xlsx / .xlsm ：openpyxl 串流，記憶體與列數無關
+    - 其他格式      ：calamine（工作表在 Rust 端，逐列轉成 Python）；沒安裝時整張讀進來再逐列產生
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    convert = StreamingWorkbook._convert
+
+    if ext in STREAM_EXTS:
+        with StreamingWorkbook(path) as book:
+            for row in book.iter_rows(sheet_name):
+                yield [convert(v) for v in row]
+        return
+
+    if HAS_CALAMINE:
+        from python_calamine import CalamineWorkbook
+        wb = CalamineWorkbook.from_path(str(path))
+        name = wb.sheet_names[sheet_name] if isinstance(sheet_name, int) else sheet_name
+        for row in wb.get_sheet_by_name(name).iter_rows():
+            yield [convert(None if v == "" else v) for v in row]
+        return
+
+    df = read_excel(path, sheet_name=sheet_name, engine="pandas", header=None, dtype=object)
+    for row in df.itertuples(index=False):
+        yield [convert(None if pd.isna(v) else v) for v in row]
+
+
+def available_engines():
+    out = ["pandas", "stream"]
+    if HAS_CALAMINE:
+        out.insert(0, "calamine")
+    return out
+
+
+# ===== 表頭列偵測 =====
+def read_sheet_head(book, sheet, nrows=HEADER_SCAN_ROWS) -> pd.DataFrame:
+    """只讀前 nrows 列（nrows=None 表示整張），儲存格保持原始值。"""
+    return book.parse(sheet, header=None, nrows=nrows, dtype=object)
+
+
+def find_header_row(df_head: pd.DataFrame, keys, min_hits=1, normalize=None):
+    """
+    回傳第一個「命中 keys 中至少 min_hits 個不同欄名」的列號；找不到回傳 None
+
+    normalize：對儲存格字串 Series 做的向量化正規化（預設只去頭尾空白）
+    """
+    if df_head.empty:
+        return None
+
+    values = df_head.to_numpy(dtype=object)
+    rows = np.repeat(np.arange(values.shape[0]), values.shape[1])
+    flat = values.ravel()
+    present = ~pd.isna(flat)
+    if not present.any():
+        return None
+
+    cells = pd.Series(flat[present]).astype(str).str.strip()
+    if normalize is not None:
+        cells = normalize(cells)
+
+    hit = cells.isin(keys).to_numpy()
+    if not hit.any():
+        return None
+
+    hits = pd.DataFrame({"row": rows[present][hit], "key": cells.to_numpy()[hit]})
+    per_row = hits.drop_duplicates().groupby("row").size()
+    ok = per_row[per_row >= min_hits]
+    if ok.empty:
+        return None
+    return int(ok.index.min())
+
+
+def read_sheet_table(book, sheet, df_head: pd.DataFrame, header_row: int, head_is_full=False) -> pd.DataFrame:
+    """
+    以 header_row 為欄名列，讀出下方資料，並移除整列空白。
+    空白欄名的欄若下方有資料就保留（欄名維持空白，與舊版相同），整欄全空才移除。
+    head_is_full=True 表示 df_head 已是整張工作表，直接切片不再重讀。
+    """
+    header = df_head.iloc[header_row]
+    if head_is_full:
+        df = df_head.iloc[header_row + 1:].copy()
+    else:
+        df = book.parse(sheet, header=None, skiprows=header_row + 1, dtype=object)
+        # 預覽與下方資料的寬度可能不同，對齊成同樣欄數（多出的欄視為空白欄名）
+        width = max(len(header), df.shape[1])
+        header = header.reindex(range(width))
+        df = df.reindex(columns=range(width))
+
+    blank = [pd.isna(v) or str(v).strip() == "" for v in header.tolist()]
+    has_data = df.notna().any(axis=0).tolist()
+    keep = [i for i in range(len(header)) if not blank[i] or has_data[i]]
+
+    df = df.iloc[:, keep]
+    df.columns = header.iloc[keep].tolist()
+    df = df.dropna(how="all")
+    df.index = pd.RangeIndex(len(df))
+    return df
+
+
+def extract_table(book, sheet, df_head: pd.DataFrame, keys, min_hits=1, normalize=None,
+                  scan_rows=HEADER_SCAN_ROWS):
+    """
+    df_head 為 read_sheet_head() 的結果。
+    找到表頭回傳資料表；整張工作表都找不到表頭回傳 None。
+    """
+    head_is_full = scan_rows is None or len(df_head) < scan_rows
+    header_row = find_header_row(df_head, keys, min_hits, normalize)
+
+    if header_row is None and not head_is_full:
+        # 表頭不在前 N 列：整張讀進來再找一次
+        df_head = read_sheet_head(book, sheet, nrows=None)
+        head_is_full = True
+        header_row = find_header_row(df_head, keys, min_hits, normalize)
+
+    if header_row is None:
+        return None
+    return read_sheet_table(book, sheet, df_head, header_row, head_is_full)
+
+
+# ===== 只讀需要的欄位（xlsx 或同名副本）=====
+def find_companion(xlsx_path):
+    """
+    同名的 .parquet / .csv.gz 副本（merge_all_data.py 的 COMPANION_FORMAT）；
+    副本比 xlsx 舊（xlsx 之後又被改過）或沒裝 pyarrow 讀不了 parquet 時不採用，回傳 None
+    """
+    stem = os.path.splitext(str(xlsx_path))[0]
+    for ext in COMPANION_EXTS:
+        path = stem + ext
+        if ext == ".parquet" and not HAS_PYARROW:
+            continue
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(xlsx_path):
+            return path
+    return None
+
+
+def _is_parquet(path):
+    return str(path).lower().endswith(".parquet")
+
+
+def _is_csv(path):
+    return str(path).lower().endswith((".csv", ".csv.gz"))
+
+
+def read_columns(path, sheet_name=0):
+    """只讀表頭，回傳原始欄名 list；path 可為 Excel、.parquet 或 .csv(.gz)"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    if _is_csv(path):
+        return list(pd.read_csv(path, nrows=0, encoding="utf-8-sig").columns)
+    return list(read_excel(path, sheet_name=sheet_name, nrows=0).columns)
+
+
+def read_table(path, usecols, text_cols=(), sheet_name=0) -> pd.DataFrame:
+    """
+    只讀 usecols 這幾欄（原始欄名，輸出依 usecols 順序）。
+    text_cols 以字串讀入（單號、代號不會變成數字），其餘保留原生型別：
+    Excel / parquet 的日期、金額直接是 datetime64 / 數字，不再從字串重新解析。
+    """
+    usecols = list(usecols)
+    text_cols = [c for c in text_cols if c in usecols]
+    if _is_parquet(path):
+        df = pd.read_parquet(path, columns=usecols)
+        for c in text_cols:
+            s = df[c]
+            if s.dtype != object or pd.api.types.infer_dtype(s, skipna=True) not in ("string", "empty"):
+                df[c] = s.astype(object).where(s.isna(), s.astype(str))
+    elif _is_csv(path):
+        df = pd.read_csv(path, usecols=usecols, dtype={c: str for c in text_cols}, encoding="utf-8-sig")
+    else:
+        df = read_excel(path, sheet_name=sheet_name, usecols=usecols, dtype={c: str for c in text_cols})
+    return df[usecols]
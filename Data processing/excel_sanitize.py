@@ -0,0 +1,90 @@
+"""
+寫入 Excel 前的文字清洗（整欄向量化）
+
+- 去掉 Excel 不接受的 XML 字元（保留 \\t \\n \\r），避免開檔出現「部分內容有問題」
+- 超過儲存格上限 MAX_EXCEL_STRLEN 的字串截斷
+- 每欄先把所有值串成一個字串做一次檢查：沒有非法字元、也沒有超長字串的欄直接略過；
+  全部是 ASCII 時只需檢查 C0 控制字元（C1 / 代理對 / 非字元都不可能出現）
+"""
+import re
+import pandas as pd
+
+MAX_EXCEL_STRLEN = 32767
+
+# Excel 禁用/不合法 XML 字元（保留 \t \n \r）
+ILLEGAL_RE = re.compile(
+    r"["                     # 開頭 [
+    r"\x00-\x08\x0B\x0C\x0E-\x1F"   # C0 控制字元（排除 \t \n \r）
+    r"\x7F-\x84\x86-\x9F"           # C1 控制字元
+    r"\uD800-\uDFFF"                # 代理對區段（孤立代理）
+    r"\uFDD0-\uFDEF"                # 非字元碼點區段
+    r"\uFFFE\uFFFF"                 # 非字元
+    r"]"                     # 結尾 ]
+)
+_ASCII_ILLEGAL_RE = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]")
+
+
+def clean_text(v):
+    """單一值版本（欄名等零星資料用）：空值原樣回傳，其餘轉字串後清洗。"""
+    if pd.isna(v):
+        return v
+    s = ILLEGAL_RE.sub("", str(v))
+    if len(s) > MAX_EXCEL_STRLEN:
+        s = s[:MAX_EXCEL_STRLEN]
+    return s
+
+
+def is_text_dtype(s: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype)
+
+
+def sanitize_series(s: pd.Series, na_rep=None) -> pd.Series:
+    """
+    非空值一律轉成字串並清洗；空值保留（na_rep 不為 None 時改成 na_rep）。
+    整欄乾淨且本來就全是字串時，原樣回傳（不複製）。
+    """
+    notna = s.notna()
+    has_na = not notna.all()
+    vals = s[notna] if has_na else s
+
+    all_str = pd.api.types.infer_dtype(vals, skipna=False) in ("string", "empty")
+    strs = vals if all_str else vals.astype(str)
+
+    changed = not all_str
+    if len(strs):
+        joined = "".join(strs.tolist())
+        pattern = _ASCII_ILLEGAL_RE if joined.isascii() else ILLEGAL_RE
+        if pattern.search(joined):
+            # 只改有問題的儲存格
+            bad = strs.str.contains(pattern)
+            strs = strs.copy()
+            strs[bad] = strs[bad].str.replace(pattern, "", regex=True)
+            changed = True
+        if len(joined) > MAX_EXCEL_STRLEN and strs.str.len().max() > MAX_EXCEL_STRLEN:
+            strs = strs.str.slice(0, MAX_EXCEL_STRLEN)
+            changed = True
+
+    if not changed and (not has_na or na_rep is None) and pd.api.types.is_object_dtype(s.dtype):
+        return s
+    if not has_na:
+        return strs.astype(object)
+    out = s.astype(object)
+    out[notna] = strs.astype(object)
+    if na_rep is not None:
+        out[~notna] = na_rep
+    return out
+
+
+def sanitize_frame(df: pd.DataFrame, skip=(), na_rep=None) -> pd.DataFrame:
+    """
+    清洗所有文字欄（object / string dtype），skip 內的欄名不動。
+    以欄位位置逐欄處理，欄名重複也不會出錯；回傳新的 DataFrame。
+    """
+    out = df.copy()
+    for i, col in enumerate(out.columns):
+        if col in skip:
+            continue
+        s = out.iloc[:, i]
+        if is_text_dtype(s):
+            out.isetitem(i, sanitize_series(s, na_rep))
+    return out
@@ -0,0 +1,231 @@
+"""
+大表輸出共用工具（XlsxWriter constant_memory 串流寫入）
+
+- 逐列寫出：每寫完一列就落地到暫存檔，記憶體用量與總列數無關
+- 單張工作表超過 Excel 上限（EXCEL_MAX_ROWS，含表頭）時自動分頁：
+  TOTAL → TOTAL_2 → TOTAL_3 …（第一張維持原名，下游工具照舊讀得到）
+- 每張分頁都保留：欄寬、日期欄格式、凍結首列、AutoFilter
+- 可另外輸出 Parquet / CSV 副本給下游程式讀（比讀 xlsx 快很多）
+- CappedSheetWriter：一段一段往同一張工作表寫，超過列數上限的部分改寫到活頁簿旁的溢出檔
+"""
+import os
+import gzip
+import pandas as pd
+
+EXCEL_MAX_ROWS = 1_048_576
+MAX_SHEET_NAME = 31
+CHUNK_ROWS = 20_000  # 每次轉成 Python 物件的列數（控制暫時性記憶體）
+
+# 與 pandas to_excel 的表頭樣式相同（粗體、細框、置中）
+HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+COMPANION_FORMATS = ("parquet", "csv")
+
+
+def open_streaming_workbook(path, date_format=None, strings_as_text=False):
+    """
+    建立 constant_memory 模式的活頁簿。
+    date_format：日期 / 時間儲存格的預設顯示格式（例如 "yyyy/mm/dd"）
+    strings_as_text：以 = 或 http 開頭的字串照原樣寫成文字（不轉成公式 / 超連結），比對報告用
+    注意：constant_memory 下每張工作表都必須由上往下逐列寫，寫過的列不能再改。
+    """
+    import xlsxwriter
+    options = {"constant_memory": True}
+    if date_format:
+        options["default_date_format"] = date_format
+    if strings_as_text:
+        options.update(strings_to_formulas=False, strings_to_urls=False)
+    return xlsxwriter.Workbook(path, options)
+
+
+def part_sheet_names(base_name, n_parts):
+    """第一張維持 base_name，其後為 base_name_2、base_name_3 …（截到 31 字元）"""
+    names = []
+    for i in range(n_parts):
+        if i == 0:
+            names.append(base_name[:MAX_SHEET_NAME])
+        else:
+            suffix = f"_{i + 1}"
+            names.append(base_name[:MAX_SHEET_NAME - len(suffix)] + suffix)
+    return names
+
+
+def iter_row_values(df: pd.DataFrame, chunk=CHUNK_ROWS):
+    """分段把 DataFrame 轉成 Python 值的 list（空值為 None），逐列產生。"""
+    for start in range(0, len(df), chunk):
+        block = df.iloc[start:start + chunk].to_numpy(dtype=object)
+        block[pd.isna(block)] = None
+        yield from block.tolist()
+
+
+def _header_value(c):
+    return None if c is None or (not isinstance(c, str) and pd.isna(c)) else c
+
+
+def write_table(ws, df: pd.DataFrame, row=0, head_fmt=None) -> int:
+    """在 ws 第 row 列起寫表頭 + 資料（小表格用），回傳下一個空白列"""
+    ws.write_row(row, 0, [_header_value(c) for c in df.columns], head_fmt)
+    for values in iter_row_values(df):
+        row += 1
+        ws.write_row(row, 0, values)
+    return row + 1
+
+
+def write_frame(wb, df: pd.DataFrame, sheet_name, max_rows=EXCEL_MAX_ROWS, col_width=None,
+                date_cols=(), date_width=None, date_format=None, freeze_header=False, autofilter=False,
+                header_format=HEADER_FORMAT, footer_frames=()):
+    """
+    把 df 寫進 wb（open_streaming_workbook 建立），超過 max_rows（含表頭）自動分頁。
+    footer_frames：接在最後一張分頁資料下方（中間空一列）的小表格，例如執行時間統計
+    回傳 [(工作表名稱, 資料列數), ...]
+    """
+    headers = [_header_value(c) for c in df.columns]
+    ncols = len(headers)
+    per_sheet = max_rows - 1
+    n_parts = max(1, -(-len(df) // per_sheet))
+
+    head_fmt = wb.add_format(header_format) if header_format else None
+    date_fmt = wb.add_format({"num_format": date_format}) if date_format else None
+    date_idx = [i for i, c in enumerate(df.columns) if c in set(date_cols)]
+
+    written = []
+    rows = iter_row_values(df)
+    for part, name in enumerate(part_sheet_names(sheet_name, n_parts)):
+        ws = wb.add_worksheet(name)
+        n = min(per_sheet, len(df) - part * per_sheet)
+
+        # 欄寬 / 欄格式要在寫資料前設定
+        if col_width is not None and ncols:
+            ws.set_column(0, ncols - 1, col_width)
+        for i in date_idx:
+            ws.set_column(i, i, date_width or col_width, date_fmt)
+
+        ws.write_row(0, 0, headers, head_fmt)
+        for r in range(1, n + 1):
+            ws.write_row(r, 0, next(rows))
+
+        if freeze_header:
+            ws.freeze_panes(1, 0)
+        if autofilter and ncols:
+            ws.autofilter(0, 0, n, ncols - 1)
+        written.append((name, n))
+
+    # constant_memory 只能往下寫：附加表格接在最後一張分頁的資料之後
+    r = written[-1][1] + 2
+    for extra in footer_frames:
+        r = write_table(ws, extra, r, head_fmt) + 1
+    return written
+
+
+class CappedSheetWriter:
+    """
+    一段一段（DataFrame）往下寫同一張工作表，最多 max_rows 筆資料列；
+    超過的部分依序寫到活頁簿旁的溢出檔，不分頁、也不在記憶體裡累積：
+      csv     → <活頁簿>_<工作表>.csv.gz（utf-8-sig）
+      parquet → <活頁簿>_<工作表>.parquet（每欄都存成文字；沒裝 pyarrow 時改寫 CSV）
+    工作表在建立時就加入活頁簿（決定分頁順序），表頭為 columns。
+    """
+
+    def __init__(self, wb, sheet_name, xlsx_path, columns, max_rows=EXCEL_MAX_ROWS - 1, spill_format="csv",
+                 col_width=None, header_format=HEADER_FORMAT, freeze_header=True, autofilter=True):
+        if spill_format not in COMPANION_FORMATS:
+            raise ValueError(f"未知的溢出檔格式：{spill_format}（可用：{', '.join(COMPANION_FORMATS)}）")
+        self.name = sheet_name[:MAX_SHEET_NAME]
+        self.columns = list(columns)
+        self.max_rows = max(0, min(int(max_rows), EXCEL_MAX_ROWS - 1))
+        self.spill_format = spill_format
+        self.spill_stem = f"{os.path.splitext(xlsx_path)[0]}_{self.name}"
+        self.autofilter = autofilter
+        self.rows = 0          # 已寫進工作表的資料列
+        self.spilled = 0       # 寫到溢出檔的資料列
+        self.spill_path = None
+        self._csv = None
+        self._parquet = None
+
+        self.ws = wb.add_worksheet(self.name)
+        if col_width is not None and self.columns:
+            self.ws.set_column(0, len(self.columns) - 1, col_width)
+        self.ws.write_row(0, 0, [_header_value(c) for c in self.columns],
+                          wb.add_format(header_format) if header_format else None)
+        if freeze_header:
+            self.ws.freeze_panes(1, 0)
+
+    def write(self, df: pd.DataFrame):
+        room = self.max_rows - self.rows
+        head = df if len(df) <= room else df.iloc[:room]
+        for values in iter_row_values(head):
+            self.rows += 1
+            self.ws.write_row(self.rows, 0, values)
+        if len(df) > len(head):
+            self._spill(df.iloc[len(head):])
+
+    def _spill(self, df: pd.DataFrame):
+        if self.spill_path is None:
+            self._open_spill()
+        if self._parquet is not None:
+            import pyarrow as pa
+            block = df.astype(object).where(df.notna(), None)
+            cols = {str(c): [None if v is None else str(v) for v in block.iloc[:, i]]
+                    for i, c in enumerate(self.columns)}
+            self._parquet.write_table(pa.Table.from_pydict(cols, schema=self._schema))
+        else:
+            df.to_csv(self._csv, header=self.spilled == 0, index=False)
+        self.spilled += len(df)
+
+    def _open_spill(self):
+        if self.spill_format == "parquet":
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                self.spill_path = self.spill_stem + ".parquet"
+                self._schema = pa.schema([(str(c), pa.string()) for c in self.columns])
+                self._parquet = pq.ParquetWriter(self.spill_path, self._schema)
+                return
+            except ImportError as e:
+                print(f"[Warn] Parquet 溢出檔無法寫入，改寫 CSV：{e}")
+        self.spill_path = self.spill_stem + ".csv.gz"
+        self._csv = gzip.open(self.spill_path, "wt", encoding="utf-8-sig", newline="")
+
+    def close(self) -> dict:
+        """收尾（AutoFilter、關閉溢出檔），回傳 {sheet, rows, spilled, spill_path}"""
+        if self.autofilter and self.columns:
+            self.ws.autofilter(0, 0, self.rows, len(self.columns) - 1)
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._csv is not None:
+            self._csv.close()
+        return {"sheet": self.name, "rows": self.rows, "spilled": self.spilled, "spill_path": self.spill_path}
+
+
+def write_companion(df: pd.DataFrame, xlsx_path, fmt):
+    """
+    在 xlsx 旁邊輸出同名副本：fmt = "parquet"（需要 pyarrow）或 "csv"（gzip 壓縮）。
+    Parquet 寫不出來（沒裝 pyarrow、同欄混型別等）時改寫 CSV。回傳輸出路徑。
+    """
+    if fmt not in COMPANION_FORMATS:
+        raise ValueError(f"未知的副本格式：{fmt}（可用：{', '.join(COMPANION_FORMATS)}）")
+    stem = os.path.splitext(xlsx_path)[0]
+
+    if fmt == "parquet":
+        path = stem + ".parquet"
+        try:
+            out = df.copy()
+            out.columns = [str(c) for c in out.columns]
+            # 同欄混有數字與字串時 pyarrow 不收：非日期的 object 欄（含混型別的 category）統一轉字串
+            for i in range(out.shape[1]):
+                s = out.iloc[:, i]
+                if isinstance(s.dtype, pd.CategoricalDtype) and \
+                        pd.api.types.infer_dtype(s.cat.categories, skipna=True) != "string":
+                    s = s.astype(object)
+                if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) not in ("string", "date", "empty"):
+                    out.isetitem(i, s.where(s.isna(), s.astype(str)))
+            out.to_parquet(path, index=False)
+            return path
+        except Exception as e:
+            if os.path.exists(path):
+                os.remove(path)
+            print(f"[Warn] Parquet 副本寫入失敗，改寫 CSV：{e}")
+
+    path = stem + ".csv.gz"
+    df.to_csv(path, index=False, encoding="utf-8-sig", compression="gzip")
+    return path
@@ -0,0 +1,152 @@
+"""
+產生測試用的憑單 Excel（效能測試 / 重現問題用，內容為亂數）
+
+用法：
+    python make_sample_vouchers.py <輸出資料夾> --folders 4 --files 5 --rows 2000 [--sheets 2] [--seed 1]
+
+產生 <輸出資料夾>/F01 … F<N> 子資料夾，每個資料夾 M 個活頁簿，每張工作表 K 列明細，
+盡量貼近實際匯出檔會遇到的狀況：
+- 表頭上方有公司名稱、列印日期、空白列等雜訊列；表頭右側有空白欄名
+- 一個活頁簿多張工作表
+- 憑單日期混用 2024/05/01、2024-05-01、民國 113/05/01、Excel 序號、日期儲存格，
+  同一張憑單的第二列以後日期留白（合併時往下填滿）
+- 金額為含千分位逗號的文字
+- 每張工作表最後有「小結」列
+- 廠商簡稱 / 備註偶爾含 Excel 不接受的控制字元
+
+注意：輸出資料夾不要放在合併程式會掃描的 BASE_DIR 子資料夾底下，否則會被併進 TOTAL。
+"""
+import os
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+HEADER = ["憑單日期", "憑單單號", "序號", "廠商代號", "廠商簡稱", "付款條件代號", "付款條件名稱",
+          "預計付款日", "本幣貨款金額", None, "備註"]
+
+TERMS = [
+    ("T01", "當月18號付款"), ("T02", "次月15號付款"), ("T03", "月結30天"), ("T04", "月結45天"),
+    ("T05", "月結60天"), ("T06", "月結90天"), ("T07", "月結120天"), ("T08", "當月15號"),
+    ("T09", "請財務部確認付款日"), ("T10", "貨到付款"), ("T11", "次月10號付款"),
+]
+VENDORS = [
+    ("V001", "南科管理局"), ("V002", "台積"), ("V003", "聯電"), ("V004", "友達"), ("V005", "群創"),
+    ("V006", "中鋼"), ("V007", "台塑"), ("V008", "鴻海"), ("V009", "廣達"), ("V010", "仁寶"),
+    ("V011", "華碩\x7f"), ("V012", "宏碁\x86"),
+]
+EXCEL_EPOCH = date(1899, 12, 30)
+LINES_PER_VOUCHER = (1, 4)
+
+
+def _date_value(d: date, rng: random.Random):
+    kind = rng.randrange(5)
+    if kind == 0:
+        return d.strftime("%Y/%m/%d")
+    if kind == 1:
+        return d.strftime("%Y-%m-%d")
+    if kind == 2:
+        return f"{d.year - 1911}/{d.month:02d}/{d.day:02d}"
+    if kind == 3:
+        return (d - EXCEL_EPOCH).days
+    return datetime(d.year, d.month, d.day)
+
+
+def _sheet_rows(rows, prefix, start: date, days, rng: random.Random):
+    """產生 rows 列明細（含每張憑單第二列起的空白日期），回傳 (明細列, 金額合計)"""
+    out, total, n_voucher = [], 0, 0
+    while len(out) < rows:
+        n_voucher += 1
+        d = start + timedelta(days=rng.randrange(days))
+        vcode, vname = rng.choice(VENDORS)
+        tcode, tname = rng.choice(TERMS)
+        voucher_no = f"{prefix}{n_voucher:06d}"
+        for line in range(1, rng.randint(*LINES_PER_VOUCHER) + 1):
+            if len(out) >= rows:
+                break
+            amount = rng.randint(100, 2_000_000)
+            total += amount
+            note = rng.choice(["", "", "", "急件", "分批交貨", "含運費\x1f"])
+            out.append([
+                _date_value(d, rng) if line == 1 else None,
+                voucher_no, line, vcode, vname, tcode, tname,
+                (d + timedelta(days=30)).strftime("%Y/%m/%d"),
+                f"{amount:,}", None, note,
+            ])
+    return out, total
+
+
+def write_workbook(path, sheets, rows, prefix, start, days, rng):
+    import xlsxwriter
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_numbers": False})
+    date_fmt = wb.add_format({"num_format": "yyyy/mm/dd"})
+    try:
+        for si in range(sheets):
+            ws = wb.add_worksheet(f"Sheet{si + 1}")
+            body, total = _sheet_rows(rows, f"{prefix}{si + 1}", start, days, rng)
+            r = 0
+            # 表頭上方的雜訊列
+            ws.write_row(r, 0, ["○○股份有限公司　應付憑單明細表"]); r += 1
+            ws.write_row(r, 0, ["列印日期", datetime.now().strftime("%Y/%m/%d")]); r += 1
+            r += 1
+            ws.write_row(r, 0, HEADER); r += 1
+            for values in body:
+                for c, v in enumerate(values):
+                    if v is None:
+                        continue
+                    if isinstance(v, datetime):
+                        ws.write_datetime(r, c, v, date_fmt)
+                    else:
+                        ws.write(r, c, v)
+                r += 1
+            ws.write_row(r, 0, ["小結:", None, None, None, None, None, None, None, f"{total:,}"])
+    finally:
+        wb.close()
+
+
+def generate(out_dir, folders=4, files=5, rows=2000, sheets=2, seed=1, start=date(2024, 1, 1), days=365):
+    """產生測試資料，回傳產生的檔案路徑清單"""
+    rng = random.Random(seed)
+    paths = []
+    for fi in range(folders):
+        folder = os.path.join(out_dir, f"F{fi + 1:02d}")
+        os.makedirs(folder, exist_ok=True)
+        for wi in range(files):
+            path = os.path.join(folder, f"vouchers_{wi + 1:03d}.xlsx")
+            write_workbook(path, sheets, rows, f"P{fi + 1:02d}{wi + 1:03d}", start, days, rng)
+            paths.append(path)
+    return paths
+
+
+def _warn_if_scanned(out_dir):
+    """輸出在 merge_all_data 會掃描的子資料夾時提醒"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    rel = os.path.relpath(os.path.abspath(out_dir), here)
+    if rel.startswith(".."):
+        return
+    try:
+        from merge_all_data import list_immediate_subdirs
+        top = rel.split(os.sep)[0]
+        if rel == "." or top in list_immediate_subdirs(here):
+            print(f"[Warn] {out_dir} 位於合併程式會掃描的資料夾內，測試資料會被併進 TOTAL")
+    except Exception:
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate synthetic voucher workbooks for benchmarks.")
+    ap.add_argument("out_dir", help="Output folder (F01..FNN subfolders are created inside).")
+    ap.add_argument("--folders", type=int, default=4, help="Number of subfolders.")
+    ap.add_argument("--files", type=int, default=5, help="Workbooks per folder.")
+    ap.add_argument("--rows", type=int, default=2000, help="Detail rows per sheet.")
+    ap.add_argument("--sheets", type=int, default=2, help="Sheets per workbook.")
+    ap.add_argument("--seed", type=int, default=1, help="Random seed (same seed, same data).")
+    args = ap.parse_args()
+
+    _warn_if_scanned(args.out_dir)
+    paths = generate(args.out_dir, args.folders, args.files, args.rows, args.sheets, args.seed)
+    total = len(paths) * args.sheets * args.rows
+    print(f"已產生 {len(paths)} 個檔案、約 {total} 列明細：{args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
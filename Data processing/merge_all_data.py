@@ -1,10 +1,21 @@
 import os
-import re
 import glob
 from datetime import datetime
 import warnings
+import argparse
+import cProfile
+import pstats
+import numpy as np
 import pandas as pd
 import sys
+from parse_cache import ParseCache
+from excel_reader import open_workbook, read_sheet_head, extract_table
+from excel_sanitize import ILLEGAL_RE, MAX_EXCEL_STRLEN, clean_text, sanitize_frame
+from date_parse import coerce_dates
+from excel_writer import EXCEL_MAX_ROWS, open_streaming_workbook, write_frame, write_companion
+from stage_timer import StageTimer
+from compact_dtypes import compact_frame, frame_memory_mb, to_nullable_number
+from row_hash import row_fingerprint, multi_source_mask
 
 # ===== 可調參數 =====
 DATE_COL_CANDIDATES = ["憑單日期", "憑單日", "憑單日期(西元)", "單據日期"]  # 統一輸出成第一個名稱
@@ -25,7 +36,30 @@ SORT_ASC = True
 DATE_FMT_DEFAULT = "yyyy/mm/dd"     # Excel 顯示格式（年月日）
 DATE_COLUMN_WIDTH = 12
 DEFAULT_COL_WIDTH = 8
-MAX_EXCEL_STRLEN = 32767
+
+# 輸出：單張工作表超過 Excel 上限時自動分頁（TOTAL、TOTAL_2、TOTAL_3 …）
+# SPLIT_BY = "sheets" → 全部寫在同一個檔案；"month" → 依憑單日期每月一個檔案 TOTAL_<時間>_<YYYYMM>.xlsx
+#   （沒有日期的列 → TOTAL_<時間>_nodate.xlsx）。各月份的 SUMMARY / DUPLICATES 只列該月份的來源與重複組，
+#   ERRORS 只寫在最新月份那份（excel_error_log.py 預設檢查的也是這份）
+SPLIT_BY = "sheets"
+MAX_ROWS_PER_SHEET = EXCEL_MAX_ROWS
+# 另外輸出給下游程式讀的副本：None / "parquet" / "csv"
+COMPANION_FORMAT = None
+
+# 合併後改用精簡型別（低基數文字 → category、金額 → Int64/Float64、日期 → datetime64），大幅降低記憶體
+COMPACT_DTYPES = True
+
+# 跨檔重複憑單（同一張憑單出現在重疊的匯出檔）
+# DEDUP_MODE：None → 不檢查；"report" → 只列在 DUPLICATES 工作表；"drop" → 每組只保留一個來源，其餘從 TOTAL 移除
+DEDUP_MODE = "report"
+# DEDUP_BY："keys" → 依業務鍵（每組候選各取第一個存在的欄位，任一組找不到就改用整列指紋）；"row" → 整列指紋
+DEDUP_BY = "keys"
+DEDUP_KEY_CANDIDATES = [
+    ["憑單單號", "憑單編號", "單據編號"],
+    ["序號", "項次", "行號"],
+]
+# DEDUP_KEEP："first" → 保留排序後最先出現的來源；"latest" → 保留修改時間最新的來源檔
+DEDUP_KEEP = "first"
 
 # 想要偵測的「正式欄位列」關鍵欄位
 HEADER_KEYS = [
@@ -40,17 +74,6 @@ HEADER_KEYS = [
     "預計兌現日",
 ]
 
-# Excel 禁用/不合法 XML 字元（保留 \t \n \r）
-ILLEGAL_RE = re.compile(
-    r"["                     # 開頭 [
-    r"\x00-\x08\x0B\x0C\x0E-\x1F"   # C0 控制字元（排除 \t \n \r）
-    r"\x7F-\x84\x86-\x9F"           # C1 控制字元
-    r"\uD800-\uDFFF"                # 代理對區段（孤立代理）
-    r"\uFDD0-\uFDEF"                # 非字元碼點區段
-    r"\uFFFE\uFFFF"                 # 非字元
-    r"]"                     # 結尾 ]
-)
-
 # ===== 基準與輸出 =====
 if getattr(sys, "frozen", False):
     # 被 PyInstaller 打包成 EXE 時，抓 EXE 本身所在資料夾
@@ -60,9 +83,6 @@ else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 OUTPUT_DIR = os.path.join(BASE_DIR, "total")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-OUTPUT_FILE = os.path.join(OUTPUT_DIR, f"TOTAL_{timestamp}.xlsx")
 
 # 自動排除的目錄 / 檔名（避免把輸出或報表再吃回去）
 EXCLUDE_DIR_NAMES = {
@@ -82,6 +102,14 @@ EXCLUDE_FILE_PATTERNS = [
     "TERMS_COMPARE_*.xlsx", # 付款條件比對報表
 ]
 
+# 解析快取：只重新解析新增 / 有變動的檔案（放在 OUTPUT_DIR 底下，不會被當成來源資料夾）
+USE_PARSE_CACHE = True
+CACHE_SUBDIR = "_cache"
+PARSER_VERSION = 4  # 解析 / 清洗邏輯有改動時 +1，讓舊快取失效
+
+# 各階段計時一律開啟；記憶體尖峰（tracemalloc）會讓寫檔慢好幾倍，預設關閉（--trace-memory 開啟）
+TRACE_MEMORY = False
+
 # ===== 基本工具 =====
 def list_immediate_subdirs(path):
     # 排除輸出目錄 & 特定資料夾
@@ -120,48 +148,21 @@ def list_excels(folder):
 
 def coerce_date_series(s: pd.Series) -> pd.Series:
     """
-    穩定日期解析：
-    1) 先把空白 / NaN 正規化
+    穩定日期解析（date_parse.coerce_dates）：
+    1) 空白 / NaN 視為缺值
     2) 日期往下填滿（ffill），處理「只有第一列有日期，下面明細空白」的情況
-    3) 依序嘗試不同日期格式與 Excel 序號
+    3) 只對不重複值依序嘗試不同日期格式、民國年與 Excel 序號，再廣播回每一列
     """
-    tmp = s.astype(str).str.strip()
-    tmp = tmp.replace({"": pd.NA, "nan": pd.NA, "NaT": pd.NA})
-
-    # 日期往下填滿
-    tmp = tmp.ffill()
-
-    dt = pd.to_datetime(tmp, errors="coerce", format="%Y/%m/%d")
-    mask = dt.isna()
-    if mask.any():
-        dt2 = pd.to_datetime(tmp[mask], errors="coerce", format="%Y-%m-%d")
-        dt.loc[mask] = dt2
-
-    mask = dt.isna() & pd.to_numeric(tmp, errors="coerce").notna()
-    if mask.any():
-        nums = pd.to_numeric(tmp[mask], errors="coerce")
-        dt2 = pd.to_datetime(nums, unit="D", origin="1899-12-30", errors="coerce")
-        dt.loc[mask] = dt2
+    return coerce_dates(s, ffill=True)
 
-    return dt.dt.floor("D")
-
-def find_latest_template():
-    candidates = glob.glob(os.path.join(OUTPUT_DIR, "TOTAL_*.xlsx"))
-    candidates = [p for p in candidates if os.path.abspath(p) != os.path.abspath(OUTPUT_FILE)]
+def find_latest_template(output_dir=OUTPUT_DIR, exclude=None):
+    candidates = glob.glob(os.path.join(output_dir, "TOTAL_*.xlsx"))
+    candidates = [p for p in candidates if not exclude or os.path.abspath(p) != os.path.abspath(exclude)]
     if not candidates:
         return None
     candidates.sort(key=lambda p: os.path.getmtime(p), reverse=True)
     return candidates[0]
 
-def _clean_cell_value(v):
-    if pd.isna(v):
-        return v
-    s = str(v)
-    s = ILLEGAL_RE.sub("", s)
-    if len(s) > MAX_EXCEL_STRLEN:
-        s = s[:MAX_EXCEL_STRLEN]
-    return s
-
 def read_template_header(template_path):
     """僅讀上一份 TOTAL 的表頭欄名（不複製樣式）。"""
     if not template_path:
@@ -180,123 +181,143 @@ def read_template_header(template_path):
         return None
 
 # ===== 依欄位名稱自動找出真正表頭列 =====
-def extract_table_from_sheet(df_raw: pd.DataFrame):
+HEADER_MIN_HITS = 3  # 至少對到 3 個就視為正式欄位列
+
+def extract_table_from_sheet(xls, sheet, df_head: pd.DataFrame):
     """
-    df_raw 是 header=None 讀進來的工作表
-    會從上往下找含有 HEADER_KEYS 的那一列作為欄位列
-    找到後，該列以下才視為資料
+    df_head 是 header=None 讀進來的工作表前 HEADER_SCAN_ROWS 列
+    會從上往下找含有 HEADER_KEYS 的那一列作為欄位列（前 N 列找不到才整張找）
+    找到後只讀該列以下、有欄名的欄位
     """
-    header_row = None
-    nrows = len(df_raw)
-
-    for i in range(nrows):
-        row = df_raw.iloc[i]
-        values = [str(v).strip() for v in row if not pd.isna(v) and str(v).strip() != ""]
-        if not values:
-            continue
-        # 計算這列裡有幾個欄位名稱命中 HEADER_KEYS
-        hit = sum(1 for key in HEADER_KEYS if key in values)
-        if hit >= 3:  # 至少對到 3 個就視為正式欄位列
-            header_row = i
-            break
-
-    if header_row is None:
-        return None
+    return extract_table(xls, sheet, df_head, HEADER_KEYS, min_hits=HEADER_MIN_HITS)
 
-    header = df_raw.iloc[header_row]
-    df = df_raw.iloc[header_row + 1:].copy()
-    df.columns = header
-
-    # 移除整列空白
-    df = df.dropna(how="all")
-
-    # 移除完全是 Unnamed 且內容全空的欄位
-    mask_keep = []
-    for col in df.columns:
-        col_str = str(col)
-        if col_str.startswith("Unnamed"):
-            if df[col].notna().any():
-                mask_keep.append(True)
-            else:
-                mask_keep.append(False)
+# ===== 單檔解析 =====
+def parse_workbook(fpath, timer=None):
+    """
+    讀一個 Excel 檔的所有工作表，回傳 [(sheet, df 或 None, error 或 None), ...]
+    df 為已抓表頭、統一日期欄、清洗過的資料（尚未附加來源資訊）
+    timer：StageTimer，記錄 read / extract header / coerce dates / clean 各階段
+    """
+    timer = timer or StageTimer()
+    results, tables = [], []
+
+    # 先只讀前幾列找表頭，找到後再讀表頭以下的資料
+    with timer.stage("read") as st:
+        xls = open_workbook(fpath)
+        if READ_ALL_SHEETS:
+            items = [(name, name) for name in xls.sheet_names]
         else:
-            mask_keep.append(True)
-    df = df.loc[:, mask_keep]
+            items = [("Sheet1", 0)]
+        heads = [(sht, ref, read_sheet_head(xls, ref)) for sht, ref in items]
+        st["rows"] = sum(len(h) for _, _, h in heads)
 
-    return df
+    try:
+        with timer.stage("extract header") as st:
+            for sht, ref, df_head in heads:
+                if df_head.empty:
+                    continue
+                tables.append((sht, extract_table_from_sheet(xls, ref, df_head)))
+            st["rows"] = sum(len(df) for _, df in tables if df is not None)
+    finally:
+        xls.close()
+
+    for sht, df in tables:
+        if df is None or df.empty:
+            results.append((sht, None, "找不到欄位列"))
+            continue
 
-# ===== 讀檔與彙整 =====
-records, file_log, errors = [], [], []
+        with timer.stage("coerce dates") as st:
+            # 找日期欄
+            date_col = next((c for c in DATE_COL_CANDIDATES if c in df.columns), None)
+            if date_col is None:
+                if len(df.columns) >= 2:
+                    date_col = df.columns[1]
+                else:
+                    continue
 
-print(f"Base dir: {BASE_DIR}")
-subdirs = list_immediate_subdirs(BASE_DIR)
-print(f"偵測子資料夾（會合併）：{subdirs}")
+            dt = coerce_date_series(df[date_col])
+            keep = dt.notna()
+            st["rows"] = len(dt)
+            if not keep.any():
+                continue
 
-for sub in subdirs:
-    subdir_path = os.path.join(BASE_DIR, sub)
-    excel_files = list_excels(subdir_path)
-    if not excel_files:
-        continue
+        with timer.stage("clean") as st:
+            df2 = df.loc[keep].copy()
 
-    for fpath in excel_files:
-        # 雙重保險：避免任何位於 OUTPUT_DIR 的檔案被吃回
-        if os.path.commonpath([os.path.abspath(fpath), os.path.abspath(OUTPUT_DIR)]) == os.path.abspath(OUTPUT_DIR):
-            continue
+            # 清洗欄名
+            df2.columns = pd.Index([clean_text(c) if c is not None else c for c in df2.columns])
 
-        try:
-            # 用 header=None 讀，讓 extract_table_from_sheet 自己找表頭列
-            if READ_ALL_SHEETS:
-                xls = pd.read_excel(fpath, sheet_name=None, header=None)
-                items = xls.items()
-            else:
-                df_raw = pd.read_excel(fpath, header=None)
-                items = [("Sheet1", df_raw)]
-
-            for sht, df_raw in items:
-                if df_raw is None or df_raw.empty:
-                    continue
+            # 統一日期欄名
+            std_date_name = DATE_COL_CANDIDATES[0]
+            df2[std_date_name] = dt[keep]
 
-                df = extract_table_from_sheet(df_raw)
-                if df is None or df.empty:
-                    errors.append({"file": f"{fpath}::{sht}", "error": "找不到欄位列"})
-                    continue
+            # 移除 Unnamed 欄
+            df2 = df2.loc[:, ~df2.columns.astype(str).str.startswith("Unnamed")]
 
-                # 找日期欄
-                date_col = next((c for c in DATE_COL_CANDIDATES if c in df.columns), None)
-                if date_col is None:
-                    if len(df.columns) >= 2:
-                        date_col = df.columns[1]
-                    else:
-                        continue
-
-                dt = coerce_date_series(df[date_col])
-                keep = dt.notna()
-                if not keep.any():
-                    continue
+            # 清洗內容（整欄向量化；先不動金額欄位，後面統一處理）
+            # 每張表只在這裡清洗一次，合併後不再重洗
+            df2 = sanitize_frame(df2, skip=AMOUNT_COL_CANDIDATES)
+            st["rows"] = len(df2)
 
-                df2 = df.loc[keep].copy()
+        results.append((sht, df2, None))
 
-                # 清洗欄名
-                df2.columns = pd.Index([_clean_cell_value(c) if c is not None else c for c in df2.columns])
+    return results
 
-                # 統一日期欄名
-                std_date_name = DATE_COL_CANDIDATES[0]
-                df2[std_date_name] = dt[keep]
+def cache_config():
+    """會影響解析結果的設定；任何一項變動都會讓快取失效。"""
+    return {
+        "parser_version": PARSER_VERSION,
+        "header_keys": HEADER_KEYS,
+        "date_cols": DATE_COL_CANDIDATES,
+        "amount_cols": AMOUNT_COL_CANDIDATES,
+        "read_all_sheets": READ_ALL_SHEETS,
+        "illegal_re": ILLEGAL_RE.pattern,
+        "max_strlen": MAX_EXCEL_STRLEN,
+    }
 
-                # 移除 Unnamed 欄
-                df2 = df2.loc[:, ~df2.columns.astype(str).str.startswith("Unnamed")]
+# ===== 讀檔與彙整 =====
+def discover_files(base_dir=BASE_DIR, output_dir=OUTPUT_DIR, subdirs=None):
+    """回傳 [(子資料夾名稱, 檔案路徑), ...]；OUTPUT_DIR 底下的檔案一律排除"""
+    out_abs = os.path.abspath(output_dir)
+    found = []
+    for sub in subdirs if subdirs is not None else list_immediate_subdirs(base_dir):
+        for fpath in list_excels(os.path.join(base_dir, sub)):
+            # 雙重保險：避免任何位於 OUTPUT_DIR 的檔案被吃回
+            if os.path.commonpath([os.path.abspath(fpath), out_abs]) == out_abs:
+                continue
+            found.append((sub, fpath))
+    return found
+
+def load_records(files, cache=None, timer=None):
+    """
+    逐檔解析（有快取就直接讀快取），回傳 (records, file_log, errors)
+    records 為各工作表 DataFrame（已附加 source_folder / source_file / sheet_name）
+    """
+    timer = timer or StageTimer()
+    records, file_log, errors = [], [], []
 
-                # 清洗內容（先不動金額欄位，後面統一處理）
-                for col in df2.columns:
-                    if col in AMOUNT_COL_CANDIDATES:
-                        continue
-                    if df2[col].dtype == "object":
-                        df2[col] = df2[col].map(_clean_cell_value)
+    for sub, fpath in files:
+        try:
+            parsed = None
+            if cache:
+                with timer.stage("cache") as st:
+                    parsed = cache.load(fpath)
+                    st["rows"] = sum(len(df) for _, df, _ in parsed or [] if df is not None)
+            if parsed is None:
+                parsed = parse_workbook(fpath, timer)
+                if cache:
+                    with timer.stage("cache"):
+                        cache.store(fpath, parsed)
+
+            for sht, df2, err in parsed:
+                if df2 is None:
+                    errors.append({"file": f"{fpath}::{sht}", "error": err})
+                    continue
 
                 # 附加來源資訊
-                df2["source_folder"] = sub
-                df2["source_file"] = os.path.basename(fpath)
-                df2["sheet_name"] = sht
+                df2["source_folder"] = clean_text(sub)
+                df2["source_file"] = clean_text(os.path.basename(fpath))
+                df2["sheet_name"] = clean_text(sht)
 
                 records.append(df2)
                 file_log.append({"folder": sub, "file": fpath, "sheet": sht, "rows": len(df2)})
@@ -304,82 +325,302 @@ for sub in subdirs:
         except Exception as e:
             errors.append({"file": fpath, "error": str(e)})
 
-# ===== 欄序對齊、排序、日期只保留年月日 =====
-template_path = find_latest_template()
-template_cols = read_template_header(template_path)
-
-if records:
-    total_df = pd.concat(records, ignore_index=True)
-
-    # 二次保險清洗（先清欄名）
-    total_df.columns = pd.Index([_clean_cell_value(c) if c is not None else c for c in total_df.columns])
-
-    # 1) 非金額欄位：清掉非法字元
-    for col in total_df.columns:
-        if col in AMOUNT_COL_CANDIDATES:
-            continue
-        if total_df[col].dtype == "object":
-            total_df[col] = total_df[col].map(_clean_cell_value)
-
-    # 2) 金額欄位：轉成數字（Excel 才會自動加總）
-    for col in AMOUNT_COL_CANDIDATES:
-        if col in total_df.columns:
-            s = total_df[col].astype(str).str.replace(",", "", regex=False).str.strip()
-            s = s.replace({"": pd.NA, "nan": pd.NA, "NaN": pd.NA})
-            total_df[col] = pd.to_numeric(s, errors="coerce")
-
-    # 欄序對齊（僅依上一份 TOTAL 的表頭順序，無樣式）
-    if template_cols:
-        if DATE_COL_CANDIDATES[0] not in total_df.columns and any(x == DATE_COL_CANDIDATES[0] for x in template_cols):
-            total_df[DATE_COL_CANDIDATES[0]] = pd.NaT
-        aligned_cols = template_cols + [c for c in total_df.columns if c not in template_cols]
-        for c in template_cols:
-            if c not in total_df.columns:
-                total_df[c] = pd.NA
-        total_df = total_df[aligned_cols]
-
-    # 排序（先依日期，再依來源：資料夾 / 檔案 / 工作表）
-    sort_cols = [DATE_COL_CANDIDATES[0]] + [
-        c for c in ["source_folder", "source_file", "sheet_name"] if c in total_df.columns
-    ]
-    total_df = total_df.sort_values(by=sort_cols, ascending=SORT_ASC).reset_index(drop=True)
-
-    # 只保留「年月日」
-    if DATE_COL_CANDIDATES[0] in total_df.columns:
-        total_df[DATE_COL_CANDIDATES[0]] = pd.to_datetime(
-            total_df[DATE_COL_CANDIDATES[0]],
-            errors="coerce"
-        ).dt.date
-else:
-    total_df = pd.DataFrame(columns=[DATE_COL_CANDIDATES[0]])
-
-# ===== 穩定輸出（XlsxWriter，一次成型）=====
-with pd.ExcelWriter(OUTPUT_FILE, engine="xlsxwriter") as writer:
-    total_df.to_excel(writer, index=False, sheet_name="TOTAL")
-    (pd.DataFrame(file_log) if file_log else pd.DataFrame(columns=["folder", "file", "sheet", "rows"])) \
-        .to_excel(writer, index=False, sheet_name="SUMMARY")
-    if errors:
-        pd.DataFrame(errors).to_excel(writer, index=False, sheet_name="ERRORS")
-
-    wb  = writer.book
-    ws  = writer.sheets["TOTAL"]
-
-    headers = list(total_df.columns)
-
-    # 基本欄寬（避免 ####）
-    ws.set_column(0, len(headers) - 1, DEFAULT_COL_WIDTH)
-
-    # 日期欄格式 + 欄寬
-    if DATE_COL_CANDIDATES[0] in headers:
-        date_col_idx0 = headers.index(DATE_COL_CANDIDATES[0])  # 0-based
-        date_fmt = wb.add_format({"num_format": DATE_FMT_DEFAULT})
-        ws.set_column(date_col_idx0, date_col_idx0, DATE_COLUMN_WIDTH, date_fmt)
+    return records, file_log, errors
 
-    # 凍結首列
-    ws.freeze_panes(1, 0)
-
-    # AutoFilter 覆蓋資料範圍（含表頭）
-    nrows, ncols = (len(total_df.index) + 1, len(headers))
-    ws.autofilter(0, 0, nrows - 1, ncols - 1)
-
-print(f"已輸出：{OUTPUT_FILE}\n（欄序來源：{template_path if template_cols else '無，直接以新資料欄序'}）")
+# ===== 欄序對齊、排序、日期只保留年月日 =====
+def build_total(records, template_cols=None, timer=None) -> pd.DataFrame:
+    timer = timer or StageTimer()
+    if not records:
+        return pd.DataFrame(columns=[DATE_COL_CANDIDATES[0]])
+
+    with timer.stage("concat") as st:
+        # 各工作表在 parse_workbook 已清洗過欄名與內容，這裡直接合併
+        total_df = pd.concat(records, ignore_index=True)
+        st["rows"] = len(total_df)
+
+    with timer.stage("clean") as st:
+        # 金額欄位：轉成數字（Excel 才會自動加總）；可為空的 Int64 / Float64
+        for col in AMOUNT_COL_CANDIDATES:
+            if col in total_df.columns:
+                s = total_df[col].astype(str).str.replace(",", "", regex=False).str.strip()
+                s = s.replace({"": pd.NA, "nan": pd.NA, "NaN": pd.NA})
+                total_df[col] = to_nullable_number(s)
+        st["rows"] = len(total_df)
+
+    with timer.stage("align") as st:
+        # 欄序對齊（僅依上一份 TOTAL 的表頭順序，無樣式）
+        if template_cols:
+            if DATE_COL_CANDIDATES[0] not in total_df.columns and any(x == DATE_COL_CANDIDATES[0] for x in template_cols):
+                total_df[DATE_COL_CANDIDATES[0]] = pd.NaT
+            aligned_cols = template_cols + [c for c in total_df.columns if c not in template_cols]
+            for c in template_cols:
+                if c not in total_df.columns:
+                    total_df[c] = pd.NA
+            total_df = total_df[aligned_cols]
+        st["rows"] = len(total_df)
+
+    if COMPACT_DTYPES:
+        with timer.stage("compact") as st:
+            # 低基數文字欄 → category、日期欄 → datetime64（排序也會變快）
+            before = frame_memory_mb(total_df)
+            total_df = compact_frame(total_df, date_cols=[DATE_COL_CANDIDATES[0]])
+            print(f"[INFO] 總表記憶體：{before:.1f} MB → 精簡型別後 {frame_memory_mb(total_df):.1f} MB")
+            st["rows"] = len(total_df)
+
+    with timer.stage("sort") as st:
+        # 排序（先依日期，再依來源：資料夾 / 檔案 / 工作表）
+        sort_cols = [DATE_COL_CANDIDATES[0]] + [
+            c for c in ["source_folder", "source_file", "sheet_name"] if c in total_df.columns
+        ]
+        total_df = total_df.sort_values(by=sort_cols, ascending=SORT_ASC).reset_index(drop=True)
+
+        # 只保留「年月日」（維持 datetime64，輸出時套 DATE_FMT_DEFAULT）
+        if DATE_COL_CANDIDATES[0] in total_df.columns:
+            total_df[DATE_COL_CANDIDATES[0]] = pd.to_datetime(
+                total_df[DATE_COL_CANDIDATES[0]],
+                errors="coerce"
+            ).dt.floor("D")
+        st["rows"] = len(total_df)
+
+    return total_df
+
+# ===== 跨檔重複偵測 =====
+SOURCE_COLS = ["source_folder", "source_file", "sheet_name"]
+
+def pick_dedup_keys(columns):
+    keys = []
+    for group in DEDUP_KEY_CANDIDATES:
+        found = next((c for c in group if c in columns), None)
+        if found is None:
+            return []
+        keys.append(found)
+    return keys
+
+def find_duplicates(total_df, file_log, timer=None):
+    """
+    以雜湊一次找出「同一鍵值出現在兩個以上來源檔」的列（同一檔內的重複不算）：
+    - 完全重複：整列內容（不含來源欄）也相同
+    - 鍵值重複：業務鍵相同但內容不同
+    業務鍵有空白的列只看整列內容（只會是完全重複）
+    回傳 (total_df, dup_df)；DEDUP_MODE="drop" 時 total_df 已移除非保留來源的列
+    """
+    timer = timer or StageTimer()
+    empty = pd.DataFrame()
+    if not DEDUP_MODE or total_df.empty or "source_file" not in total_df.columns:
+        return total_df, empty
+
+    with timer.stage("dedup") as st:
+        st["rows"] = len(total_df)
+        data_cols = [c for c in total_df.columns if c not in SOURCE_COLS]
+        keys = pick_dedup_keys(total_df.columns) if DEDUP_BY == "keys" else []
+
+        fp = row_fingerprint(total_df, data_cols)
+        if keys:
+            # 業務鍵有任一欄空白的列不以鍵值配對（空白鍵彼此雜湊相同），改用整列內容判斷
+            key_present = np.ones(len(total_df), dtype=bool)
+            for c in keys:
+                s = total_df[c]
+                key_present &= ~(s.isna() | s.astype(str).str.strip().eq("")).to_numpy()
+            key = np.where(key_present, row_fingerprint(total_df, keys), fp)
+        else:
+            key = fp
+        src_name = total_df["source_folder"].astype(str) + "/" + total_df["source_file"].astype(str)
+        src, src_names = pd.factorize(src_name)
+
+        dup = multi_source_mask(key, src)
+        if not dup.any():
+            return total_df, empty
+        exact = multi_source_mask(fp, src) & dup
+
+        # 每組選出要保留的來源
+        tmp = pd.DataFrame({"key": key, "src": src}, index=total_df.index)
+        if DEDUP_KEEP == "latest":
+            mtimes = {}
+            for item in file_log:
+                name = f"{clean_text(item['folder'])}/{clean_text(os.path.basename(item['file']))}"
+                try:
+                    mtimes[name] = os.path.getmtime(item["file"])
+                except OSError:
+                    mtimes[name] = 0.0
+            tmp["mtime"] = pd.Series(src_names).map(mtimes).fillna(0.0).to_numpy()[src]
+            order = tmp.sort_values("mtime", ascending=False, kind="stable")
+        else:
+            order = tmp
+        keeper = order.groupby("key", sort=False)["src"].transform("first").reindex(tmp.index)
+        keep = ~dup | (tmp["src"] == keeper).to_numpy()
+
+        dup_df = total_df.loc[dup].copy()
+        dup_df.insert(0, "重複群組", pd.factorize(key[dup])[0] + 1)
+        dup_df.insert(1, "重複類型", pd.Series(exact[dup], index=dup_df.index).map({True: "完全重複", False: "鍵值重複"}))
+        dup_df.insert(2, "保留", pd.Series(keep[dup], index=dup_df.index).map({True: "是", False: "否"}))
+        dup_df = dup_df.sort_values("重複群組", kind="stable").reset_index(drop=True)
+
+    basis = "、".join(keys) if keys else "整列內容"
+    print(f"[Warn] 發現跨檔重複：{dup_df['重複群組'].max()} 組 / {len(dup_df)} 列（依 {basis}，"
+          f"完全重複 {int(exact.sum())} 列）")
+    if DEDUP_MODE == "drop":
+        total_df = total_df.loc[keep].reset_index(drop=True)
+        print(f"[INFO] 已移除重複列 {int((~keep).sum())} 列（保留{'最新' if DEDUP_KEEP == 'latest' else '最先出現'}的來源）")
+    return total_df, dup_df
+
+# ===== 串流輸出（XlsxWriter constant_memory，逐列寫入）=====
+def write_total_workbook(path, df, file_log, errors, timer=None, duplicates=None):
+    """
+    TOTAL（超過上限自動分頁）→ SUMMARY（各檔列數，下方附各階段耗時）→ DUPLICATES → ERRORS
+    SUMMARY 在 TOTAL 寫完後才寫，所以耗時表中的 write 只含 TOTAL 本身
+    """
+    timer = timer or StageTimer()
+    wb = open_streaming_workbook(path, date_format=DATE_FMT_DEFAULT)
+    try:
+        with timer.stage("write") as st:
+            parts = write_frame(
+                wb, df, "TOTAL",
+                max_rows=MAX_ROWS_PER_SHEET,
+                col_width=DEFAULT_COL_WIDTH,          # 基本欄寬（避免 ####）
+                date_cols=[DATE_COL_CANDIDATES[0]],
+                date_width=DATE_COLUMN_WIDTH,
+                date_format=DATE_FMT_DEFAULT,
+                freeze_header=True,                   # 凍結首列
+                autofilter=True,                      # AutoFilter 覆蓋資料範圍（含表頭）
+            )
+            st["rows"] = len(df)
+        summary = pd.DataFrame(file_log) if file_log else pd.DataFrame(columns=["folder", "file", "sheet", "rows"])
+        write_frame(wb, summary, "SUMMARY", footer_frames=[timer.to_frame()] if timer.stages else ())
+        if duplicates is not None and not duplicates.empty:
+            write_frame(wb, duplicates, "DUPLICATES", col_width=DEFAULT_COL_WIDTH,
+                        date_cols=[DATE_COL_CANDIDATES[0]], date_width=DATE_COLUMN_WIDTH,
+                        date_format=DATE_FMT_DEFAULT, freeze_header=True, autofilter=True)
+        if errors:
+            write_frame(wb, pd.DataFrame(errors), "ERRORS")
+    finally:
+        wb.close()
+    if len(parts) > 1:
+        print(f"[INFO] 超過單張上限 {MAX_ROWS_PER_SHEET - 1} 列，已分成 {len(parts)} 張：{', '.join(n for n, _ in parts)}")
+    return parts
+
+def month_keys(df) -> pd.Series:
+    """每列的憑單月份 YYYYMM；沒有日期的列為 'nodate'"""
+    dates = pd.to_datetime(df[DATE_COL_CANDIDATES[0]], errors="coerce") \
+        if DATE_COL_CANDIDATES[0] in df.columns else pd.Series(pd.NaT, index=df.index)
+    return dates.dt.strftime("%Y%m").fillna("nodate")
+
+def split_by_month(df):
+    """依憑單日期分月；沒有日期的列歸到 'nodate'"""
+    keys = month_keys(df)
+    return [(k, df.loc[keys == k]) for k in sorted(keys.unique())]
+
+def month_file_log(df_month, file_log):
+    """SUMMARY 用：只留這個月份有資料的來源工作表，rows 改為該月份的列數"""
+    counts = df_month.groupby(SOURCE_COLS, sort=False, observed=True).size()
+    out = []
+    for item in file_log:
+        k = (clean_text(item["folder"]), clean_text(os.path.basename(item["file"])), clean_text(item["sheet"]))
+        if k in counts.index:
+            out.append({**item, "rows": int(counts[k])})
+    return out
+
+def month_duplicates(duplicates, month):
+    """DUPLICATES 用：有任一列落在這個月份的重複組（整組列出，保留 / 移除的來源一起看得到）"""
+    if duplicates is None or duplicates.empty:
+        return duplicates
+    groups = duplicates.loc[month_keys(duplicates) == month, "重複群組"]
+    return duplicates[duplicates["重複群組"].isin(groups)].reset_index(drop=True)
+
+def write_outputs(total_df, file_log, errors, output_file, timer=None, duplicates=None):
+    """依 SPLIT_BY 寫出 TOTAL（與選用的副本），回傳輸出的 xlsx 路徑清單"""
+    output_dir = os.path.dirname(output_file)
+    stem = os.path.splitext(os.path.basename(output_file))[0]
+
+    if SPLIT_BY == "month" and len(total_df):
+        output_files = []
+        months = split_by_month(total_df)
+        # 讀取失敗的檔案不屬於任何月份，ERRORS 只寫在最新月份那份（全部沒有日期時寫在 nodate）
+        dated = [m for m, _ in months if m != "nodate"]
+        main_month = max(dated) if dated else "nodate"
+        for month, df_month in months:
+            path = os.path.join(output_dir, f"{stem}_{month}.xlsx")
+            write_total_workbook(path, df_month.reset_index(drop=True), month_file_log(df_month, file_log),
+                                 errors if month == main_month else [], timer, month_duplicates(duplicates, month))
+            output_files.append(path)
+        print(f"[INFO] 依月份輸出 {len(output_files)} 個檔案")
+        if errors:
+            print(f"[INFO] 讀取失敗清單（ERRORS）寫在：{os.path.join(output_dir, f'{stem}_{main_month}.xlsx')}")
+    else:
+        output_files = [output_file]
+        write_total_workbook(output_file, total_df, file_log, errors, timer, duplicates)
+
+    if COMPANION_FORMAT:
+        companion = write_companion(total_df, output_file, COMPANION_FORMAT)
+        print(f"已輸出副本：{companion}")
+    return output_files
+
+def run_merge(base_dir=BASE_DIR, output_dir=OUTPUT_DIR, use_cache=USE_PARSE_CACHE, timer=None):
+    """
+    整個合併流程：discover → read / extract header / coerce dates / clean（逐檔，可走快取）
+    → concat → align → compact → sort → dedup → write
+    回傳 dict：total_df、output_files、file_log、errors、duplicates、template_path、timings（各階段耗時 DataFrame）
+    """
+    timer = timer or StageTimer(trace_memory=TRACE_MEMORY)
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    output_file = os.path.join(output_dir, f"TOTAL_{timestamp}.xlsx")
+
+    print(f"Base dir: {base_dir}")
+    with timer.stage("discover") as st:
+        subdirs = list_immediate_subdirs(base_dir)
+        print(f"偵測子資料夾（會合併）：{subdirs}")
+        files = discover_files(base_dir, output_dir, subdirs)
+        st["rows"] = len(files)
+
+    cache = ParseCache(os.path.join(output_dir, CACHE_SUBDIR), cache_config()) if use_cache else None
+    records, file_log, errors = load_records(files, cache, timer)
+    if cache:
+        cache.save()
+        print(f"解析快取：命中 {cache.hits} 檔，重新解析 {cache.misses} 檔")
+
+    template_path = find_latest_template(output_dir, exclude=output_file)
+    template_cols = read_template_header(template_path)
+    total_df = build_total(records, template_cols, timer)
+    total_df, duplicates = find_duplicates(total_df, file_log, timer)
+    output_files = write_outputs(total_df, file_log, errors, output_file, timer, duplicates)
+
+    print(f"已輸出：{', '.join(output_files)}\n（欄序來源：{template_path if template_cols else '無，直接以新資料欄序'}）")
+    return {
+        "total_df": total_df,
+        "output_files": output_files,
+        "file_log": file_log,
+        "errors": errors,
+        "duplicates": duplicates,
+        "template_path": template_path if template_cols else None,
+        "timings": timer.to_frame(),
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Merge voucher Excel files under BASE_DIR subfolders into total/TOTAL_*.xlsx.")
+    ap.add_argument("--profile", nargs="?", const="", default=None, metavar="PROF_FILE",
+                    help="Run under cProfile; print the top functions and save stats "
+                         "(default: total/merge_profile_<timestamp>.prof).")
+    ap.add_argument("--no-cache", action="store_true", help="Ignore the parse cache and re-read every file.")
+    ap.add_argument("--trace-memory", action="store_true",
+                    help="Measure per-stage peak memory with tracemalloc (noticeably slower).")
+    args = ap.parse_args(argv)
+
+    timer = StageTimer(trace_memory=TRACE_MEMORY or args.trace_memory)
+    use_cache = USE_PARSE_CACHE and not args.no_cache
+    try:
+        if args.profile is None:
+            run_merge(use_cache=use_cache, timer=timer)
+        else:
+            prof = cProfile.Profile()
+            prof.runcall(run_merge, use_cache=use_cache, timer=timer)
+            prof_path = args.profile or os.path.join(
+                OUTPUT_DIR, f"merge_profile_{datetime.now().strftime('%Y%m%d_%H%M')}.prof")
+            prof.dump_stats(prof_path)
+            pstats.Stats(prof).sort_stats("cumulative").print_stats(25)
+            print(f"已輸出 cProfile 結果：{prof_path}")
+    finally:
+        timer.close()
+    timer.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+監看模式：BASE_DIR 底下的子資料夾有新增 / 修改 / 刪除憑單檔時，自動重新產生 TOTAL
+
+用法：
+    python merge_watch.py [--interval 2] [--debounce 5] [--no-initial]
+
+- 掃描範圍、排除規則與 merge_all_data.py 完全相同（EXCLUDE_DIR_NAMES、EXCLUDE_FILE_PATTERNS、~$ 暫存檔）
+- 有安裝 watchdog 時用系統事件（Linux inotify / Windows ReadDirectoryChangesW）即時喚醒，
+  否則每 POLL_SECONDS 秒輪詢一次；兩種方式都以「檔案大小 + 修改時間」比對來判斷實際變動
+- merge 自己寫出的檔案（OUTPUT_DIR 底下的 TOTAL、解析快取）不會觸發事件喚醒
+- 防抖：最後一次變動後 DEBOUNCE_SECONDS 秒內沒有新變動（檔案複製完成）才合併
+- 合併走解析快取：只重新解析新增 / 變動的檔案，其餘直接讀快取
+- 待處理佇列有上限（QUEUE_SIZE）：合併還在跑時新進的變動會併成一批，不會一檔觸發一次
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+import merge_all_data as merge
+
+POLL_SECONDS = 2.0
+DEBOUNCE_SECONDS = 5.0
+QUEUE_SIZE = 1   # 最多排隊幾批（合併一次就會處理所有變動，排 1 批就夠）
+USE_WATCHDOG = True
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+
+def snapshot(base_dir=merge.BASE_DIR, output_dir=merge.OUTPUT_DIR) -> dict:
+    """目前會被合併的檔案 → (大小, 修改時間)；檔案在掃描途中被移走就略過"""
+    out = {}
+    for _, fpath in merge.discover_files(base_dir, output_dir):
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            continue
+        out[fpath] = (st.st_size, st.st_mtime_ns)
+    return out
+
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    changes = {}
+    for p in new.keys() - old.keys():
+        changes[p] = "新增"
+    for p in old.keys() - new.keys():
+        changes[p] = "刪除"
+    for p in new.keys() & old.keys():
+        if new[p] != old[p]:
+            changes[p] = "修改"
+    return changes
+
+
+class MergeWatcher:
+    def __init__(self, base_dir=merge.BASE_DIR, output_dir=merge.OUTPUT_DIR, interval=POLL_SECONDS,
+                 debounce=DEBOUNCE_SECONDS, use_watchdog=USE_WATCHDOG):
+        self.base_dir = base_dir
+        self.output_dir = output_dir
+        self.interval = interval
+        self.debounce = debounce
+        self.use_watchdog = use_watchdog and HAS_WATCHDOG
+        # 合併輸出與解析快取：每次合併都會寫入，不算來源變動
+        self.ignore_roots = [os.path.abspath(output_dir), os.path.abspath(os.path.join(output_dir, merge.CACHE_SUBDIR))]
+        self.jobs = queue.Queue(maxsize=QUEUE_SIZE)
+        self.wake = threading.Event()
+        self.stop = threading.Event()
+        self.merges = 0
+
+    # ===== 合併（背景執行緒，一次只跑一個）=====
+    def _worker(self):
+        while not self.stop.is_set():
+            try:
+                batch = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if batch is None:
+                break
+            self._merge(batch)
+
+    def _merge(self, changes):
+        if changes:
+            print(f"\n[INFO] 偵測到 {len(changes)} 個檔案變動，重新合併：")
+            for p, kind in sorted(changes.items())[:20]:
+                print(f"  {kind} {os.path.relpath(p, self.base_dir)}")
+            if len(changes) > 20:
+                print(f"  …另有 {len(changes) - 20} 個")
+        t0 = time.perf_counter()
+        try:
+            result = merge.run_merge(self.base_dir, self.output_dir, use_cache=True)
+        except Exception as e:
+            print(f"[Error] 合併失敗：{e}")
+            return
+        self.merges += 1
+        print(f"[INFO] 合併完成：{len(result['total_df'])} 列，耗時 {time.perf_counter() - t0:.1f}s")
+
+    # ===== 監看 =====
+    def _ignored(self, path) -> bool:
+        path = os.path.abspath(os.fsdecode(path))
+        return any(path == root or path.startswith(root + os.sep) for root in self.ignore_roots)
+
+    def _start_observer(self):
+        if not self.use_watchdog:
+            return None
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path] + ([event.dest_path] if getattr(event, "dest_path", "") else [])
+                if all(watcher._ignored(p) for p in paths):
+                    return
+                watcher.wake.set()
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.base_dir, recursive=True)
+        observer.start()
+        return observer
+
+    def run(self, initial=True):
+        mode = "watchdog 事件" if self.use_watchdog else f"每 {self.interval:g} 秒輪詢"
+        print(f"監看中：{self.base_dir}（{mode}，防抖 {self.debounce:g} 秒，Ctrl+C 結束）")
+
+        worker = threading.Thread(target=self._worker, daemon=True)
+        worker.start()
+        observer = self._start_observer()
+
+        known = snapshot(self.base_dir, self.output_dir)
+        if initial:
+            self.jobs.put({})
+
+        pending, last_change = {}, None
+        try:
+            while not self.stop.is_set():
+                # watchdog 有事件就提早醒來；沒有事件時仍定期輪詢（保險）
+                self.wake.wait(self.interval)
+                self.wake.clear()
+
+                current = snapshot(self.base_dir, self.output_dir)
+                changes = diff_snapshots(known, current)
+                known = current
+                if changes:
+                    for p, kind in changes.items():
+                        # 新增後又被改（還在複製中）仍算新增
+                        if not (kind == "修改" and pending.get(p) == "新增"):
+                            pending[p] = kind
+                    last_change = time.monotonic()
+
+                if not pending or time.monotonic() - last_change < self.debounce:
+                    continue
+                try:
+                    self.jobs.put_nowait(pending)
+                    pending, last_change = {}, None
+                except queue.Full:
+                    # 上一批還沒開始合併：留著，下一輪併成同一批
+                    pass
+        except KeyboardInterrupt:
+            print("\n結束監看")
+        finally:
+            self.stop.set()
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            worker.join()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Watch BASE_DIR subfolders and re-merge TOTAL when voucher files change.")
+    ap.add_argument("--interval", type=float, default=POLL_SECONDS, help="Polling interval in seconds.")
+    ap.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS,
+                    help="Seconds without further changes before merging.")
+    ap.add_argument("--no-initial", action="store_true", help="Do not merge once at startup.")
+    ap.add_argument("--no-watchdog", action="store_true", help="Always poll, even if watchdog is installed.")
+    args = ap.parse_args()
+
+    watcher = MergeWatcher(interval=args.interval, debounce=args.debounce, use_watchdog=not args.no_watchdog)
+    watcher.run(initial=not args.no_initial)
+
+
+if __name__ == "__main__":
+    main()
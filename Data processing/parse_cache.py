@@ -0,0 +1,171 @@
+"""
+單檔解析快取（給 merge_all_data.py 用）
+
+- 每個來源檔以「路徑 + 大小 + 修改時間 + 內容雜湊」當指紋
+- 每張工作表清洗、抓表頭後的結果存成 Parquet（無 pyarrow 或欄位型別不相容時改用 pickle）
+- 清洗設定（HEADER_KEYS 等）變動時，整個快取自動失效
+"""
+import os
+import json
+import shutil
+import hashlib
+import pandas as pd
+
+INDEX_NAME = "index.json"
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def _sha1_file(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_fingerprint(path, prev=None) -> dict:
+    """
+    回傳檔案指紋。
+    大小與修改時間都和 prev 相同時沿用舊雜湊，不重讀檔案內容。
+    """
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if prev and prev.get("size") == fp["size"] and prev.get("mtime_ns") == fp["mtime_ns"] and prev.get("sha1"):
+        fp["sha1"] = prev["sha1"]
+    else:
+        fp["sha1"] = _sha1_file(path)
+    return fp
+
+
+def config_digest(config: dict) -> str:
+    raw = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def save_frame(df: pd.DataFrame, base: str) -> str:
+    """
+    存 DataFrame 到 base + .parquet，回傳檔名（不含資料夾）；解析快取、比對快照、付款日檢查狀態共用。
+    優先寫 Parquet；欄名非字串、同欄混型別等 pyarrow 不收的情況退回 pickle（base + .pkl）。
+    """
+    if HAS_PARQUET:
+        path = base + ".parquet"
+        try:
+            df.to_parquet(path, index=False)
+            return os.path.basename(path)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+    path = base + ".pkl"
+    df.to_pickle(path)
+    return os.path.basename(path)
+
+
+def load_frame(path: str) -> pd.DataFrame:
+    """讀回 save_frame 存的檔案（依副檔名判斷格式）"""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+class ParseCache:
+    """
+    快取目錄結構：
+        <cache_dir>/<設定雜湊>/index.json
+        <cache_dir>/<設定雜湊>/<內容雜湊>_<n>.parquet|.pkl
+
+    index.json：
+        "paths" : 絕對路徑 → 上次看到的指紋（省下重算雜湊）
+        "files" : 內容雜湊 → 各工作表結果 [{"sheet", "data" 或 "error"}]
+    """
+
+    def __init__(self, cache_dir: str, config: dict):
+        self.digest = config_digest(config)
+        self.root = os.path.join(cache_dir, self.digest)
+        os.makedirs(self.root, exist_ok=True)
+
+        # 設定已變更的舊快取直接清掉
+        for d in os.listdir(cache_dir):
+            full = os.path.join(cache_dir, d)
+            if d != self.digest and os.path.isdir(full):
+                shutil.rmtree(full, ignore_errors=True)
+
+        self.index = {"paths": {}, "files": {}}
+        index_path = os.path.join(self.root, INDEX_NAME)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, encoding="utf-8") as f:
+                    self.index = json.load(f)
+            except Exception:
+                pass
+        self.hits = 0
+        self.misses = 0
+        self._seen = {}
+
+    def fingerprint(self, path) -> dict:
+        key = os.path.abspath(path)
+        fp = file_fingerprint(path, self.index["paths"].get(key))
+        self._seen[key] = fp
+        return fp
+
+    def load(self, path):
+        """
+        命中時回傳 [(sheet, df 或 None, error 或 None), ...]；未命中回傳 None
+        """
+        fp = self.fingerprint(path)
+        entry = self.index["files"].get(fp["sha1"])
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            results = []
+            for item in entry:
+                if item.get("data"):
+                    results.append((item["sheet"], load_frame(os.path.join(self.root, item["data"])), None))
+                else:
+                    results.append((item["sheet"], None, item.get("error")))
+        except Exception:
+            # 快取檔缺損：當作沒命中，重新解析
+            self.index["files"].pop(fp["sha1"], None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return results
+
+    def store(self, path, results):
+        fp = self._seen.get(os.path.abspath(path)) or self.fingerprint(path)
+        entry = []
+        for n, (sheet, df, error) in enumerate(results):
+            if df is not None:
+                name = save_frame(df, os.path.join(self.root, f"{fp['sha1']}_{n}"))
+                entry.append({"sheet": sheet, "data": name})
+            else:
+                entry.append({"sheet": sheet, "error": error})
+        self.index["files"][fp["sha1"]] = entry
+
+    def save(self):
+        """
+        寫回 index；只保留本次有看到的檔案，其餘（已刪除 / 已變更的舊版本）連同資料檔一起清掉。
+        """
+        live = {fp["sha1"] for fp in self._seen.values()}
+        self.index["paths"] = dict(self._seen)
+        self.index["files"] = {k: v for k, v in self.index["files"].items() if k in live}
+
+        keep = {INDEX_NAME}
+        for entry in self.index["files"].values():
+            keep.update(item["data"] for item in entry if item.get("data"))
+        for name in os.listdir(self.root):
+            if name not in keep:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+
+        tmp = os.path.join(self.root, INDEX_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, INDEX_NAME))
@@ -0,0 +1,141 @@
+"""
+付款日檢查的增量狀態（excel_error_log.py 使用）
+
+上次檢查的每一列結果存在 compare/_state/，每個 TOTAL 系列一份（檔名去掉 _YYYYMMDD_HHMM 時間戳，見 state_key）：
+
+    pay_state_<系列>.json           # 中繼資料：狀態版本、規則指紋、來源檔、列數、建立時間
+    pay_state_<系列>.parquet|.pkl   # 整列雜湊、key 雜湊 → 系統預計付款日、計算依據、規則種類、是否不一致
+
+- 整列雜湊 = key 欄 + 單據日期 + 付款條件 + 預計付款日 + 廠商簡稱 / 代號（正規化後的值），輸入相同結果必定相同，直接沿用
+- key 雜湊用來判斷同一張憑單上次是否不一致（新不一致 / 已解決）
+- 規則表、假日檔內容或 STATE_VERSION 變動時，舊狀態自動失效（全部重算一次）
+"""
+import os
+import re
+import json
+import hashlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from parse_cache import save_frame, load_frame
+from row_hash import row_fingerprint
+
+STATE_VERSION = 1           # 雜湊欄位或規則計算方式有變動時 +1
+STATE_NAME = "pay_state"
+STAMP_PATTERN = re.compile(r"_\d{8}_\d{4}")   # TOTAL 檔名裡的時間戳
+ROW_HASH_COL = "__row_hash"
+KEY_HASH_COL = "__key_hash"
+RESULT_COLS = ["系統預計付款日", "計算依據", "規則種類", "不一致"]
+
+# 狀態欄的值
+STATUS_UNCHANGED = "未變動"
+STATUS_NEW_MISMATCH = "新不一致"
+STATUS_RESOLVED = "已解決"
+STATUS_CHANGED = "新增或變動"
+
+
+def rules_fingerprint(paths) -> str:
+    """規則相關檔案（規則表、假日檔）的內容雜湊；None（例如沒有假日檔）或不存在的檔案以空內容計"""
+    h = hashlib.sha1(f"v{STATE_VERSION}".encode())
+    for p in paths:
+        h.update(os.path.basename(p or "-").encode())
+        if p and os.path.exists(p):
+            with open(p, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def state_key(source) -> str:
+    """
+    來源檔 → 狀態檔名用的系列名稱：檔名去掉時間戳（TOTAL_20240601_1200.xlsx → TOTAL、
+    按月分檔的 TOTAL_20240601_1200_202405.xlsx → TOTAL_202405）。
+    同一系列每天的新 TOTAL 沿用上一份的狀態；其他檔案、不同月份各自一份，不會互相覆蓋。
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return STAMP_PATTERN.sub("", stem, count=1) or stem
+
+
+def _text(s: pd.Series) -> pd.Series:
+    return s.astype(str).str.strip()
+
+
+def input_hashes(key_cols, doc_dates, terms, plan_dates, vendor_cols=()):
+    """
+    回傳 (整列雜湊, key 雜湊)；key_cols / vendor_cols 為 Series 的 list（沒有 key 時 key 雜湊 = 整列雜湊）。
+    文字一律轉字串去空白、日期用解析後的 datetime64，與讀檔方式無關。
+    """
+    keys = pd.DataFrame({f"k{i}": _text(s) for i, s in enumerate(key_cols)}, index=doc_dates.index)
+    row = keys.assign(doc=doc_dates, term=_text(terms), plan=plan_dates,
+                      **{f"v{i}": _text(s) for i, s in enumerate(vendor_cols)})
+    row_h = row_fingerprint(row)
+    key_h = row_fingerprint(keys) if key_cols else row_h
+    return row_h, key_h
+
+
+class CheckState:
+    def __init__(self, root, source):
+        self.root = root
+        self.name = f"{STATE_NAME}_{state_key(source)}"
+        self.meta_path = os.path.join(root, self.name + ".json")
+
+    def load(self, fingerprint):
+        """上次的狀態（DataFrame）；沒有、已損毀或規則已變動時回傳 None"""
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != STATE_VERSION or meta.get("fingerprint") != fingerprint:
+                print("[INFO] 規則表或假日檔已變動，全部重新檢查")
+                return None
+            return load_frame(os.path.join(self.root, meta["data"]))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, row_h, key_h, results: pd.DataFrame, fingerprint, source):
+        os.makedirs(self.root, exist_ok=True)
+        frame = results[RESULT_COLS].reset_index(drop=True).copy()
+        frame.insert(0, KEY_HASH_COL, key_h)
+        frame.insert(0, ROW_HASH_COL, row_h)
+        # 相同輸入的列結果相同，只留一份
+        frame = frame.drop_duplicates([ROW_HASH_COL, KEY_HASH_COL])
+        for old in (self.name + ".parquet", self.name + ".pkl"):
+            if os.path.exists(os.path.join(self.root, old)):
+                os.remove(os.path.join(self.root, old))
+        data = save_frame(frame, os.path.join(self.root, self.name))
+        meta = {
+            "version": STATE_VERSION,
+            "fingerprint": fingerprint,
+            "source": os.path.abspath(source),
+            "rows": int(len(frame)),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "data": data,
+        }
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.meta_path)
+
+
+def reuse_results(prev: pd.DataFrame, row_h: np.ndarray):
+    """
+    回傳 (可沿用的列 mask, 沿用列的結果 DataFrame（依 mask 順序）)；prev 為 None 時全部需要重算
+    """
+    if prev is None or prev.empty:
+        return np.zeros(len(row_h), dtype=bool), pd.DataFrame(columns=RESULT_COLS)
+    by_hash = prev.drop_duplicates(ROW_HASH_COL).set_index(ROW_HASH_COL)[RESULT_COLS]
+    hit = np.isin(row_h, by_hash.index.to_numpy())
+    return hit, by_hash.loc[row_h[hit]].reset_index(drop=True)
+
+
+def status_column(prev, key_h, reused, mismatch) -> np.ndarray:
+    """
+    沿用的列 → 未變動；重算的列：現在不一致且上次不是 → 新不一致、上次不一致現在一致 → 已解決、其餘 → 新增或變動
+    """
+    if prev is None or prev.empty:
+        was_bad = np.zeros(len(key_h), dtype=bool)
+    else:
+        was_bad = np.isin(key_h, prev.loc[prev["不一致"].astype(bool), KEY_HASH_COL].to_numpy())
+    return np.select(
+        [reused, mismatch & ~was_bad, ~mismatch & was_bad],
+        [STATUS_UNCHANGED, STATUS_NEW_MISMATCH, STATUS_RESOLVED],
+        STATUS_CHANGED,
+    ).astype(object)
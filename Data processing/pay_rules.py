@@ -0,0 +1,272 @@
+"""
+預計付款日規則（excel_error_log.py 使用）
+
+- 規則寫在設定檔（預設 pay_rules.json）：付款條件名稱或正規表示式 → 規則種類與參數，可限定廠商 / 廠商代號；
+  新增付款條件（例如 月結90天）只要改設定檔
+- 載入時編譯成查表：{正規化條件名稱: 規則}，分「廠商代號 / 廠商 / 不限」三層，查詢為 O(1)；
+  pattern 規則每個不重複的條件名稱只比對一次（結果快取）
+- 每個不重複的（付款條件, 廠商, 廠商代號）組合只查一次 → TermRule，
+  再依規則參數以 datetime64 陣列一次算出整欄預計付款日（月份運算用 datetime64[M]），不逐列呼叫 Python 函式
+- 遇假日的調整：每條規則可設 shift（biz_calendar.SHIFT_POLICIES），依營業日行事曆的查表陣列整批調整
+- 相差天數整欄相減
+
+優先序：廠商代號限定 > 廠商限定 > 不限廠商；同一層內 term 完全相符 > pattern（依檔案順序）。
+都對不上的條件列為未支援，並由 unmatched_terms 彙總回報。
+"""
+import re
+import json
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from biz_calendar import SHIFT_POLICIES
+
+RULE_TYPES = ("skip", "day", "month_end", "unsupported")
+BLANK_REASON = "無單據日期或付款條件空白"
+DEFAULT_UNMATCHED_REASON = "未支援（付款條件不在規則表）"
+SHIFT_NOTES = {
+    "following": "（遇假日順延）",
+    "preceding": "（遇假日提前）",
+    "modified_following": "（遇假日調整）",
+    "modified_preceding": "（遇假日調整）",
+}
+
+
+class TermRule(NamedTuple):
+    """
+    kind：skip / day（單據月份 + months 個月的 day 日）/ month_end（單據月份 + months 個月的月底）/ unsupported
+    cutoff > 0 時，單據日 > cutoff 再順延一個月（例如 當月18號付款）
+    shift：算出的日期不是營業日時的調整方式（biz_calendar.SHIFT_POLICIES）
+    """
+    kind: str
+    months: int = 0
+    day: int = 0
+    cutoff: int = 0
+    reason: str = ""
+    late_reason: str = ""   # cutoff：單據日 > cutoff 時的計算依據
+    shift: str = "none"
+
+
+def normalize_term(term) -> str:
+    """規則比對用的條件名稱：去頭尾與中間半形空白"""
+    return str(term).strip().replace(" ", "")
+
+
+# ========= 規則表 =========
+class _Rule:
+    """設定檔裡的一條規則（已檢查、已編譯）"""
+
+    def __init__(self, spec: dict, no: int, default_shift="none"):
+        self.no = no
+        self.kind = spec.get("type")
+        if self.kind not in RULE_TYPES:
+            raise ValueError(f"付款條件規則第 {no} 條：type 應為 {'/'.join(RULE_TYPES)}：{spec}")
+        terms = spec.get("terms") or ([spec["term"]] if "term" in spec else [])
+        self.terms = [normalize_term(t) for t in terms]
+        self.pattern = re.compile(spec["pattern"]) if spec.get("pattern") else None
+        if bool(self.terms) == bool(self.pattern):
+            raise ValueError(f"付款條件規則第 {no} 條：term(s) 與 pattern 需擇一：{spec}")
+        self.vendor = str(spec["vendor"]).strip() if spec.get("vendor") else None
+        self.vendor_code = str(spec["vendor_code"]).strip() if spec.get("vendor_code") else None
+        self.months = int(spec.get("months", 0))
+        self.day = int(spec.get("day", 0))
+        self.cutoff = int(spec.get("cutoff", 0))
+        self.series = spec.get("series")
+        self.reason = spec.get("reason", "")
+        self.late_reason = spec.get("late_reason", "")
+        if self.kind == "day" and not 1 <= self.day <= 31:
+            raise ValueError(f"付款條件規則第 {no} 條：day 應為 1~31：{spec}")
+        self.shift = spec.get("shift", default_shift)
+        if self.shift not in SHIFT_POLICIES:
+            raise ValueError(f"付款條件規則第 {no} 條：shift 應為 {'/'.join(SHIFT_POLICIES)}：{spec}")
+
+    def build(self, params=None):
+        """依比對到的參數產生 TermRule；series 條件不符時回傳 None（交給下一條規則）"""
+        params = {k: int(v) if v.isdigit() else v for k, v in (params or {}).items()}
+        months = self.months
+        if self.series:
+            v = params.get(self.series["param"])
+            start, step = self.series.get("start", 0), self.series.get("step", 1)
+            if not isinstance(v, int) or v < start or (v - start) % step:
+                return None
+            months = self.series.get("months", 0) + (v - start) // step
+        fields = {**params, "months": months, "day": self.day}
+        return TermRule(self.kind, months, self.day, self.cutoff,
+                        self.reason.format(**fields), self.late_reason.format(**fields), self.shift)
+
+
+class RuleTable:
+    """
+    編譯後的規則表。lookup(條件, 廠商, 廠商代號) → TermRule；結果依（正規化條件, 廠商, 廠商代號）快取。
+    """
+
+    def __init__(self, rules, unmatched_reason=DEFAULT_UNMATCHED_REASON, default_shift="none"):
+        if default_shift not in SHIFT_POLICIES:
+            raise ValueError(f"付款條件規則表：shift 應為 {'/'.join(SHIFT_POLICIES)}：{default_shift}")
+        self.unmatched = TermRule("unsupported", reason=unmatched_reason)
+        # 三層查表：(範圍種類, 範圍值) → {條件: 規則}、[pattern 規則]
+        self._exact = {}
+        self._patterns = {}
+        self.shifts = set()     # 有用到的假日調整方式（只有 none 時不需要行事曆）
+        for i, spec in enumerate(rules, 1):
+            rule = _Rule(spec, i, default_shift)
+            self.shifts.add(rule.shift)
+            scope = ("code", rule.vendor_code) if rule.vendor_code else (("vendor", rule.vendor) if rule.vendor else ("any", None))
+            if rule.pattern is not None:
+                self._patterns.setdefault(scope, []).append(rule)
+            for t in rule.terms:
+                # 同一範圍重複定義時以先出現的為準
+                self._exact.setdefault(scope, {}).setdefault(t, rule)
+        self._cache = {}
+        self.source = None      # 從檔案載入時為規則表路徑（增量檢查的規則指紋用）
+
+    @classmethod
+    def load(cls, path) -> "RuleTable":
+        with open(path, encoding="utf-8") as f:
+            conf = json.load(f)
+        table = cls(conf.get("rules", []), conf.get("unmatched_reason", DEFAULT_UNMATCHED_REASON),
+                    conf.get("shift", "none"))
+        table.source = path
+        return table
+
+    @property
+    def needs_calendar(self) -> bool:
+        return bool(self.shifts - {"none"})
+
+    def _match_scope(self, scope, t):
+        rule = self._exact.get(scope, {}).get(t)
+        if rule is not None:
+            built = rule.build()
+            if built is not None:
+                return built
+        for rule in self._patterns.get(scope, ()):
+            m = rule.pattern.fullmatch(t)
+            if m:
+                built = rule.build(m.groupdict())
+                if built is not None:
+                    return built
+        return None
+
+    def lookup(self, term, vendor="", vendor_code="") -> TermRule:
+        t = normalize_term(term)
+        vendor, vendor_code = str(vendor).strip(), str(vendor_code).strip()
+        key = (t, vendor, vendor_code)
+        if key not in self._cache:
+            rule = None
+            for scope in (("code", vendor_code), ("vendor", vendor), ("any", None)):
+                if scope[0] == "any" or scope in self._exact or scope in self._patterns:
+                    rule = self._match_scope(scope, t)
+                    if rule is not None:
+                        break
+            self._cache[key] = rule or self.unmatched
+        return self._cache[key]
+
+    def scope_values(self, level) -> set:
+        """規則表裡出現過的廠商（level="vendor"）或廠商代號（level="code"）"""
+        return {v for lv, v in list(self._exact) + list(self._patterns) if lv == level}
+
+
+# ========= 向量化日期運算 =========
+def month_day(doc: np.ndarray, months_ahead, day) -> np.ndarray:
+    """
+    單據月份 + months_ahead 個月的 day 日（doc 為 datetime64[D]，參數可為純量或同長度陣列）；
+    day 超過該月天數時取月底
+    """
+    months = doc.astype("datetime64[M]") + np.asarray(months_ahead, dtype=np.int64)
+    out = months.astype("datetime64[D]") + (np.asarray(day, dtype=np.int64) - 1)
+    return np.minimum(out, (months + 1).astype("datetime64[D]") - 1)
+
+
+def month_end(doc: np.ndarray, months_ahead) -> np.ndarray:
+    """單據月份 + months_ahead 個月的月底"""
+    months = doc.astype("datetime64[M]") + np.asarray(months_ahead, dtype=np.int64) + 1
+    return months.astype("datetime64[D]") - 1
+
+
+def _empty_like(s: pd.Series) -> pd.Series:
+    return pd.Series("", index=s.index, dtype=object)
+
+
+def expected_pay_dates(doc_dates: pd.Series, terms: pd.Series, table: RuleTable, vendors=None, vendor_codes=None,
+                       calendar=None):
+    """
+    doc_dates：單據日期（datetime64，只有年月日）；terms：付款條件名稱（字串）；
+    vendors / vendor_codes：廠商簡稱 / 廠商代號（沒有該欄時給 None）
+    calendar：biz_calendar.BusinessCalendar，規則有設 shift 時用來調整非營業日（None 時不調整）
+    回傳 (預計付款日 datetime64 Series, 計算依據 Series, 規則種類 Series)；
+    規則種類為 skip / day / month_end / unsupported，缺單據日期或條件空白為 blank
+    """
+    term_s = terms.astype(str)
+    # 規則表沒提到的廠商 / 代號一律視為空白，分組數最多為 條件數 ×（限定廠商數 + 1）×（限定代號數 + 1）
+    scoped = []
+    for s, level in ((vendors, "vendor"), (vendor_codes, "code")):
+        values = table.scope_values(level)
+        if s is None or not values:
+            scoped.append(_empty_like(terms))
+        else:
+            s = s.astype(str).str.strip()
+            scoped.append(s.where(s.isin(values), ""))
+    if any(s.ne("").any() for s in scoped):
+        codes, uniques = pd.factorize(pd.MultiIndex.from_arrays([term_s] + scoped))
+        rules = [table.lookup(*u) for u in uniques]
+    else:
+        codes, uniques = pd.factorize(term_s.to_numpy(dtype=object))
+        rules = [table.lookup(u) for u in uniques]
+
+    # 每個不重複組合的參數 → 依代碼展開成整欄
+    kind = np.array([r.kind for r in rules], dtype=object)[codes]
+    months = np.array([r.months for r in rules], dtype=np.int64)[codes]
+    day = np.array([r.day for r in rules], dtype=np.int64)[codes]
+    cutoff = np.array([r.cutoff for r in rules], dtype=np.int64)[codes]
+    shift = np.array([r.shift for r in rules], dtype=object)[codes]
+    reason = np.array([r.reason for r in rules], dtype=object)[codes]
+    late_reason = np.array([r.late_reason for r in rules], dtype=object)[codes]
+
+    doc = doc_dates.to_numpy(dtype="datetime64[D]")
+    has_doc = ~np.isnat(doc)
+    blank = ~has_doc | (term_s.to_numpy() == "")
+    safe_doc = np.where(has_doc, doc, np.datetime64("2000-01-01"))
+
+    # cutoff：單據日超過 cutoff 時順延一個月
+    doc_day = (safe_doc - safe_doc.astype("datetime64[M]")).astype(np.int64) + 1
+    late = (cutoff > 0) & (doc_day > cutoff)
+    months = months + late
+
+    out = np.full(len(doc), np.datetime64("NaT"), dtype="datetime64[D]")
+    by_day = (kind == "day") & ~blank
+    by_end = (kind == "month_end") & ~blank
+    out[by_day] = month_day(safe_doc[by_day], months[by_day], day[by_day])
+    out[by_end] = month_end(safe_doc[by_end], months[by_end])
+
+    reason = np.where(late, late_reason, reason)
+
+    # 假日調整：同一種調整方式的列一起查表
+    if calendar is not None:
+        for policy in set(shift[by_day | by_end]) - {"none"}:
+            m = (shift == policy) & (by_day | by_end)
+            moved = calendar.shift(out[m], policy)
+            changed = np.flatnonzero(m)[moved != out[m]]
+            out[m] = moved
+            reason[changed] = reason[changed] + SHIFT_NOTES[policy]
+
+    reason[blank] = BLANK_REASON
+    kind = kind.copy()
+    kind[blank] = "blank"
+    idx = doc_dates.index
+    return (pd.Series(out.astype("datetime64[ns]"), index=idx),
+            pd.Series(reason, index=idx, dtype=object),
+            pd.Series(kind, index=idx, dtype=object))
+
+
+def unmatched_terms(terms: pd.Series, kinds: pd.Series, reasons: pd.Series) -> pd.DataFrame:
+    """未支援的付款條件彙總：付款條件名稱、計算依據、筆數（多的在前）"""
+    mask = kinds.eq("unsupported")
+    if not mask.any():
+        return pd.DataFrame(columns=["付款條件名稱", "計算依據", "筆數"])
+    return (pd.DataFrame({"付款條件名稱": terms[mask].astype(str).str.strip(), "計算依據": reasons[mask]})
+              .groupby(["付款條件名稱", "計算依據"], sort=False).size().reset_index(name="筆數")
+              .sort_values("筆數", ascending=False, kind="stable").reset_index(drop=True))
+
+
+def day_diff(plan: pd.Series, expected: pd.Series) -> pd.Series:
+    """預計付款日 - 系統預計付款日（天）；任一邊空白為 NA"""
+    return (plan - expected).dt.days.astype("Int64")
@@ -0,0 +1,24 @@
+"""
+整列 / 指定欄位的 64-bit 雜湊（pandas hash_pandas_object，整欄向量化）
+
+- 欄位順序有影響，index 不算
+- 空值（None / NaN / pd.NA）雜湊相同；category 欄與同內容的文字欄雜湊相同
+- 物件欄會先轉成字串再雜湊，所以數字 1 與字串 "1" 視為相同
+"""
+import numpy as np
+import pandas as pd
+
+
+def row_fingerprint(df: pd.DataFrame, cols=None) -> np.ndarray:
+    """回傳每列的 uint64 雜湊；cols 為 None 時用全部欄位"""
+    sub = df if cols is None else df.loc[:, list(cols)]
+    if sub.shape[1] == 0:
+        return np.zeros(len(df), dtype=np.uint64)
+    return pd.util.hash_pandas_object(sub, index=False).to_numpy()
+
+
+def multi_source_mask(hashes: np.ndarray, sources: np.ndarray) -> np.ndarray:
+    """同一個雜湊值出現在兩個以上不同來源（sources 為來源代碼）的列 → True"""
+    pairs = pd.DataFrame({"h": hashes, "src": sources}).drop_duplicates()
+    n_src = pairs["h"].value_counts()
+    return pd.Series(hashes).map(n_src).to_numpy() > 1
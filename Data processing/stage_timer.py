@@ -0,0 +1,71 @@
+"""
+流程各階段計時（含列數與記憶體尖峰）
+
+用法：
+    timer = StageTimer(trace_memory=True)
+    with timer.stage("concat") as st:
+        total_df = pd.concat(records)
+        st["rows"] = len(total_df)
+    timer.report()
+
+- 同名階段可進入多次（例如每個檔案各讀一次），時間與列數累加、記憶體取最大值
+- trace_memory=True 時以 tracemalloc 量測（pandas / numpy 的配置也算在內），
+  每次進入階段前重設尖峰；會讓程式變慢一些，只在需要時開啟
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+MB = 1024 * 1024
+
+
+class StageTimer:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}  # 名稱 → {"seconds", "rows", "calls", "peak_mb"}，依第一次進入的順序
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """yield 一個 dict，呼叫端可設定 st["rows"] 為本階段處理的列數"""
+        rec = self.stages.setdefault(name, {"seconds": 0.0, "rows": 0, "calls": 0, "peak_mb": None})
+        st = {"rows": 0}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield st
+        finally:
+            rec["seconds"] += time.perf_counter() - t0
+            rec["calls"] += 1
+            rec["rows"] += st["rows"] or 0
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] / MB
+                rec["peak_mb"] = peak if rec["peak_mb"] is None else max(rec["peak_mb"], peak)
+
+    def to_frame(self) -> pd.DataFrame:
+        rows = [
+            {"stage": name, "seconds": round(r["seconds"], 3), "rows": r["rows"], "calls": r["calls"],
+             "peak_mb": None if r["peak_mb"] is None else round(r["peak_mb"], 1)}
+            for name, r in self.stages.items()
+        ]
+        return pd.DataFrame(rows, columns=["stage", "seconds", "rows", "calls", "peak_mb"])
+
+    def total_seconds(self) -> float:
+        return sum(r["seconds"] for r in self.stages.values())
+
+    def report(self, title="各階段耗時"):
+        print(f"\n==== {title} ====")
+        for name, r in self.stages.items():
+            mem = "" if r["peak_mb"] is None else f"   尖峰 {r['peak_mb']:8.1f} MB"
+            print(f"{name:<16} {r['seconds']:8.3f}s   {r['rows']:>10} 列   {r['calls']:>5} 次{mem}")
+        print(f"{'合計':<14} {self.total_seconds():8.3f}s")